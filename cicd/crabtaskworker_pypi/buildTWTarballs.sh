@@ -75,6 +75,8 @@ zip -rq "${STARTDIR}/CRAB3.zip" . -x  \*.pyc || exit 3
 popd
 
 cp -r "${CRABSERVERDIR}/scripts/job_wrapper" .
+# job wrapper reads the lumis and input files of the job with this
+cp "${CRABSERVERDIR}/src/python/IndexedArchive.py" job_wrapper/
 cp -r "${CRABSERVERDIR}/scripts/dagman" .
 
 #cp "${CRABSERVERDIR}/src/python"/{ServerUtilities.py,RucioUtils.py,CMSGroupMapper.py,RESTInteractions.py} .
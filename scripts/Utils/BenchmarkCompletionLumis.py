@@ -0,0 +1,136 @@
+"""
+Compare the time to compute the lumis of the completion jobs of a tail stage
+the way PreDAG did it before (extract job_lumis_<id>.json of each failed job from
+run_and_lumis.tar.gz and sum LumiList objects one at a time) with
+PreDAG.adjustLumisForCompletion, reading from the indexed archive and from the
+legacy tarball.
+
+run with (in an environment where TaskWorker.Actions.PreDAG can be imported,
+e.g. a TaskWorker container or a schedd with CRAB3.zip/WMCore.zip in PYTHONPATH):
+
+python3 BenchmarkCompletionLumis.py --jobs 3000 --failed 20
+
+A synthetic spool directory is created in a temporary directory and removed at the end.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import tarfile
+import argparse
+import tempfile
+from ast import literal_eval
+
+from WMCore.DataStructs.LumiList import LumiList
+
+from IndexedArchive import appendToArchive, JOB_INPUTS_ARCHIVE, INDEX_SUFFIX
+from TaskWorker.Actions.PreDAG import PreDAG
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--jobs",
+  help="number of jobs of the task",
+  type=int,
+  default=3000)
+parser.add_argument("--failed",
+  help="number of failed jobs to process in the tail stage",
+  type=int,
+  default=20)
+parser.add_argument("--missing",
+  help="number of jobs which reported missing lumis",
+  type=int,
+  default=300)
+args = parser.parse_args()
+
+
+def makeJobLumis(rng, nRuns=5):
+    """ a compact list like the job_lumis_<id>.json written by DagmanCreator """
+    compactList = {}
+    for run in rng.sample(range(1, 50), nRuns):
+        first = rng.randint(1, 2000)
+        pairs = []
+        for _ in range(rng.randint(1, 4)):
+            last = first + rng.randint(0, 20)
+            pairs.append([first, last])
+            first = last + rng.randint(1, 5)
+        compactList[str(run)] = pairs
+    return compactList
+
+
+def makeSpool(rng):
+    """ job lumis in both run_and_lumis.tar.gz and the indexed archive, and the missing lumis files """
+    members = [(f"job_lumis_{jobId}.json", json.dumps(makeJobLumis(rng))) for jobId in range(1, args.jobs + 1)]
+    with tarfile.open('run_and_lumis.tar.gz', 'w:gz') as tf:
+        for name, content in members:
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+    appendToArchive(JOB_INPUTS_ARCHIVE, members)
+    missingDir = 'automatic_splitting/missing_lumis/'
+    os.makedirs(missingDir)
+    for jobId in rng.sample(range(1, args.jobs + 1), args.missing):
+        with open(os.path.join(missingDir, str(jobId)), 'w', encoding='utf-8') as fd:
+            fd.write(str(makeJobLumis(rng, nRuns=2)))
+
+
+def oldMissingLumis(failed, unprocessed):
+    """ the way PreDAG.adjustLumisForCompletion used to do it """
+    missingDir = "automatic_splitting/missing_lumis/"
+    missing = LumiList()
+    for missingFile in set(os.listdir(missingDir)) & unprocessed:
+        with open(os.path.join(missingDir, missingFile), 'r', encoding='utf-8') as fd:
+            missing = missing + LumiList(compactList=literal_eval(fd.read()))
+    for failedId in failed:
+        tmpdir = tempfile.mkdtemp()
+        with tarfile.open('run_and_lumis.tar.gz') as f:
+            fn = f"job_lumis_{failedId}.json"
+            f.extract(fn, path=tmpdir)
+            with open(os.path.join(tmpdir, fn), 'r', encoding='utf-8') as fd:
+                missing = missing + LumiList(compactList=json.load(fd))
+        shutil.rmtree(tmpdir)
+    return missing
+
+
+def timeIt(name, func):
+    """ run func, print and return its result """
+    start = time.perf_counter()
+    result = func()
+    print(f"{name:>24}: {time.perf_counter() - start:.2f}s")
+    return result
+
+
+def main():
+    """ time the old and the new way in a synthetic spool directory """
+    rng = random.Random(12345)
+    spool = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(spool)
+        makeSpool(rng)
+        failed = [str(jobId) for jobId in rng.sample(range(1, args.jobs + 1), args.failed)]
+        unprocessed = set(failed) | set(os.listdir("automatic_splitting/missing_lumis/"))
+        print(f"{args.failed} failed jobs and {args.missing} jobs with missing lumis out of {args.jobs}")
+        old = timeIt('LumiList sum', lambda: oldMissingLumis(failed, unprocessed))
+        preDAG = PreDAG.__new__(PreDAG)
+        preDAG.failedJobs = failed
+        preDAG.logger = logging.getLogger()
+        task = {'tm_split_args': {}}
+        timeIt('indexed archive', lambda: preDAG.adjustLumisForCompletion(task, unprocessed))
+        if task['tm_split_args']['runs'] != old.getRuns():
+            print("WARNING: the runs of the two methods differ")
+        # as for tasks submitted before the indexed archive
+        os.unlink(JOB_INPUTS_ARCHIVE + INDEX_SUFFIX)
+        timeIt('run_and_lumis.tar.gz', lambda: preDAG.adjustLumisForCompletion(task, unprocessed))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(spool)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Compare the latency of running DAG PRE/POST scripts with a new python process
+for each of them (as dag_bootstrap.sh did) and via TaskManagerHookServer.
+
+run with (in an environment where TaskWorker.TaskManagerBootstrap can be imported,
+e.g. a TaskWorker container or a schedd with CRAB3.zip/WMCore.zip in PYTHONPATH):
+
+python3 BenchmarkDagHooks.py -n 20
+
+A synthetic spool directory is created in a temporary directory and removed at the end.
+The hook which is run there imports TaskWorker.TaskManagerBootstrap, as the real
+PreJob/PostJob do, reads the job ad and records its arguments in a file, so that
+the difference between the two is the cost of starting python and importing
+the CRAB, WMCore, HTCondor and Rucio modules.
+Any module with a bootstrap() function can be used in place of it with --bootstrap-module,
+to run real hooks in a copy of a task spool directory given with --spool.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("-n", "--number",
+  help="number of times each hook is run",
+  type=int,
+  default=20)
+parser.add_argument("--bootstrap-module",
+  help="module with the bootstrap() function to run, default is the synthetic hook",
+  default=None)
+parser.add_argument("--spool",
+  help="directory where to run the hooks, default is a synthetic spool directory",
+  default=None)
+parser.add_argument("--client",
+  help="path of dag_hook_client.py",
+  default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '../dagman/dag_hook_client.py'))
+parser.add_argument("--args",
+  help="arguments of the hook, as in the SCRIPT lines of the DAG description",
+  nargs=argparse.REMAINDER,
+  default=['POSTJOB', '1', '0', '0', '0', '0', '0', 'taskname', '1', '0', 'T2_CH_CERN'])
+args = parser.parse_args()
+
+SYNTHETIC_HOOK = '''
+import os
+import sys
+import json
+import TaskWorker.TaskManagerBootstrap  # pylint: disable=unused-import
+
+
+def bootstrap():
+    """ what every hook does: read the job ad and write something in the spool directory """
+    with open('.job.ad', 'r', encoding='utf-8') as fd:
+        ad = dict(line.split(' = ', 1) for line in fd.read().splitlines())
+    with open(f"hook_{os.getpid()}.json", 'w', encoding='utf-8') as fd:
+        json.dump({'argv': sys.argv[1:], 'task': ad['CRAB_ReqName']}, fd)
+    return 0
+'''
+
+
+def makeSpool(spool):
+    """ the files used by the synthetic hook, and the client as dag_bootstrap.sh finds it """
+    with open(os.path.join(spool, 'synthetic_hook.py'), 'w', encoding='utf-8') as fd:
+        fd.write(SYNTHETIC_HOOK)
+    with open(os.path.join(spool, '.job.ad'), 'w', encoding='utf-8') as fd:
+        fd.write('CRAB_ReqName = "241111_174546:user_benchmark"\nCRAB_JobCount = 1000\n')
+    shutil.copy(args.client, os.path.join(spool, 'dag_hook_client.py'))
+
+
+def timeRuns(cmd, env):
+    """ run cmd args.number times, return the list of elapsed times """
+    times = []
+    for _ in range(args.number):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name, times):
+    """ print latency statistics """
+    times = sorted(times)
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print(f"{name:>8}: mean {statistics.mean(times):.3f}s  median {statistics.median(times):.3f}s  "
+          f"p95 {p95:.3f}s  total {sum(times):.1f}s")
+
+
+def runBenchmark(bootstrapModule, env):
+    """ time the hooks w/o and with the server, in the current directory """
+    direct = timeRuns([sys.executable, '-c',
+                       f"import sys; from {bootstrapModule} import bootstrap; sys.exit(bootstrap())"] + args.args, env)
+    server = subprocess.Popen([sys.executable, '-m', 'TaskWorker.TaskManagerHookServer',
+                               '--bootstrap-module', bootstrapModule, '--dagman-pid', str(os.getpid())], env=env)
+    try:
+        for _ in range(600):
+            if os.path.exists('dag_hook_server.sock'):
+                break
+            time.sleep(0.1)
+        else:
+            print("Hook server did not start, see dag_hook_server.log")
+            return 1
+        viaServer = timeRuns([sys.executable, '-I', '-S', 'dag_hook_client.py'] + args.args, env)
+    finally:
+        server.terminate()
+        server.wait()
+        if os.path.exists('dag_hook_server.sock'):
+            os.unlink('dag_hook_server.sock')
+    report('direct', direct)
+    report('server', viaServer)
+    print(f"speedup (median): {statistics.median(direct) / statistics.median(viaServer):.1f}x")
+    return 0
+
+
+def main():
+    """ run the benchmark in the given or in a synthetic spool directory """
+    spool = args.spool or tempfile.mkdtemp()
+    cwd = os.getcwd()
+    env = dict(os.environ)
+    try:
+        os.chdir(spool)
+        if args.spool:
+            if not os.path.exists('dag_hook_client.py'):
+                shutil.copy(args.client, 'dag_hook_client.py')
+            return runBenchmark(args.bootstrap_module or 'TaskWorker.TaskManagerBootstrap', env)
+        makeSpool(spool)
+        env['PYTHONPATH'] = os.pathsep.join([spool] + [p for p in [env.get('PYTHONPATH')] if p])
+        ret = runBenchmark(args.bootstrap_module or 'synthetic_hook', env)
+        nRuns = len([name for name in os.listdir('.') if name.startswith('hook_')])
+        if not args.bootstrap_module and nRuns != 2 * args.number:
+            print(f"WARNING: the hook ran {nRuns} times instead of {2 * args.number}")
+        return ret
+    finally:
+        os.chdir(cwd)
+        if not args.spool:
+            shutil.rmtree(spool)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+"""
+Compare the cost of what task_process/cache_status.py does with the nodes of a large task
+the way it did it before (records created by a deepcopy of NODE_DEFAULTS, event times as floats,
+a deepcopy of the whole cache for the JSON file and all files rewritten at every run)
+with the current code.
+
+run with (in an environment where htcondor2 and classad2 can be imported, e.g. a schedd):
+
+python3 BenchmarkStatusCache.py --jobs 20000
+
+A synthetic spool directory is created in a temporary directory and removed at the end.
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import pickle
+import random
+import shutil
+import argparse
+import tempfile
+import importlib
+import tracemalloc
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+parser.add_argument("--jobs",
+  help="number of jobs of the task",
+  type=int,
+  default=20000)
+parser.add_argument("--retries",
+  help="fraction of the jobs which were resubmitted once",
+  type=float,
+  default=0.2)
+args = parser.parse_args()
+
+OLD_NODE_DEFAULTS = {
+    'Retries': 0,
+    'Restarts': 0,
+    'SiteHistory': [],
+    'ResidentSetSize': [],
+    'SubmitTimes': [],
+    'StartTimes': [],
+    'EndTimes': [],
+    'TotalUserCpuTimeHistory': [],
+    'TotalSysCpuTimeHistory': [],
+    'WallDurations': [],
+    'JobIds': []
+}
+
+
+class FakeJobEventLog():
+    """ replays a list of events like an htcondor.JobEventLog """
+    def __init__(self, events):
+        self.allEvents = events
+
+    def events(self, stop_after):  # pylint: disable=unused-argument
+        """ same signature as htcondor.JobEventLog.events """
+        return iter(self.allEvents)
+
+
+def makeEvents(rng):
+    """ the job_log events of a task where all jobs ran and a fraction was resubmitted """
+    events = []
+    start = 1700000000
+    cluster = 1000
+    for jobId in range(1, args.jobs + 1):
+        for _ in range(2 if rng.random() < args.retries else 1):
+            cluster += 1
+            submit = start + rng.randint(0, 3600)
+            run = submit + rng.randint(60, 3600)
+            end = run + rng.randint(600, 36000)
+            ids = {'Cluster': cluster, 'Proc': 0}
+            events.append(dict(ids, MyType='SubmitEvent', LogNotes=f"DAG Node: Job{jobId}",
+                               EventTime=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(submit))))
+            events.append(dict(ids, MyType='ExecuteEvent', EventTime=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(run))))
+            events.append(dict(ids, MyType='JobAdInformationEvent', JOBGLIDEIN_CMSSite=rng.choice(['T2_CH_CERN', 'T2_IT_Pisa', 'T1_US_FNAL']),
+                               EventTime=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(run))))
+            events.append(dict(ids, MyType='JobImageSizeEvent', ResidentSetSize=rng.randint(10**5, 10**6),
+                               EventTime=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(run + 300))))
+            events.append(dict(ids, MyType='JobTerminatedEvent', TerminatedNormally=True, ReturnValue=0,
+                               TotalRemoteUsage="Usr 0 01:02:03, Sys 0 00:01:02",
+                               EventTime=time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(end))))
+    return events
+
+
+def oldNodes(nodes):
+    """ the same nodes as the previous code had them, with times stored as floats """
+    old = {}
+    for node, info in nodes.items():
+        if node == 'DagStatus':
+            old[node] = info
+            continue
+        old[node] = copy.deepcopy(OLD_NODE_DEFAULTS)
+        old[node].update(info)
+        for key in ('SubmitTimes', 'StartTimes', 'EndTimes'):
+            old[node][key] = [float(t) for t in info[key]]
+    return old
+
+
+def oldStoreNodesInfoInJSONFile(cacheDoc, jsonFile):
+    """ the way cache_status.storeNodesInfoInJSONFile used to do it """
+    newDict = copy.deepcopy(cacheDoc)
+    del newDict['nodeMap']
+    for node, nodeInfo in newDict['nodes'].items():
+        if node != 'DagStatus':
+            del nodeInfo['WallDurations']
+    del newDict['jobLogCheckpoint']
+    tempFilename = (jsonFile + ".%s") % os.getpid()
+    with open(tempFilename, "w", encoding='utf-8') as fp:
+        json.dump(newDict, fp)
+    shutil.move(tempFilename, jsonFile)
+
+
+def timeIt(func):
+    """ run func, return (result, elapsed seconds) """
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def peakMemory(func):
+    """ run func, return the peak of the memory allocated meanwhile in MB """
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+def report(name, old, new, unit):
+    """ print one line of the comparison """
+    ratio = f"{old / new:.1f}x" if new and old / new < 100 else ">100x"
+    print(f"{name:>36}: {old:8.2f}{unit:<2} {new:8.2f}{unit:<2} {ratio:>6}")
+
+
+def main():
+    """ compare the old and the new way in a synthetic spool directory """
+    rng = random.Random(12345)
+    spool = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(spool)
+        os.mkdir('task_process')
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../dagman/task_process'))
+        cacheStatus = importlib.import_module('cache_status')
+
+        events = makeEvents(rng)
+        nodes, nodeMap = {}, {}
+        cacheStatus.parseJobLog(FakeJobEventLog(events), nodes, nodeMap)
+        nodes['DagStatus'] = {'Timestamp': time.time(), 'NodesTotal': args.jobs, 'SubDags': {}}
+        cacheDoc = {'jobLogCheckpoint': 'jel-1.pkl', 'fjrParseResCheckpoint': 0, 'nodes': nodes,
+                    'nodeMap': nodeMap, 'overallDagStatus': 'SUBMITTED'}
+        oldCacheDoc = dict(cacheDoc, nodes=oldNodes(nodes))
+        print(f"{args.jobs} jobs, {len(events)} events")
+        print(f"{'':>36}  {'old':>10} {'new':>10}")
+
+        _, old = timeIt(lambda: [copy.deepcopy(OLD_NODE_DEFAULTS) for _ in range(args.jobs)])
+        _, new = timeIt(lambda: [cacheStatus.newNodeInfo() for _ in range(args.jobs)])
+        report('create node records', old, new, 's')
+
+        oldPkl, old = timeIt(lambda: pickle.dumps(oldCacheDoc, protocol=2))
+        newPkl, new = timeIt(lambda: pickle.dumps(cacheDoc, protocol=2))
+        report('pickle dump', old, new, 's')
+        report('status_cache.pkl size', len(oldPkl) / 2**20, len(newPkl) / 2**20, 'MB')
+
+        jsonFile = cacheStatus.JSON_STATUS_CACHE_FILE
+        _, old = timeIt(lambda: oldStoreNodesInfoInJSONFile(oldCacheDoc, jsonFile))
+        _, new = timeIt(lambda: cacheStatus.storeNodesInfoInJSONFile(cacheDoc))
+        report('write status_cache.json', old, new, 's')
+        old = peakMemory(lambda: oldStoreNodesInfoInJSONFile(oldCacheDoc, jsonFile))
+        new = peakMemory(lambda: cacheStatus.storeNodesInfoInJSONFile(cacheDoc))
+        report('memory to write status_cache.json', old, new, 'MB')
+
+        def storeAll():
+            cacheStatus.storeNodesInfoInPklFile(cacheDoc)
+            cacheStatus.storeNodesInfoInTxtFile(cacheDoc)
+            cacheStatus.storeNodesInfoInJSONFile(cacheDoc)
+
+        def idleCycle():
+            if cacheStatus.statusCacheChanged(cacheDoc, 'SUBMITTED', {'DagStatus'}, nodes['DagStatus']):
+                storeAll()
+
+        _, old = timeIt(storeAll)
+        _, new = timeIt(idleCycle)
+        report('run where nothing changed', old, new, 's')
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(spool)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -58,6 +58,85 @@ def setupStreamLogger():
     return logger
 
 
+def indexPostScriptEvents(filename):
+    """
+    Return the index of the POST Script terminated events in the DAG .nodes.log
+    file, i.e. a dictionary {node: [[offset, value], ...]} with the byte offset
+    in the file of the return value of each of these events for the node, and
+    the value itself. The index is saved by saveIndex() in <filename>.postindex
+    together with the offset up to which the file was scanned, so that only the
+    events appended to the file since last time have to be scanned.
+    """
+    indexname = filename + ".postindex"
+    stat = os.stat(filename)
+    try:
+        with open(indexname, 'r', encoding='utf-8') as fd:
+            index = json.load(fd)
+        if index['inode'] != stat.st_ino or index['scanned'] > stat.st_size:
+            raise ValueError("index does not match file")
+    except (OSError, ValueError, KeyError):
+        index = {'inode': stat.st_ino, 'scanned': 0, 'events': {}}
+    terminator_re = re.compile(br"^\.\.\.$")
+    # date field has two different format, this is for condor up to version 8.8.8
+    event1_re = re.compile(br"016 \(-?\d+\.\d+\.\d+\) \d+/\d+ \d+:\d+:\d+ POST Script terminated.")
+    # and this for 8.9.7
+    event2_re = re.compile(br"016 \(-?\d+\.\d+\.\d+\) \d+-\d+-\d+ \d+:\d+:\d+ POST Script terminated.")
+    retvalue_re = re.compile(br"Normal termination \(return value (\d)\)")
+    node_re = re.compile(br"DAG Node: Job(\d+(-\d+)?)")
+    events = index['events']
+    offset = index['scanned']
+    # state is the number of lines of the sequence matched so far:
+    # terminator, POST Script terminated event, return value, node
+    state = 0
+    retvalue = None
+    with open(filename, 'rb') as fd:
+        fd.seek(offset)
+        for line in fd:
+            if not line.endswith(b"\n"):
+                # event being written
+                break
+            start = offset
+            offset += len(line)
+            if state == 1 and (event1_re.search(line) or event2_re.search(line)):
+                state = 2
+            elif state == 2 and retvalue_re.search(line):
+                m = retvalue_re.search(line)
+                retvalue = [start + m.start(1), m.group(1).decode()]
+                state = 3
+            elif state == 3:
+                m = node_re.search(line)
+                if m:
+                    events.setdefault(m.group(1).decode(), []).append(retvalue)
+                state = 0
+            else:
+                state = 0
+            if state == 0 and terminator_re.search(line):
+                state = 1
+            # only resume next time from the beginning of a sequence
+            if state == 0:
+                index['scanned'] = offset
+            elif state == 1:
+                index['scanned'] = start
+    return index
+
+
+def saveIndex(filename, index):
+    """
+    Save the index returned by indexPostScriptEvents() for the DAG .nodes.log file.
+    If it can not be saved, remove the old one, which would not be valid anymore.
+    """
+    indexname = filename + ".postindex"
+    try:
+        with open(indexname + ".tmp", 'w', encoding='utf-8') as fd:
+            json.dump(index, fd)
+        os.rename(indexname + ".tmp", indexname)
+    except OSError as ex:
+        printLog(f"Failed to save {indexname}: {ex}")
+        for name in (indexname, indexname + ".tmp"):
+            if os.path.exists(name):
+                os.unlink(name)
+
+
 def adjustPostScriptExitStatus(resubmitJobIds, filename):
     """
     Edit the DAG .nodes.log file changing the POST script exit code from 0|2 to 1
@@ -73,6 +152,14 @@ def adjustPostScriptExitStatus(resubmitJobIds, filename):
     for the job ids in resubmitJobIds and replace the return value to 1.
     If resubmitJobIds = True, only replace return values 2 (not 0) to 1.
 
+    The offsets of these return values are found with indexPostScriptEvents(),
+    and since the new value has the same length as the old one, they are
+    overwritten in place. We can not write a temp file and do an atomic rename,
+    because the running shadows keep their event log file descriptors open,
+    but this way the file is never rewritten and changing a byte can not fail
+    halfway for lack of quota. Note that we don't race with the shadow as we
+    have a write lock on the file itself.
+
     Note:
           When DAGMan runs in recovery mode, the DAG .nodes.log file is used to
     identify the nodes that have completed and should not be resubmitted.
@@ -85,80 +172,25 @@ def adjustPostScriptExitStatus(resubmitJobIds, filename):
         return []
     printLog(f"Looking for resubmitJobIds {resubmitJobIds} in {filename}")
     resubmitAllFailed = (resubmitJobIds is True)
-    terminator_re = re.compile(r"^\.\.\.$")
-    # date field has two different format, this is for condor up to version 8.8.8
-    event1_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+/\d+ \d+:\d+:\d+ POST Script terminated.")
-    # and this for 8.9.7
-    event2_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+-\d+-\d+ \d+:\d+:\d+ POST Script terminated.")
     if resubmitAllFailed:
-        retvalue_re = re.compile(r"Normal termination \(return value 2\)")
+        valuesToAdjust = ('2',)
     else:
-        retvalue_re = re.compile(r"Normal termination \(return value [0|2]\)")
-    node_re = re.compile(r"DAG Node: Job(\d+(-\d+)?)")
-    ra_buffer = []
-    alt = None
-    output = ''
+        valuesToAdjust = ('0', '2')
+        resubmitJobIds = set(resubmitJobIds)
+    index = indexPostScriptEvents(filename)
     adjustedJobIds = []
-    for line in open(filename, 'r', encoding='utf-8').readlines():
-        if len(ra_buffer) == 0:
-            m = terminator_re.search(line)
-            if m:
-                ra_buffer.append(line)
-            else:
-                output += line
-        elif len(ra_buffer) == 1:
-            m1 = event1_re.search(line)
-            m2 = event2_re.search(line)
-            if m1 or m2:
-                ra_buffer.append(line)
-            else:
-                for l in ra_buffer:
-                    output += l
-                output += line
-                ra_buffer = []
-        elif len(ra_buffer) == 2:
-            m = retvalue_re.search(line)
-            if m:
-                ra_buffer.append("        (1) Normal termination (return value 1)\n")
-                alt = line
-            else:
-                for l in ra_buffer:
-                    output += l
-                output += line
-                ra_buffer = []
-        elif len(ra_buffer) == 3:
-            m = node_re.search(line)
-            printLog(f"Matching the line '{line.strip()}' to groups: {m.groups()}")
-            if m and (resubmitAllFailed or (m.groups()[0] in resubmitJobIds)):
-                printLog(f"Successful match: {m.groups()[0]}, adjusting status and appending to adjustedJobIds")
-                adjustedJobIds.append(m.groups()[0])
-                for l in ra_buffer:
-                    output += l
-            else:
-                for l in ra_buffer[:-1]:
-                    output += l
-                output += alt
-            output += line
-            ra_buffer = []
-        else:
-            output += line
-    if ra_buffer:
-        for l in ra_buffer:
-            output += l
-    # This is a curious dance!  If the user is out of quota, we don't want
-    # to fail halfway into writing the file.  OTOH, we can't write into a temp
-    # file and an atomic rename because the running shadows keep their event log
-    # file descriptors open.  Accordingly, we write the file once (to see if we)
-    # have enough quota space, then rewrite "the real file" after deleting the
-    # temporary one.  There's a huge race condition here, but it seems to be the
-    # best we can do given the constraints.  Note that we don't race with the
-    # shadow as we have a write lock on the file itself.
-    tmpfilename = filename + ".tmp"
-    with  open(tmpfilename, "w", encoding='utf-8') as output_fd:
-        output_fd.write(output)
-    os.unlink(tmpfilename)
-    with open(filename, "w", encoding='utf-8') as output_fd:
-        output_fd.write(output)
+    with open(filename, 'r+b') as fd:
+        for node, events in index['events'].items():
+            if not (resubmitAllFailed or node in resubmitJobIds):
+                continue
+            for event in events:
+                if event[1] in valuesToAdjust:
+                    fd.seek(event[0])
+                    fd.write(b'1')
+                    event[1] = '1'
+                    printLog(f"Adjusted status of node Job{node}, appending to adjustedJobIds")
+                    adjustedJobIds.append(node)
+    saveIndex(filename, index)
     return adjustedJobIds
 
 
@@ -336,7 +368,7 @@ def makeWebDir(ad):
         ## Make all the necessary symbolic links in the web directory.
         sourceLinks = ["debug",
                        "RunJobs.dag", "RunJobs.dag.dagman.out", "RunJobs.dag.nodes.log",
-                       "input_files.tar.gz", "run_and_lumis.tar.gz",
+                       "input_files.tar.gz", "run_and_lumis.tar.gz", "job_inputs.jsonl",
                        "input_dataset_lumis.json", "input_dataset_duplicate_lumis.json",
                        "aso_status.json", "error_summary.json", "site.ad.json"
                       ]
@@ -154,6 +154,17 @@ if [ "X$_CONDOR_JOB_AD" != "X" ]; then
   echo "Printing current job ad..."
   cat $_CONDOR_JOB_AD
 fi
+if [[ $scriptKind == "HOOKSERVER" ]]; then
+  # started in background by dag_bootstrap_startup.sh with the DAGMan pid as argument, so that
+  # it has the same environment as the PRE/POST scripts it runs. Keep its output out of dag_bootstrap.out
+  exec nice -n 19 python3 -m TaskWorker.TaskManagerHookServer --dagman-pid $2 > dag_hook_server.out 2>&1
+fi
 echo "Now running the job in `pwd`..."
+# if the hook server started by dag_bootstrap_startup.sh is there, let it run the
+# job in a process forked from it, w/o starting python and importing everything again.
+# The client falls back to running TaskManagerBootstrap if the server does not answer
+if [ -S dag_hook_server.sock ] && [ -e dag_hook_client.py ]; then
+  exec python3 -I -S dag_hook_client.py "$@"
+fi
 exec nice -n 19 python3 -m TaskWorker.TaskManagerBootstrap "$@"
 } 2>&1 | tee dag_bootstrap.out
@@ -142,9 +142,10 @@ if [ "X$TASKWORKER_ENV" = "X" -a ! -e CRAB3.zip ]; then
     # extract from the JobWrapper tarball the executable to be used as "cmd" in condor submit to Grid
     tar xf CMSRunAnalysis.tar.gz gWMS-CMSRunAnalysis.sh
 
-    # also extract the run_and_lumis.tar.gz file which will be used by automatic-splitting
-    # related code in PostJob and PreDag. Want to keep 'untarring' at minimum to save on I/O
-    tar xf CMSRunAnalysis.tar.gz run_and_lumis.tar.gz
+    # also extract the job_inputs archive which will be used by automatic-splitting
+    # related code in PostJob and PreDag, and run_and_lumis.tar.gz and input_files.tar.gz for
+    # the web directory. Want to keep 'untarring' at minimum to save on I/O
+    tar xf CMSRunAnalysis.tar.gz run_and_lumis.tar.gz input_files.tar.gz job_inputs.jsonl job_inputs.jsonl.idx
 
     export TASKWORKER_ENV="1"
 fi
@@ -261,6 +262,14 @@ EOF
     fi
     # --- End new status prototype ---
 
+    # start the server which runs the PRE/POST scripts w/o starting python for each of them,
+    # see TaskWorker/TaskManagerHookServer.py. It exits when condor_dagman (exec'ed below as $$) is gone.
+    # If it is not running, dag_bootstrap.sh runs them as usual
+    if [ -e dag_hook_client.py ]; then
+        echo "starting DAG hook server"
+        ./dag_bootstrap.sh HOOKSERVER $$ > /dev/null 2>&1 < /dev/null &
+    fi
+
     echo "executing condor_dagman"
     # Documentation about condor_dagman: http://research.cs.wisc.edu/htcondor/manual/v8.3/condor_dagman.html
     # In particular:
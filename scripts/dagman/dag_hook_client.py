@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# pylint: disable=invalid-name
+"""
+Run by dag_bootstrap.sh in place of "python3 -m TaskWorker.TaskManagerBootstrap"
+when the hook server (TaskWorker/TaskManagerHookServer.py) is running for this task.
+Passes arguments, environment, working directory and stdin/stdout/stderr to the
+server, which runs the PreJob/PostJob/PreDAG in a process forked from it, and
+exits with the exit code of that process.
+Only uses the standard library, so that it starts fast also with "python3 -I -S".
+If the server can not be reached, runs TaskManagerBootstrap as dag_bootstrap.sh would.
+"""
+import os
+import sys
+import json
+import socket
+import struct
+
+SOCKET_NAME = 'dag_hook_server.sock'
+
+
+def fallback(args):
+    """ run the hook w/o the server """
+    os.execvp('nice', ['nice', '-n', '19', 'python3', '-m', 'TaskWorker.TaskManagerBootstrap'] + args)
+
+
+def main(args):
+    """ send the request and wait for the exit code """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_NAME)
+    except OSError as ex:
+        print(f"Hook server not available ({ex}), running TaskManagerBootstrap directly", flush=True)
+        sock.close()
+        fallback(args)
+    payload = json.dumps({'argv': args, 'env': dict(os.environ), 'cwd': os.getcwd()}).encode('utf-8')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    fds = struct.pack('3i', 0, 1, 2)
+    sock.sendmsg([struct.pack('!I', len(payload))], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+    sock.sendall(payload)
+    # the job is now running, if anything goes wrong from here on it can't be
+    # run again in this process since it may have already done something
+    reply = b''
+    while len(reply) < 4:
+        chunk = sock.recv(4 - len(reply))
+        if not chunk:
+            print("Hook server closed the connection w/o sending the exit code", file=sys.stderr)
+            return 1
+        reply += chunk
+    return struct.unpack('!i', reply)[0]
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -46,6 +46,8 @@ import json
 import logging
 import os
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from http.client import HTTPException
 
@@ -55,10 +57,16 @@ from RucioUtils import Client as rucioclient
 from rucio.rse.rsemanager import find_matching_scheme
 
 from RESTInteractions import CRABRest
-from ServerUtilities import encodeRequest
+from ServerUtilities import encodeRequest, readNewLines, findLineOffset
 
 FTS_ENDPOINT = "https://fts3-cms.cern.ch:8446/"
 FTS_MONITORING = "https://fts3-cms.cern.ch:8449/"
+# max number of FTS jobs whose status is queried concurrently
+FTS_STATUS_THREADS = 10
+# last known state of the FTS jobs which are still monitored
+FTS_JOBS_STATE_FILE = 'task_process/transfers/fts_jobs_state.json'
+# max number of transfers whose state is updated in one REST call
+MARK_TRANSFERS_CHUNK = 1000
 
 if not os.path.exists('task_process/transfers'):
     os.makedirs('task_process/transfers')
@@ -95,6 +103,28 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+def chunkJobs(jobIds, idsPerJob, n):
+    """
+    Yield successive lists of FTS jobs which have at most n transfer ids in total,
+    a job with more than n ids is alone in its list.
+    :param jobIds: list of FTS job ids
+    :param idsPerJob: dictionary {jobId: number of transfer ids of the job}
+    :param n: max number of transfer ids
+    :return: yield the next list of job ids
+    """
+    chunk = []
+    nIds = 0
+    for jobId in jobIds:
+        if chunk and nIds + idsPerJob[jobId] > n:
+            yield chunk
+            chunk = []
+            nIds = 0
+        chunk.append(jobId)
+        nIds += idsPerJob[jobId]
+    if chunk:
+        yield chunk
+
+
 def mark_transferred(ids, crabserver):
     """
     Mark the list of files as tranferred
@@ -167,9 +197,11 @@ def remove_files_in_bkg(pfns, logFile, timeout=None):
     return
 
 
-def check_FTSJob(logger, ftsContext, jobid, jobsEnded, jobs_ongoing, done_id, failed_id, failed_reasons):
+def check_FTSJob(logger, ftsContext, jobid, jobsEnded, jobs_ongoing, done_id, failed_id, failed_reasons, jobStates=None):
     """
     get transfers state per jobid
+    It can be executed concurrently for different jobids: output params
+    are only appended to, or updated for this jobid.
 
     INPUT PARAMS
     :param logger: a logging object
@@ -181,6 +213,9 @@ def check_FTSJob(logger, ftsContext, jobid, jobsEnded, jobs_ongoing, done_id, fa
     :param done_id:
     :param failed_id:
     :param failed_reasons:
+    INPUT/OUTPUT PARAMS
+    :param jobStates: dictionary {jobId: last known job state}, when the job
+        was already ACTIVE, file statuses are retrieved with a single query
     - check if the fts job is in final state (FINISHED, FINISHEDDIRTY, CANCELED, FAILED)
     - get file transfers states and get corresponding oracle ID from FTS file metadata
     - update states on oracle
@@ -190,11 +225,19 @@ def check_FTSJob(logger, ftsContext, jobid, jobsEnded, jobs_ongoing, done_id, fa
 
     jobs_ongoing.append(jobid)
     file_statuses = {}
+    if jobStates is None:
+        jobStates = {}
 
     try:
-        status = fts3.get_job_status(ftsContext, jobid, list_files=False)
-        if status["job_state"] in ['ACTIVE', 'FINISHED', 'FINISHEDDIRTY', "FAILED", "CANCELED"]:
-            file_statuses = fts3.get_job_status(ftsContext, jobid, list_files=True)['files']
+        if jobStates.get(jobid) == 'ACTIVE':
+            status = fts3.get_job_status(ftsContext, jobid, list_files=True)
+            if status["job_state"] in ['ACTIVE', 'FINISHED', 'FINISHEDDIRTY', "FAILED", "CANCELED"]:
+                file_statuses = status['files']
+        else:
+            status = fts3.get_job_status(ftsContext, jobid, list_files=False)
+            if status["job_state"] in ['ACTIVE', 'FINISHED', 'FINISHEDDIRTY', "FAILED", "CANCELED"]:
+                file_statuses = fts3.get_job_status(ftsContext, jobid, list_files=True)['files']
+        jobStates[jobid] = status["job_state"]
     except HTTPException as hte:
         logger.exception(f"failed to retrieve status for {jobid}")
         logger.exception(f"httpExeption headers {hte.headers}")
@@ -490,20 +533,20 @@ def submit(rucioClient, ftsContext, toTrans, crabserver):
     return jobids
 
 
-def perform_transfers(inputFile, lastLine, _lastFile, ftsContext, rucioClient, crabserver):
+def perform_transfers(inputFile, lastLine, lastOffset, ftsContext, rucioClient, crabserver):
     """
-    get transfers and update last read line number
+    get transfers and return updated last read line number and byte offset
 
     :param inputFile: path to the file with list of files to be transferred
     :param lastLine: number of the last line processed
-    :param _last: path to the file keeping track of the last read line
+    :param lastOffset: byte offset in inputFile after the last line processed
     :param ftsContext: FTS context
     :param rucioClient: a Rucio Client object
-    :return:
+    :return: transfers, jobids, lastLine, lastOffset
     """
 
     transfers = []
-    logging.info("starting from line: %s", lastLine)
+    logging.info("starting from line: %s (byte offset %s)", lastLine, lastOffset)
 
     # read one doc from each line in input file
     # doc is a dictionary :
@@ -528,59 +571,79 @@ def perform_transfers(inputFile, lastLine, _lastFile, ftsContext, rucioClient, c
     #   "cksum": "1309875024"
     # }
 
-    with open(inputFile, encoding='utf-8') as _list:
-        for _data in _list.readlines()[lastLine:]:
-            try:
-                lastLine += 1
-                doc = json.loads(_data)
-            except Exception:
-                continue
-            transfers.append([doc["source_lfn"],
-                              doc["destination_lfn"],
-                              doc["id"],
-                              doc["source"],
-                              doc["destination"],
-                              doc["username"],
-                              doc["taskname"],
-                              doc["filesize"],
-                              doc["checksums"]])
-
-        jobids = []
-        if transfers:
-            jobids = submit(rucioClient, ftsContext, transfers, crabserver)
+    # only lines appended since last time are read, a partially written last line is left for next time
+    for _data, nextOffset in readNewLines(inputFile, lastOffset):
+        lastLine += 1
+        lastOffset = nextOffset
+        try:
+            doc = json.loads(_data)
+        except Exception:
+            continue
+        transfers.append([doc["source_lfn"],
+                          doc["destination_lfn"],
+                          doc["id"],
+                          doc["source"],
+                          doc["destination"],
+                          doc["username"],
+                          doc["taskname"],
+                          doc["filesize"],
+                          doc["checksums"]])
 
-            for jobid in jobids:
-                logging.info("Monitor link: " + FTS_MONITORING + "fts3/ftsmon/#/job/%s", jobid)  # pylint: disable=logging-not-lazy
+    jobids = []
+    if transfers:
+        jobids = submit(rucioClient, ftsContext, transfers, crabserver)
 
-            # TODO: send to dashboard
+        for jobid in jobids:
+            logging.info("Monitor link: " + FTS_MONITORING + "fts3/ftsmon/#/job/%s", jobid)  # pylint: disable=logging-not-lazy
 
-        _lastFile.write(str(lastLine))
+        # TODO: send to dashboard
 
-    return transfers, jobids
+    return transfers, jobids, lastLine, lastOffset
 
 
 def state_manager(ftsContext, crabserver):
     """
-
+    check the state of all FTS jobs in fts_jobids.txt, concurrently with at
+    most FTS_STATUS_THREADS jobs at a time, and update the state of all
+    transfers which completed since last cycle in one bulk REST update.
+    fts_jobids.txt and FTS_JOBS_STATE_FILE are rewritten with the jobs which
+    still need to be monitored.
     """
-    jobs_done = []
     jobs_ongoing = []
     jobsEnded = []
     failed_id = {}
     failed_reasons = {}
     done_id = {}
-
-    # TODO: puo esser utile togliere questo file? mmm forse no
+    jobStates = {}
 
     if os.path.exists('task_process/transfers/fts_jobids.txt'):
         with open("task_process/transfers/fts_jobids.txt", "r", encoding='utf-8') as _jobids:
-            lines = _jobids.readlines()
-            for line in list(set(lines)):
-                if line:
-                    jobid = line.split('\n')[0]
-                if jobid:
-                    check_FTSJob(logging, ftsContext, jobid, jobsEnded, jobs_ongoing, done_id, failed_id, failed_reasons)
-            _jobids.close()
+            jobids = list(dict.fromkeys(line.strip() for line in _jobids if line.strip()))
+        try:
+            with open(FTS_JOBS_STATE_FILE, 'r', encoding='utf-8') as fh:
+                jobStates = json.load(fh)
+        except (OSError, ValueError):
+            jobStates = {}
+
+        # FTS context is not thread safe, each thread creates its own
+        threadData = threading.local()
+
+        def checkJob(jobid):
+            if not hasattr(threadData, 'ftsContext'):
+                threadData.ftsContext = fts3.Context(FTS_ENDPOINT, proxy, proxy, verify=True)
+            check_FTSJob(logging, threadData.ftsContext, jobid, jobsEnded, jobs_ongoing,
+                         done_id, failed_id, failed_reasons, jobStates)
+
+        if len(jobids) == 1:
+            check_FTSJob(logging, ftsContext, jobids[0], jobsEnded, jobs_ongoing,
+                         done_id, failed_id, failed_reasons, jobStates)
+        elif jobids:
+            with ThreadPoolExecutor(max_workers=min(FTS_STATUS_THREADS, len(jobids))) as pool:
+                for future in [pool.submit(checkJob, jobid) for jobid in jobids]:
+                    try:
+                        future.result()
+                    except Exception:
+                        logging.exception('Failed to check FTS job')
 
         # the loop above has filled:
         # job_ongoing: list of FTS jobs processed
@@ -589,23 +652,28 @@ def state_manager(ftsContext, crabserver):
         # but at this point a given FTS job may be compelted, or still ACTIVE and only part of its transfers are
         # reported as done/failed.
         try:
-            # process all jobs for which some xfers have been reported as dobe
-            for jobID in done_id:
-                logging.info('Marking job %s files done and %s files failed for job %s', len(done_id[jobID]), len(failed_id[jobID]), jobID)
-
-                if done_id[jobID]:
-                    markDone = mark_transferred(done_id[jobID], crabserver)
-                else:
-                    markDone = True
-                if failed_id[jobID]:
-                    markFailed = mark_failed(failed_id[jobID], failed_reasons[jobID], crabserver)
-                else:
-                    markFailed = True
-                if jobID in jobsEnded:
-                    # only remove a Terminated FTS job from the list of xfer marking was successful, otherwise will try again
-                    if markDone and markFailed:
-                        jobs_done.append(jobID)
-                        jobs_ongoing.remove(jobID)
+            # mark xfers reported as done or failed in bulk, for a group of jobs at a time so that
+            # each REST call has at most MARK_TRANSFERS_CHUNK ids
+            idsPerJob = {jobID: len(done_id[jobID]) + len(failed_id[jobID]) for jobID in done_id}
+            for jobIDs in chunkJobs(list(done_id), idsPerJob, MARK_TRANSFERS_CHUNK):
+                allDone = [_id for jobID in jobIDs for _id in done_id[jobID]]
+                # build failed ids and reasons in the same loop, so that they stay aligned
+                allFailed = []
+                allReasons = []
+                for jobID in jobIDs:
+                    allFailed += failed_id[jobID]
+                    allReasons += failed_reasons[jobID]
+                logging.info('Marking %s files done and %s files failed for %s jobs', len(allDone), len(allFailed), len(jobIDs))
+                markDone = all(mark_transferred(ids, crabserver)
+                               for ids in chunks(allDone, MARK_TRANSFERS_CHUNK))
+                markFailed = all(mark_failed(ids, reasons, crabserver)
+                                 for ids, reasons in zip(chunks(allFailed, MARK_TRANSFERS_CHUNK),
+                                                         chunks(allReasons, MARK_TRANSFERS_CHUNK)))
+                # only remove a Terminated FTS job from the list of xfer marking was successful, otherwise will try again
+                if markDone and markFailed:
+                    for jobID in jobIDs:
+                        if jobID in jobsEnded:
+                            jobs_ongoing.remove(jobID)
         except Exception:
             logging.exception('Failed to update states')
     else:
@@ -618,6 +686,10 @@ def state_manager(ftsContext, crabserver):
 
     os.rename("task_process/transfers/fts_jobids_new.txt", "task_process/transfers/fts_jobids.txt")
 
+    with open(FTS_JOBS_STATE_FILE + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump({jobid: jobStates[jobid] for jobid in jobs_ongoing if jobid in jobStates}, fh)
+    os.rename(FTS_JOBS_STATE_FILE + '.tmp', FTS_JOBS_STATE_FILE)
+
     return jobs_ongoing
 
 
@@ -626,18 +698,28 @@ def submission_manager(rucioClient, ftsContext, crabserver):
 
     """
     last_line = 0
+    last_offset = None
     if os.path.exists('task_process/transfers/last_transfer.txt'):
         with open("task_process/transfers/last_transfer.txt", "r", encoding='utf-8') as _last:
             read = _last.readline()
             last_line = int(read)
             logging.info("last line is: %s", last_line)
             _last.close()
-
-    # TODO: if the following fails check not to leave a corrupted file
+    if os.path.exists('task_process/transfers/last_transfer_offset.txt'):
+        with open("task_process/transfers/last_transfer_offset.txt", "r", encoding='utf-8') as _last:
+            last_offset = int(_last.readline())
+    if last_offset is None:
+        # bookkeeping from before offsets were introduced, find it once from the line number
+        last_offset = findLineOffset("task_process/transfers.txt", last_line)
+
+    _, jobids, last_line, last_offset = perform_transfers("task_process/transfers.txt", last_line, last_offset,
+                                                          ftsContext, rucioClient, crabserver)
+    with open("task_process/transfers/last_transfer_offset_new.txt", "w+", encoding='utf-8') as _last:
+        _last.write(str(last_offset))
+    os.rename("task_process/transfers/last_transfer_offset_new.txt", "task_process/transfers/last_transfer_offset.txt")
     with open("task_process/transfers/last_transfer_new.txt", "w+", encoding='utf-8') as _last:
-        _, jobids = perform_transfers("task_process/transfers.txt", last_line, _last, ftsContext, rucioClient, crabserver)
-        _last.close()
-        os.rename("task_process/transfers/last_transfer_new.txt", "task_process/transfers/last_transfer.txt")
+        _last.write(str(last_line))
+    os.rename("task_process/transfers/last_transfer_new.txt", "task_process/transfers/last_transfer.txt")
 
     with open("task_process/transfers/fts_jobids.txt", "a", encoding='utf-8') as _jobids:
         for job in jobids:
@@ -653,7 +735,7 @@ def algorithm():
     - instantiates FTS3 python easy client
     - delegate user proxy to fts if needed
     - check for fts jobs to monitor and update states in oracle
-    - get last line from last_transfer.txt
+    - get last line and its byte offset from last_transfer.txt and last_transfer_offset.txt
     - gather list of file to transfers
         + group by source
         + submit ftsjob and save fts jobid
@@ -681,7 +763,7 @@ def algorithm():
         return
 
     with open("task_process/transfers.txt", encoding='utf-8') as _list:
-        _data = _list.readlines()[0]
+        _data = _list.readline()
         try:
             doc = json.loads(_data)
             username = doc["username"]
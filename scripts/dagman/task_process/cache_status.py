@@ -18,20 +18,6 @@ import classad2 as classad
 
 logging.basicConfig(filename='task_process/cache_status.log', level=logging.DEBUG)
 
-NODE_DEFAULTS = {
-    'Retries': 0,
-    'Restarts': 0,
-    'SiteHistory': [],
-    'ResidentSetSize': [],
-    'SubmitTimes': [],
-    'StartTimes': [],
-    'EndTimes': [],
-    'TotalUserCpuTimeHistory': [],
-    'TotalSysCpuTimeHistory': [],
-    'WallDurations': [],
-    'JobIds': []
-}
-
 STATUS_CACHE_FILE = "task_process/status_cache.txt"
 PKL_STATUS_CACHE_FILE = "task_process/status_cache.pkl"
 JSON_STATUS_CACHE_FILE = "task_process/status_cache.json"
@@ -39,6 +25,27 @@ LOG_PARSING_POINTERS_DIR = "task_process/jel_pickles/"
 FJR_PARSE_RES_FILE = "task_process/fjr_parse_results.txt"
 
 
+def newNodeInfo():
+    """
+    the record for a new DAG node. Built from literals, which is much cheaper than a deepcopy of
+    a template for tasks with tens of thousands of nodes. Status clients read these dictionaries
+    from status_cache.pkl as they are, so they must stay plain dictionaries of lists
+    """
+    return {
+        'Retries': 0,
+        'Restarts': 0,
+        'SiteHistory': [],
+        'ResidentSetSize': [],
+        'SubmitTimes': [],
+        'StartTimes': [],
+        'EndTimes': [],
+        'TotalUserCpuTimeHistory': [],
+        'TotalSysCpuTimeHistory': [],
+        'WallDurations': [],
+        'JobIds': []
+    }
+
+
 cpuRe = re.compile(r"Usr \d+ (\d+):(\d+):(\d+), Sys \d+ (\d+):(\d+):(\d+)")
 
 
@@ -79,18 +86,21 @@ def parseJobLog(jel, nodes, nodeMap):
     :param nodeMap: a structure to map DAG node id (i.e. CRAB_Id) to condor jobid Cluster.Proc
                     first (Submit) event in job_log has a LogNotes attribute with the DAG id,
                     but subsequent ones are only identified via Cluster and Proc
-    :return: nothing
+    :return: the set of node ids whose info was changed by the new events
     """
     count = 0
+    changedNodes = set()
     for event in jel.events(0):
         count += 1
-        eventtime = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
+        node = None
+        # EventTime has a 1 sec. resolution, keep it an int so that it is stored as such in the status_cache files
+        eventtime = int(time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S")))
         if event['MyType'] == 'SubmitEvent':
             m = nodeNameRe.match(event['LogNotes'])  # True if LogNotes is like 'DAG Node: Job13'
             if m:
                 node = m.groups()[0]  # the number after 'DAG Node: Job' e.g. '13' (as a string), i.e. CRAB_Id
                 proc = event['Cluster'], event['Proc']  # SB: why a tuple instead of a string  like '10210368.0' ?
-                info = nodes.setdefault(node, copy.deepcopy(NODE_DEFAULTS))  # adds key "node" and makes info=NODE_DEFAULTS
+                info = nodes.setdefault(node, newNodeInfo())  # adds key "node" and makes info an empty record
                 info['State'] = 'idle'
                 info['JobIds'].append("%d.%d" % proc)
                 info['RecordedSite'] = False
@@ -195,6 +205,8 @@ def parseJobLog(jel, nodes, nodeMap):
             pass
         else:
             logging.warning("Unknown event type: %s", event['MyType'])
+        if node is not None:
+            changedNodes.add(node)
 
     logging.debug("There were %d events in the job log.", count)
     now = time.time()
@@ -206,12 +218,15 @@ def parseJobLog(jel, nodes, nodeMap):
         if info['StartTimes']:
             lastStart = info['StartTimes'][-1]
         while len(info['WallDurations']) < len(info['SiteHistory']):
+            changedNodes.add(node)
             if lastStart > 0:
                 info['WallDurations'].append(now - lastStart)
             else:  # this means job did not start
                 info['WallDurations'].append(0)
         while len(info['WallDurations']) > len(info['SiteHistory']):
+            changedNodes.add(node)
             info['SiteHistory'].append("Unknown")
+    return changedNodes
 
 
 def parseErrorReport(fjrReports, nodes):
@@ -222,7 +237,7 @@ def parseErrorReport(fjrReports, nodes):
                  which writes one line for PostJoun run: {job_id : {crab_retry : error_summary}}
                  in which crab_retry is a string and error_summary is a list [exitcode, errorMsg, {}]
     :param nodes: a dictionary with format {jobid:dictionary}
-    :return: nothing
+    :return: the set of node ids which were changed
     : SIDE ACTION: modifies nodes in place by adding the Error key to the dictionary of matching jobs
                    with content = error_summary
     explicitely:
@@ -233,6 +248,7 @@ def parseErrorReport(fjrReports, nodes):
     in node[jobid]['Error'] we want the list  [5, 'Error while running CMSSW:\n', {}]
     which is what CRAB CLient status command expects.
     """
+    changedNodes = set()
     for jobid in fjrReports:
         if jobid in nodes:
             # there should be only one retry, but anyhow ... find the last retry attempt
@@ -240,13 +256,17 @@ def parseErrorReport(fjrReports, nodes):
             last_retry = max(fjrReports[jobid], key=int)  # Get the latest retry (largest key).
             # Set the error summary from the last retry attempt.
             nodes[jobid]['Error'] = fjrReports[jobid][last_retry]
+            changedNodes.add(jobid)
+    return changedNodes
 
 def parseNodeStateV2(fp, nodes, level):
     """
     HTCondor 8.1.6 updated the node state file to be classad-based.
     This is a more flexible format that allows future extensions but, unfortunately,
     also requires a separate parser.
+    returns the set of node ids whose State was changed, DagStatus is always included
     """
+    changedNodes = {"DagStatus"}
     # note that when nodes was read from cache, setdefault returns the current value
     dagStatus = nodes.setdefault("DagStatus", {})
     dagStatus.setdefault("SubDagStatus", {})
@@ -289,7 +309,10 @@ def parseNodeStateV2(fp, nodes, level):
         status = ad.get('NodeStatus', -1)
         retry = ad.get('RetryCount', -1)
         msg = ad.get("StatusDetails", "")
-        info = nodes.setdefault(nodeid, copy.deepcopy(NODE_DEFAULTS))
+        if nodeid not in nodes:
+            changedNodes.add(nodeid)
+        info = nodes.setdefault(nodeid, newNodeInfo())
+        oldState = info.get('State')
         if status == 1: # STATUS_READY
             if retry == 0:
                 info['State'] = 'unsubmitted'
@@ -317,18 +340,24 @@ def parseNodeStateV2(fp, nodes, level):
             # be tried again in the near future.  This behavior is no longer
             # observed; STATUS_ERROR is terminal.
             info['State'] = 'failed'
+        if info.get('State') != oldState:
+            changedNodes.add(nodeid)
+    return changedNodes
 
 def readOldStatusCacheFile():
     """
     it is enough to read the Pickle version, since we want to transition to that
     returns: a dictionary with keys: jobLogCheckpoint, fjrParseResCheckpoint, nodes, nodeMap
+      and the overallDagStatus as found in the Pickle file
     """
     jobLogCheckpoint = None
+    storedDagStatus = None
     if os.path.exists(PKL_STATUS_CACHE_FILE) and os.stat(PKL_STATUS_CACHE_FILE).st_size > 0:
         logging.debug("cache file found, opening")
         try:
             with open(PKL_STATUS_CACHE_FILE, "rb") as fp:
                 cacheDoc = pickle.load(fp)
+            storedDagStatus = cacheDoc.get('overallDagStatus')
             # protect against fake file with just bootstrapTime created by AdjustSites.py
             # note: python's dictionary.get(key) returns None if key is not in dictionary
             jobLogCheckpoint = cacheDoc.get('jobLogCheckpoint')
@@ -344,6 +373,7 @@ def readOldStatusCacheFile():
         fjrParseResCheckpoint = 0
         nodes = {}
         nodeMap = {}
+        storedDagStatus = None
 
     # collect all cache info in a single dictionary and return it to called
     cacheDoc = {}
@@ -351,14 +381,15 @@ def readOldStatusCacheFile():
     cacheDoc['fjrParseResCheckpoint'] = fjrParseResCheckpoint
     cacheDoc['nodes'] = nodes
     cacheDoc['nodeMap'] = nodeMap
-    return cacheDoc
+    return cacheDoc, storedDagStatus
 
 def parseCondorLog(cacheDoc):
     """
     do all real work and update checkpoints, nodes and nodemap dictionaries
     takes as input a cacheDoc dictionary with keys
       jobLogCheckpoint, fjrParseResCheckpoint, nodes, nodeMap
-    and returns the same dictionary with updated information
+    and returns the same dictionary with updated information, the set of node ids which
+    changed and the JobEventLog object to be saved with saveJobLogCheckpoint
     """
 
     jobLogCheckpoint = cacheDoc['jobLogCheckpoint']
@@ -373,30 +404,23 @@ def parseCondorLog(cacheDoc):
         # parse log from beginning
         jel = htcondor.JobEventLog('job_log')
 
-    parseJobLog(jel, nodes, nodeMap)
-    # save jel object in a pickle file made unique by a timestamp
-    newJelPickleName = f"jel-{int(time.time())}.pkl"
-    if not os.path.exists(LOG_PARSING_POINTERS_DIR):
-        os.mkdir(LOG_PARSING_POINTERS_DIR)
-    with open((LOG_PARSING_POINTERS_DIR+newJelPickleName), 'wb') as f:
-        pickle.dump(jel, f)
-    newJobLogCheckpoint = newJelPickleName
+    changedNodes = parseJobLog(jel, nodes, nodeMap)
 
     for fn in glob.glob("node_state*"):
         level = re.match(r'(\w+)(?:.(\w+))?', fn).group(2)
         with open(fn, 'r', encoding='utf-8') as nodeState:
-            parseNodeStateV2(nodeState, nodes, level)
+            changedNodes |= parseNodeStateV2(nodeState, nodes, level)
 
     try:
         errorSummary, newFjrParseResCheckpoint = summarizeFjrParseResults(fjrParseResCheckpoint)
         if errorSummary and newFjrParseResCheckpoint:
-            parseErrorReport(errorSummary, nodes)
+            changedNodes |= parseErrorReport(errorSummary, nodes)
     except IOError:
         logging.exception("error during error_summary file handling")
 
     # collect all cache info in a single dictionary and return it to caller
     newCacheDoc = {}
-    newCacheDoc['jobLogCheckpoint'] = newJobLogCheckpoint
+    newCacheDoc['jobLogCheckpoint'] = jobLogCheckpoint
     newCacheDoc['fjrParseResCheckpoint'] = newFjrParseResCheckpoint
     newCacheDoc['nodes'] = nodes
     newCacheDoc['nodeMap'] = nodeMap
@@ -404,7 +428,48 @@ def parseCondorLog(cacheDoc):
     collapsedDagStatus = collapseDAGStatus(nodes['DagStatus'])
     logging.info(f"Collapsed DAG status for reportig is {collapsedDagStatus}")
     newCacheDoc['overallDagStatus'] = collapsedDagStatus
-    return newCacheDoc
+    logging.debug("%d nodes changed in this cycle", len(changedNodes))
+    return newCacheDoc, changedNodes, jel
+
+
+def saveJobLogCheckpoint(cacheDoc, jel):
+    """
+    save jel object in a pickle file made unique by a timestamp and point cacheDoc to it
+    """
+    newJelPickleName = f"jel-{int(time.time())}.pkl"
+    if not os.path.exists(LOG_PARSING_POINTERS_DIR):
+        os.mkdir(LOG_PARSING_POINTERS_DIR)
+    with open((LOG_PARSING_POINTERS_DIR+newJelPickleName), 'wb') as f:
+        pickle.dump(jel, f)
+    cacheDoc['jobLogCheckpoint'] = newJelPickleName
+
+
+def withoutTimestamps(dagStatus):
+    """
+    the DagStatus node w/o the time when DAGMan wrote the node_state files, which changes at every run
+    """
+    if not dagStatus:
+        return dagStatus
+    status = {key: value for key, value in dagStatus.items() if key != 'Timestamp'}
+    status['SubDags'] = {level: {key: value for key, value in subDag.items() if key != 'Timestamp'}
+                         for level, subDag in dagStatus.get('SubDags', {}).items()}
+    return status
+
+
+def statusCacheChanged(cacheDoc, storedDagStatus, changedNodes, oldDagStatus):
+    """
+    decide if the status_cache files need to be rewritten, i.e. if clients (crab status via WEB_DIR,
+    Publisher, PreDAG) would find something different in them.
+    When they are not rewritten, the checkpoints are not advanced either and the next run
+    parses again the few events which did not change any node, which is harmless
+    """
+    if not os.path.exists(PKL_STATUS_CACHE_FILE) or not cacheDoc['jobLogCheckpoint']:
+        return True
+    if cacheDoc['overallDagStatus'] != storedDagStatus:
+        return True
+    if changedNodes - {'DagStatus'}:
+        return True
+    return withoutTimestamps(cacheDoc['nodes'].get('DagStatus')) != withoutTimestamps(oldDagStatus)
 
 
 def storeNodesInfoInPklFile(cacheDoc):
@@ -454,14 +519,16 @@ def storeNodesInfoInJSONFile(cacheDoc):
     # First write a new cache file with a temporary name. Then replace old one with new.
     tempFilename = (JSON_STATUS_CACHE_FILE + ".%s") % os.getpid()
     # nodeMap keys are tuple, JSON does not like them. Anyhot this dict. appears unused by other code
-    newDict = copy.deepcopy(cacheDoc)
-    del newDict['nodeMap']
-    # Avoid time information to enable comparison with *new*
-    for node, nodeInfo in newDict['nodes'].items():
-        if node != 'DagStatus':
-            del nodeInfo['WallDurations']
     # remove checkpoints to enable comparison with *new*
-    del newDict['jobLogCheckpoint']
+    # only the top level dictionaries are copied, a deepcopy of all nodes is slow and doubles the memory
+    newDict = {key: value for key, value in cacheDoc.items()
+               if key not in ('nodeMap', 'jobLogCheckpoint', 'nodes')}
+    newDict['nodes'] = {}
+    for node, nodeInfo in cacheDoc['nodes'].items():
+        if node != 'DagStatus':
+            # Avoid time information to enable comparison with *new*
+            nodeInfo = {key: value for key, value in nodeInfo.items() if key != 'WallDurations'}
+        newDict['nodes'][node] = nodeInfo
     with open(tempFilename, "w", encoding='utf-8') as fp:
         json.dump(newDict, fp)
     move(tempFilename, JSON_STATUS_CACHE_FILE)
@@ -648,12 +715,18 @@ def main():
     try:
         logging.info(f"Start at {time.strftime('%d/%m/%y %X',time.localtime())}")
 
-        oldInfo = readOldStatusCacheFile()
-        updatedInfo = parseCondorLog(oldInfo)
-        storeNodesInfoInPklFile(updatedInfo)
-        # to keep the txt file locally, useful for debugging, when we remove the old code:
-        storeNodesInfoInTxtFile(updatedInfo)
-        storeNodesInfoInJSONFile(updatedInfo)
+        oldInfo, storedDagStatus = readOldStatusCacheFile()
+        # parseCondorLog updates the nodes in place
+        oldDagStatus = copy.deepcopy(oldInfo['nodes'].get('DagStatus'))
+        updatedInfo, changedNodes, jel = parseCondorLog(oldInfo)
+        if statusCacheChanged(updatedInfo, storedDagStatus, changedNodes, oldDagStatus):
+            saveJobLogCheckpoint(updatedInfo, jel)
+            storeNodesInfoInPklFile(updatedInfo)
+            # to keep the txt file locally, useful for debugging, when we remove the old code:
+            storeNodesInfoInTxtFile(updatedInfo)
+            storeNodesInfoInJSONFile(updatedInfo)
+        else:
+            logging.info("nothing changed, status_cache files left untouched")
 
         # make sure that we only do this when status has changed, not every 5 minutes
         # even if...all in all.. one call per task every 5min is a drop in the ocean
@@ -665,6 +738,6 @@ def main():
         logging.exception("error during main loop")
 
 
-main()
-
-logging.debug("cache_status.py exiting")
+if __name__ == '__main__':
+    main()
+    logging.debug("cache_status.py exiting")
@@ -9,11 +9,20 @@ function cache_status {
     python3 task_process/cache_status.py
 }
 
+function transfer_status {
+    # (re)start the long lived process which keeps aso_status.json up to date for the PostJobs
+    if [[ -z "$TRANSFER_STATUS_PID" ]] || ! kill -0 $TRANSFER_STATUS_PID 2>/dev/null; then
+        log "Starting transfer_status.py"
+        python3 task_process/transfer_status.py &
+        TRANSFER_STATUS_PID=$!
+    fi
+}
+
 function manage_transfers {
     log "Running transfers.py"
 
     if [[ -f task_process/transfers.txt ]]; then
-        DEST_LFN=`python3 -c 'import sys, json; print(json.loads( open("task_process/transfers.txt").readlines()[0] )["destination_lfn"])' `
+        DEST_LFN=`python3 -c 'import sys, json; print(json.loads( open("task_process/transfers.txt").readline() )["destination_lfn"])' `
         re='^/store/(user|group)/rucio/.*'
         if [[ $DEST_LFN =~ $re  ]]; then
             PYTHONPATH=$PYTHONPATH:$RucioPy3 /usr/bin/time -v timeout 15m python3 task_process/RUCIO_Transfers.py >> task_process/transfer_rucio.log 2>&1
@@ -132,6 +141,7 @@ do
 
     # Run the parsing script
     cache_status
+    transfer_status
     manage_transfers
     sleep 300s
 
@@ -172,6 +182,7 @@ do
             log "Caching the status one last time, removing the task_process/task_process_running file and exiting."
 
             cache_status
+            # transfer_status.py exits when task_process_running is removed
             rm task_process/task_process_running
 
             exit 0
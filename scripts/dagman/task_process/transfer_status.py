@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# pylint: disable=broad-except, invalid-name
+"""
+Long lived process started by task_proc_wrapper.sh which owns the cache of the
+transfer statuses of this task (aso_status.json) used by the PostJobs.
+Instead of each PostJob querying the fileusertransfers REST API when the cache
+is old, this refreshes it at regular intervals, only asking for the documents
+modified since last query, and PostJobs just read the local file.
+A PostJob which needs a refresh before the next scheduled one (e.g. because its
+documents are not in the cache yet) can ask for it by touching REFRESH_REQUEST_FILE.
+"""
+import json
+import logging
+import os
+import time
+
+from RESTInteractions import CRABRest
+from ServerUtilities import encodeRequest, oracleOutputMapping, TRANSFERDB_STATES
+
+CACHE_FILE = 'aso_status.json'
+REFRESH_REQUEST_FILE = 'task_process/transfer_status_refresh'
+REST_INFO_FILE = 'task_process/RestInfoForFileTransfers.json'
+TRANSFERS_FILE = 'task_process/transfers.txt'
+# seconds between scheduled refreshes
+REFRESH_INTERVAL = 120
+# minimum seconds between refreshes, also when a PostJob asks for it
+MIN_REFRESH_INTERVAL = 30
+# seconds between full queries, refreshes in between only get the changes
+FULL_REFRESH_INTERVAL = 3600
+# tm_last_update is set by the REST before the DB transaction is committed
+SINCE_MARGIN = 300
+# how often to check for refresh requests
+POLL_INTERVAL = 5
+
+if not os.path.exists('task_process/transfers'):
+    os.makedirs('task_process/transfers')
+
+logging.basicConfig(
+    filename='task_process/transfers/transfer_status.log',
+    level=logging.INFO,
+    format='%(asctime)s: %(message)s'
+)
+
+
+class TransferStatusCache():
+    """
+    Keeps the transfer statuses in memory and writes them to CACHE_FILE
+    in the same format used by PostJob.get_transfers_statuses
+    """
+
+    def __init__(self):
+        self.crabserver = None
+        self.username = None
+        self.taskname = None
+        self.results = {}
+        self.lastQuery = 0
+        self.lastFullQuery = 0
+
+    def ready(self):
+        """
+        Transfers statuses can only be queried once PostJobs have written
+        the REST info and the first transfer document.
+        Returns True if the REST client is configured.
+        """
+        if self.crabserver:
+            return True
+        if not (os.path.exists(REST_INFO_FILE) and os.path.exists(TRANSFERS_FILE)):
+            return False
+        try:
+            with open(REST_INFO_FILE, encoding='utf-8') as fp:
+                restInfo = json.load(fp)
+            with open(TRANSFERS_FILE, encoding='utf-8') as fp:
+                doc = json.loads(fp.readline())
+        except Exception:
+            # e.g. a line which is being written
+            logging.exception("Failed to read REST info and first transfer")
+            return False
+        proxy = os.getcwd() + "/" + str(restInfo['proxyfile'])
+        os.environ["X509_USER_PROXY"] = proxy
+        self.crabserver = CRABRest(restInfo['host'], localcert=proxy, localkey=proxy,
+                                   userAgent='CRABSchedd')
+        self.crabserver.setDbInstance(restInfo['dbInstance'])
+        self.username = doc['username']
+        self.taskname = doc['taskname']
+        return True
+
+    def refreshDue(self):
+        """
+        Returns True if it is time for a scheduled refresh or if a PostJob asked for one
+        """
+        sinceLastQuery = time.time() - self.lastQuery
+        if sinceLastQuery >= REFRESH_INTERVAL:
+            return True
+        if sinceLastQuery < MIN_REFRESH_INTERVAL:
+            return False
+        try:
+            return os.path.getmtime(REFRESH_REQUEST_FILE) > self.lastQuery
+        except OSError:
+            return False
+
+    def refresh(self):
+        """
+        Query the transfer statuses modified since last query (or all of them
+        once every FULL_REFRESH_INTERVAL), merge them and write CACHE_FILE.
+        In case of failure the cache file is left as is, PostJobs will notice
+        that it is not refreshed anymore and query by themselves.
+        """
+        queryTime = time.time()
+        since = None
+        if queryTime - self.lastFullQuery < FULL_REFRESH_INTERVAL:
+            since = int(self.lastQuery) - SINCE_MARGIN
+        data = {'subresource': 'getTransferStatus',
+                'username': self.username,
+                'taskname': self.taskname}
+        if since:
+            data['since'] = since
+        try:
+            viewResults = self.crabserver.get(api='fileusertransfers', data=encodeRequest(data))
+            viewResultsDict = oracleOutputMapping(viewResults, 'id')
+        except Exception:
+            logging.exception("Error while querying transfer statuses")
+            return
+        for document in viewResultsDict:
+            viewResultsDict[document][0]['state'] = TRANSFERDB_STATES[viewResultsDict[document][0]['transfer_state']].lower()
+        if since:
+            self.results.update(viewResultsDict)
+        else:
+            self.results = viewResultsDict
+            self.lastFullQuery = queryTime
+        self.lastQuery = queryTime
+        asoInfo = {
+            "query_timestamp": queryTime,
+            "full_query_timestamp": self.lastFullQuery,
+            "query_succeded": True,
+            "query_jobid": "task_process",
+            "query_owner": "task_process",
+            "refresh_interval": REFRESH_INTERVAL,
+            "results": self.results,
+        }
+        tmpName = "%s.%d" % (CACHE_FILE, os.getpid())
+        with open(tmpName, 'w', encoding='utf-8') as fd:
+            json.dump(asoInfo, fd)
+        os.rename(tmpName, CACHE_FILE)
+        logging.info("Got %d changed transfer statuses, %d in cache", len(viewResultsDict), len(self.results))
+
+
+def algorithm():
+    """
+    refresh the cache until task_process exits. The spool directory disappears
+    when the DAG is removed, task_proc_wrapper.sh removes task_process_running when done
+    """
+    cache = TransferStatusCache()
+    while os.path.exists('task_process/task_process_running'):
+        if cache.ready() and cache.refreshDue():
+            cache.refresh()
+        time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.info("transfer_status.py starting")
+    try:
+        algorithm()
+    except Exception:
+        logging.exception("error during main loop")
+    logging.info("transfer_status.py exiting")
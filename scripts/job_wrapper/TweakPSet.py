@@ -24,7 +24,7 @@ job_lumis_1.json content:
 {"1": [[669684, 669684]]}
 job_input_file_list_1.json content:
 ["1.root"]
-On Worker nodes it has a tarball with all files. but for debugging purpose it is possible to read directly from file
+On Worker nodes it has an indexed archive with all files. but for debugging purpose it is possible to read directly from file
 
 from old TweakPSet/SetupCMSSWPsetCore, some useful documentation of args
 inputFiles:     the input files of the job. This must be a list of dictionaries whose keys are "lfn" and "parents"
@@ -57,38 +57,34 @@ eventsPerLumi:  start a new lumi section after the specified amount of events.
 
 import os
 import shutil
-import tarfile
 from ast import literal_eval
 
 from PSetTweaks.PSetTweak import PSetTweak
-from Utils.Utilities import decodeBytesToUnicode
+from IndexedArchive import readMember, archiveExists, JOB_INPUTS_ARCHIVE
 
 
 def readFileFromTarball(filename, tarball):
-    """ returns a string with the content of once file in a tarball """
+    """
+    returns the content of one file for this job from the indexed archive
+    with all of them (see IndexedArchive.py), or from a tarball for tasks
+    submitted before the indexed archive was introduced
+    """
     content = '{}'
     if os.path.isfile(filename):
         # This is only for Debugging
         print("*********************")
-        print(f"DEBUGGING MODE! WILL USE EXISTING {filename} INSTEAD OR GETTING IT FROM {tarball}")
+        print(f"DEBUGGING MODE! WILL USE EXISTING {filename} INSTEAD OR GETTING IT FROM {JOB_INPUTS_ARCHIVE}")
         print("*********************")
         with open(filename, 'r', encoding='utf-8') as f:
             content = f.read()
         return literal_eval(content)
-    if not os.path.exists(tarball):
-        raise RuntimeError(f"Error getting {tarball} file location")
-    tarFile = tarfile.open(tarball)
-    for member in tarFile.getmembers():  # pylint: disable=unused-variable
-        try:
-            f = tarFile.extractfile(filename)
-            content = f.read()
-            content = decodeBytesToUnicode(content)
-            break
-        except KeyError as er:
-            # Don`t exit due to KeyError, print error. EventBased and FileBased does not have run and lumis
-            print(f"Failed to get information from tarball {tarball} and file {filename}. Error : {er}")
-            break
-    tarFile.close()
+    if not archiveExists(JOB_INPUTS_ARCHIVE) and not os.path.exists(tarball):
+        raise RuntimeError(f"Error getting {JOB_INPUTS_ARCHIVE} file location")
+    try:
+        content = readMember(JOB_INPUTS_ARCHIVE, filename, legacyTarball=tarball)
+    except KeyError as er:
+        # Don`t exit due to KeyError, print error. EventBased and FileBased does not have run and lumis
+        print(f"Failed to get information from {JOB_INPUTS_ARCHIVE} for file {filename}. Error : {er}")
     return literal_eval(content)
 
 
@@ -105,6 +105,13 @@ G_NOW_EPOCH = None
 ## Name of the JSON job report.
 G_JOB_REPORT_NAME = None
 
+## In-memory copy of the JSON job report (see the JobReport class). All the
+## job report functions below read and modify it, and it is written back to
+## G_JOB_REPORT_NAME at most every G_JOB_REPORT_CHECKPOINT_INTERVAL seconds
+## while there are changes, and when cmscp exits.
+G_JOB_REPORT = None
+G_JOB_REPORT_CHECKPOINT_INTERVAL = 60
+
 ## The exit code of the job wrapper is put here after reading it from the job
 ## report. This exit code is used to determine whether the output/log files
 ## should be put in the "failed" subdirectory and whether publication has to be
@@ -185,16 +192,63 @@ def get_job_id(source):
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+class JobReport(object):
+    """
+    The json job report held in memory for the whole stageout. The file is
+    parsed once on first access. Changes are recorded with changed(), which
+    writes a checkpoint of the report if the last one is older than
+    G_JOB_REPORT_CHECKPOINT_INTERVAL seconds, so that a job killed during a
+    long stageout still leaves a recent report. flush() writes pending
+    changes. The file is always replaced atomically, so the PostJob never
+    sees a partially written report.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.report = None
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def get(self):
+        """
+        Return the job report dictionary, loading it from file if needed.
+        """
+        if self.report is None:
+            with open(self.name) as fd:
+                self.report = json.load(fd)
+        return self.report
+
+    def changed(self):
+        """
+        Record that the job report dictionary was modified.
+        """
+        self.dirty = True
+        if time.time() - self.last_flush >= G_JOB_REPORT_CHECKPOINT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the job report to file if it was modified.
+        """
+        if not self.dirty:
+            return
+        tmp_name = "%s.tmp" % (self.name)
+        with open(tmp_name, 'w') as fd:
+            json.dump(self.report, fd)
+        os.rename(tmp_name, self.name)
+        self.dirty = False
+        self.last_flush = time.time()
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
 def get_from_job_report(key, default = None, location = None):
     """
     Extract and return from the json job report section specified by the keys
     given in the location list (which is expected to be a dictionary) the value
     corresponding to the given key. If not found, return the default.
     """
-    if G_JOB_REPORT_NAME is None:
+    if G_JOB_REPORT is None:
         return default
-    with open(G_JOB_REPORT_NAME) as fd:
-        job_report = json.load(fd)
+    job_report = G_JOB_REPORT.get()
     subreport = job_report
     subreport_name = ''
     if location is None:
@@ -225,10 +279,9 @@ def get_output_file_from_job_report(file_name, job_report = None):
     found, return None.
     """
     if job_report is None:
-        if G_JOB_REPORT_NAME is None:
+        if G_JOB_REPORT is None:
             return None
-        with open(G_JOB_REPORT_NAME) as fd:
-            job_report = json.load(fd)
+        job_report = G_JOB_REPORT.get()
     job_report_output = job_report['steps']['cmsRun']['output']
     for output_module in job_report_output.values():
         for output_file_info in output_module:
@@ -255,10 +308,9 @@ def add_to_job_report(key_value_pairs, location = None, mode = 'overwrite'):
     the job report, print a warning message and return False. Return True
     otherwise.
     """
-    if G_JOB_REPORT_NAME is None:
+    if G_JOB_REPORT is None:
         return False
-    with open(G_JOB_REPORT_NAME) as fd:
-        job_report = json.load(fd)
+    job_report = G_JOB_REPORT.get()
     subreport = job_report
     subreport_name = ''
     if location is None:
@@ -279,11 +331,13 @@ def add_to_job_report(key_value_pairs, location = None, mode = 'overwrite'):
         print(msg)
         return False
     if mode in ['new', 'overwrite']:
-        for key, value in key_value_pairs:
+        ## Check all keys before modifying the in-memory job report.
+        for key, _ in key_value_pairs:
             if mode == 'new' and key in subreport:
                 msg = "WARNING: Key '%s' already exists in job report section %s." % (key, subreport_name)
                 print(msg)
                 return False
+        for key, value in key_value_pairs:
             subreport[key] = value
     elif mode == 'update':
         for key, value in key_value_pairs:
@@ -292,8 +346,7 @@ def add_to_job_report(key_value_pairs, location = None, mode = 'overwrite'):
         msg = "WARNING: Unknown mode '%s'." % (mode)
         print(msg)
         return False
-    with open(G_JOB_REPORT_NAME, 'w') as fd:
-        json.dump(job_report, fd)
+    G_JOB_REPORT.changed()
     return True
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
@@ -372,11 +425,10 @@ def add_to_file_in_job_report(file_name, is_log, key_value_pairs):
     if is_log:
         is_ok = add_to_job_report(key_value_pairs)
         return is_ok
-    if G_JOB_REPORT_NAME is None:
+    if G_JOB_REPORT is None:
         return False
     orig_file_name, _ = get_job_id(file_name)
-    with open(G_JOB_REPORT_NAME) as fd:
-        job_report = json.load(fd)
+    job_report = G_JOB_REPORT.get()
     output_file_info = get_output_file_from_job_report(orig_file_name, job_report)
     if output_file_info is None:
         msg = "WARNING: Metadata for file %s not found in job report." % (orig_file_name)
@@ -384,8 +436,7 @@ def add_to_file_in_job_report(file_name, is_log, key_value_pairs):
         return False
     for key, value in key_value_pairs:
         output_file_info[key] = value
-    with open(G_JOB_REPORT_NAME, 'w') as fd:
-        json.dump(job_report, fd)
+    G_JOB_REPORT.changed()
     return True
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
@@ -947,8 +998,9 @@ def main():
     ## Start JOB REPORT VALIDATION
     ##--------------------------------------------------------------------------
     ## Set the json job report name.
-    global G_JOB_REPORT_NAME
+    global G_JOB_REPORT_NAME, G_JOB_REPORT
     G_JOB_REPORT_NAME = 'jobReport.json.%s' % G_JOB_AD['CRAB_Id']
+    G_JOB_REPORT = JobReport(G_JOB_REPORT_NAME)
     ## Load the json job report and make sure it has the expected structure.
     condition = no_condition
     if skip['job_report_validation']:
@@ -961,8 +1013,7 @@ def main():
         print(msg)
         try:
             job_report = {}
-            with open(G_JOB_REPORT_NAME) as fd:
-                job_report = json.load(fd)
+            job_report = G_JOB_REPORT.get()
             cmscp_status['job_report_validation']['return_code'] = 0
         except Exception:
             msg  = "ERROR: Unable to load %s." % (G_JOB_REPORT_NAME)
@@ -1538,6 +1589,14 @@ if __name__ == '__main__':
         add_to_job_report([('exitCode',    JOB_STGOUT_WRAPPER_EXIT_INFO['exit_code']), \
                            ('exitAcronym', JOB_STGOUT_WRAPPER_EXIT_INFO['exit_acronym']), \
                            ('exitMsg',     JOB_STGOUT_WRAPPER_EXIT_INFO['exit_msg'])])
+    ## Write the job report changes which are not in the last checkpoint.
+    if G_JOB_REPORT is not None:
+        try:
+            G_JOB_REPORT.flush()
+        except Exception:
+            MSG  = "ERROR: Failed to write job report %s." % (G_JOB_REPORT_NAME)
+            MSG += "\n%s" % (traceback.format_exc())
+            print(MSG)
     ## Now we have to exit with the appropriate exit code, and report failures
     if G_JOB_WRAPPER_EXIT_CODE == None:
         MSG = "Cannot retrieve the job exit code from the job report (does %s exist?)." % (G_JOB_REPORT_NAME)
@@ -32,8 +32,7 @@ class Cleanup:
             if not name in self.transfer.cleanedFiles:
                 toBeDeleted.append(name)
         self.deleteFileInTempArea(toBeDeleted)
-        self.transfer.cleanedFiles += toBeDeleted
-        self.transfer.updateCleanedFiles()
+        self.transfer.updateCleanedFiles(toBeDeleted)
 
     def deleteFileInTempArea(self, fileList):
         """
@@ -11,7 +11,7 @@ from rucio.common.exception import RucioException
 import ASO.Rucio.config as config # pylint: disable=consider-using-from-import
 from ASO.Rucio.Actions.BuildDBSDataset import BuildDBSDataset
 from ASO.Rucio.exception import RucioTransferException
-from ASO.Rucio.utils import chunks, updateToREST, tfcLFN2PFN, LFNToPFNFromPFN
+from ASO.Rucio.utils import chunks, updateToREST, tfcLFN2PFN, LFNToPFNFromPFN, PFNPrefixCache
 
 
 class RegisterReplicas:
@@ -25,6 +25,12 @@ class RegisterReplicas:
         self.rucioClient = rucioClient
         self.transfer = transfer
         self.crabRESTClient = crabRESTClient
+        # schedd-wide cache of the source PFN prefixes, disabled when the
+        # path is not set (e.g. in unittest)
+        self.pfnCache = None
+        cachePath = getattr(config.args, 'rse_pfn_cache_path', None)
+        if cachePath:
+            self.pfnCache = PFNPrefixCache(cachePath, config.args.rse_pfn_cache_ttl)
 
     def execute(self):
         """
@@ -32,12 +38,13 @@ class RegisterReplicas:
         """
         # Generate generator for range of transferItems we want to register.
         # This make it easier for do testing.
+        # `Transfer.transferItems` only contains the lines after `lastTransferLine`
         start = self.transfer.lastTransferLine
         if config.args.force_total_files:
             end = start + config.args.force_total_files
         else:
-            end = len(self.transfer.transferItems)
-        transferGenerator = itertools.islice(self.transfer.transferItems, start, end)
+            end = start + len(self.transfer.transferItems)
+        transferGenerator = itertools.islice(self.transfer.transferItems, 0, end - start)
 
         # Prepare
         transferItemsWithoutLogfile = self.skipLogTransfers(transferGenerator)
@@ -202,9 +209,15 @@ class RegisterReplicas:
         """
         Add `replicas` to the dataset in `container` in chunks (chunk size is
         defined in `config.args.replicas_chunk_size`). This including creates a
-        new dataset when the current dataset exceeds
+        new dataset when the current dataset reaches
         `config.arg.max_file_per_datset`.
 
+        Number of files in datasets is counted locally from the content listed
+        by `populateLFN2DatasetMap()`, so datasets are filled exactly up to
+        `max_file_per_dataset` without listing them again after every chunk.
+        Content of the datasets we close is bookkept in
+        `Transfer.closedDatasets`.
+
         :param fileDocs: a list of fileDoc info an
         :type fileDocs: list of dict
         :return: same list as fileDocs args but with updated rule ID and dataset
@@ -225,41 +238,51 @@ class RegisterReplicas:
                 containerFileDocs.append(c)
             else:
                 newFileDocs.append(r)
+        if not newFileDocs:
+            return containerFileDocs
+        datasetContent = {}
+        for lfn, dataset in replicasInContainer.items():
+            datasetContent.setdefault(dataset, []).append(lfn)
 
         b = BuildDBSDataset(self.transfer, self.rucioClient, self.crabRESTClient)
-        for chunk in chunks(newFileDocs, config.args.replicas_chunk_size):
-            currentDataset = b.getOrCreateDataset(container)
-            self.logger.debug(f'currentDataset: {currentDataset}')
-            dids = [{
-                'scope': self.transfer.rucioScope,
-                'type': "FILE",
-                'name': x["name"]
-            } for x in chunk]
-            # no need to try catch for duplicate content.
-            attachments = [{
-                'scope': self.transfer.rucioScope,
-                'name': currentDataset,
-                'dids': dids
-            }]
-            self.rucioClient.add_files_to_datasets(attachments, ignore_duplicate=True)
-            for c in chunk:
-                success = {
-                    'id': c['id'],
-                    'name': c['name'],
-                    'dataset': currentDataset,
-                    'blockcomplete': 'NO',
-                    'ruleid': self.transfer.containerRuleID,
-                }
-                containerFileDocs.append(success)
-
-            # Current algo will add files whole chunk, so total number of
-            # files in dataset is at most is max_file_per_datset+replicas_chunk_size.
-            #
-            # check the current number of files in the dataset
-            num = len(list(self.rucioClient.list_content(self.transfer.rucioScope, currentDataset)))
-            if num >= config.args.max_file_per_dataset:
+        currentDataset = None
+        start = 0
+        while start < len(newFileDocs):
+            if not currentDataset:
+                currentDataset = b.getOrCreateDataset(container)
+                self.logger.debug(f'currentDataset: {currentDataset}')
+            content = datasetContent.setdefault(currentDataset, [])
+            room = config.args.max_file_per_dataset - len(content)
+            if room > 0:
+                chunk = newFileDocs[start:start + min(room, config.args.replicas_chunk_size)]
+                start += len(chunk)
+                dids = [{
+                    'scope': self.transfer.rucioScope,
+                    'type': "FILE",
+                    'name': x["name"]
+                } for x in chunk]
+                # no need to try catch for duplicate content.
+                attachments = [{
+                    'scope': self.transfer.rucioScope,
+                    'name': currentDataset,
+                    'dids': dids
+                }]
+                self.rucioClient.add_files_to_datasets(attachments, ignore_duplicate=True)
+                for c in chunk:
+                    success = {
+                        'id': c['id'],
+                        'name': c['name'],
+                        'dataset': currentDataset,
+                        'blockcomplete': 'NO',
+                        'ruleid': self.transfer.containerRuleID,
+                    }
+                    containerFileDocs.append(success)
+                    content.append(c['name'])
+            if len(content) >= config.args.max_file_per_dataset:
                 self.logger.info(f'Closing dataset: {currentDataset}')
                 self.rucioClient.close(self.transfer.rucioScope, currentDataset)
+                self.transfer.updateClosedDatasets(currentDataset, content)
+                currentDataset = None
         return containerFileDocs
 
 
@@ -275,6 +298,11 @@ class RegisterReplicas:
         All in all, we expect replicas in Temp_RSE to only stay there for one
         month max.
 
+        Scheme of each (sourceRSE, destinationRSE) pair, and its PFN prefix
+        for each area below `/store/temp/`, are kept in the schedd-wide
+        `PFNPrefixCache` (when `config.args.rse_pfn_cache_path` is set), so
+        Rucio is only asked again for a new area or when the entry expires.
+
         :param sourceLFN: source LFN
         :type sourceLFN: string
         :param sourceRSE: source RSE where LFN is reside, but it must be normal
@@ -289,17 +317,28 @@ class RegisterReplicas:
         :rtype: string
         """
         self.logger.debug(f'Getting pfn for {sourceLFN} at {sourceRSE}')
+        cached = self.pfnCache.get(sourceRSE, destinationRSE) if self.pfnCache else None
+        if cached:
+            pfn = PFNPrefixCache.resolve(cached, sourceLFN)
+            if pfn:
+                self.logger.debug(f'PFN (cached): {pfn}')
+                return pfn
         try:
-            _, srcScheme, _, _ = find_matching_scheme(
-                {"protocols": self.rucioClient.get_protocols(destinationRSE)},
-                {"protocols": self.rucioClient.get_protocols(sourceRSE)},
-                "third_party_copy_read",
-                "third_party_copy_write",
-            )
+            if cached:
+                srcScheme = cached['scheme']
+            else:
+                _, srcScheme, _, _ = find_matching_scheme(
+                    {"protocols": self.rucioClient.get_protocols(destinationRSE)},
+                    {"protocols": self.rucioClient.get_protocols(sourceRSE)},
+                    "third_party_copy_read",
+                    "third_party_copy_write",
+                )
             did = f'{self.transfer.rucioScope}:{sourceLFN}'
             sourcePFNMap = self.rucioClient.lfns2pfns(sourceRSE, [did], operation="third_party_copy_read", scheme=srcScheme)
             pfn = sourcePFNMap[did]
             self.logger.debug(f'PFN: {pfn}')
+            if self.pfnCache:
+                self.pfnCache.put(sourceRSE, destinationRSE, srcScheme, sourceLFN, pfn)
             return pfn
         except Exception as ex:
             raise RucioTransferException("Failed to get source PFN") from ex
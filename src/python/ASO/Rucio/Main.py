@@ -2,6 +2,7 @@
 Main module.
 """
 
+import os
 import logging
 from argparse import ArgumentParser
 
@@ -42,6 +43,12 @@ def main():
     opt.add_argument("--last-line-path", dest="last_line_path",
                      default='task_process/transfers/last_transfer.txt',
                      help="")
+    opt.add_argument("--last-offset-path", dest="last_offset_path",
+                     default='task_process/transfers/last_transfer_offset.txt',
+                     help="byte offset in transfers.txt of the line after last_transfer.txt")
+    opt.add_argument("--transfers-index-path", dest="transfers_index_path",
+                     default='task_process/transfers/transfers_index.txt',
+                     help="Bookkeeping path of the LFN index of transfers.txt")
     opt.add_argument("--transfer-txt-path", dest="transfers_txt_path",
                      default='task_process/transfers.txt',
                      help="")
@@ -71,8 +78,19 @@ def main():
     opt.add_argument("--ignore-lfn2pfn-map", dest="ignore_lfn2pfn_map",
                      action='store_true',
                      help="")
+    opt.add_argument("--closed-datasets-path", dest="closed_datasets_path",
+                     default='task_process/transfers/closed_datasets.json',
+                     help="Bookkeeping path of closedDatasets")
+    opt.add_argument("--ignore-closed-datasets", dest="ignore_closed_datasets",
+                     action='store_true',
+                     help="")
+    opt.add_argument("--rse-pfn-cache-path", dest="rse_pfn_cache_path",
+                     default=os.path.join(os.path.expanduser('~'), '.crab', 'rse_pfn_cache.json'),
+                     help="Schedd-wide cache of source PFN prefix per RSE pair, empty string to disable")
+    opt.add_argument("--rse-pfn-cache-ttl", dest="rse_pfn_cache_ttl", default=6*60*60, type=int, # 6 hours
+                     help="Lifetime in seconds of RSE PFN cache entries")
     opt.add_argument("--cleaned-files-path", dest="cleaned_files_path",
-                     default='task_process/transfers/cleaned_files.json',
+                     default='task_process/transfers/cleaned_files.txt',
                      help="Bookkeeping path of cleanedFiles")
     opt.add_argument("--ignore-cleaned-files", dest="ignore_cleaned_files",
                      action='store_true',
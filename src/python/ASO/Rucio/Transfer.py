@@ -9,7 +9,8 @@ import shutil
 
 import ASO.Rucio.config as config # pylint: disable=consider-using-from-import
 from ASO.Rucio.exception import RucioTransferException
-from ASO.Rucio.utils import writePath, parseFileNameFromLFN, addSuffixToProcessedDataset
+from ASO.Rucio.utils import writePath, parseFileNameFromLFN, addSuffixToProcessedDataset, BookkeepingSet
+from ServerUtilities import readNewLines, findLineOffset
 
 
 class Transfer:
@@ -26,10 +27,13 @@ class Transfer:
         self.restDBInstance = ''
         self.restProxyFile = ''
 
-        # Content of transfers.txt (list of dict)
-        # Note that we load whole file into memory but continue process from
-        # `lastTransferLine`.
+        # Content of transfers.txt (list of dict) appended after `lastTransferLine`
+        # Only new lines are read, starting from byte offset `lastTransferOffset`.
         self.transferItems = []
+        # byte offset in transfers.txt after each of transferItems
+        self.transferItemsEndOffsets = []
+        # transferItems of the first job in transfers.txt, to get task info from
+        self.firstJobTransferItems = []
 
         # from transfer info
         self.rucioUsername = ''
@@ -44,13 +48,16 @@ class Transfer:
         # dynamically change throughout the scripts
         self.currentDataset = ''
 
-        # map of destination_lfn to transferItems
+        # map of destination_lfn to transferItems, for all lines in transfers.txt
+        # backed by an index file, see TransferItemsIndex
         self.LFN2transferItemMap = None
 
         # Bookkeeping variable
         # All variable here should be `None` and get assiged in `read*` method
         # to make it fail (fast) when we forgot to add `read*` in readInfo.
         self.lastTransferLine = None
+        self.lastTransferOffset = None
+        self.transferItemsStartLine = None
         self.containerRuleID = None
         self.publishRuleID = None
         self.multiPubRuleIDs = {}
@@ -58,6 +65,7 @@ class Transfer:
         self.bookkeepingBlockComplete = None
         self.LFN2PFNMap = None
         self.cleanedFiles = None
+        self.closedDatasets = None
 
     def readInfo(self):
         """
@@ -72,8 +80,8 @@ class Transfer:
             os.makedirs('task_process/transfers')
         # read into memory
         self.readLastTransferLine()
-        self.readTransferItems()
         self.buildLFN2transferItemMap()
+        self.readTransferItems()
         self.readRESTInfo()
         self.readInfoFromTransferItems()
         self.buildMultiPubContainerNames()
@@ -82,6 +90,7 @@ class Transfer:
         self.readBlockComplete()
         self.readLFN2PFNMap()
         self.readCleanedFiles()
+        self.readClosedDatasets()
 
     def readInfoFromRucio(self, rucioClient):
         """
@@ -95,9 +104,11 @@ class Transfer:
     def readLastTransferLine(self):
         """
         Reading lastTransferLine from task_process/transfers/last_transfer.txt
+        and lastTransferOffset from task_process/transfers/last_transfer_offset.txt
         """
         if not config.args.force_last_line is None: # Need explicitly compare to None
             self.lastTransferLine = config.args.force_last_line
+            self.lastTransferOffset = findLineOffset(config.args.transfers_txt_path, self.lastTransferLine)
             return
         path = config.args.last_line_path
         try:
@@ -106,46 +117,91 @@ class Transfer:
         except FileNotFoundError:
             self.logger.info(f'{path} not found. Assume it is first time it run.')
             self.lastTransferLine = 0
+        path = config.args.last_offset_path
+        try:
+            with open(path, 'r', encoding='utf-8') as r:
+                self.lastTransferOffset = int(r.read())
+        except FileNotFoundError:
+            # bookkeeping from before offsets were introduced, find it once from the line number
+            self.lastTransferOffset = findLineOffset(config.args.transfers_txt_path, self.lastTransferLine)
 
     def updateLastTransferLine(self, line):
         """
         Update lastTransferLine to task_process/transfers/last_transfer.txt
+        and the corresponding byte offset to task_process/transfers/last_transfer_offset.txt
 
-        :param line: line number
+        :param line: line number, must not be before the first line of `transferItems`
         :type line: int
         """
-        self.lastTransferLine = line
+        processed = min(line - self.transferItemsStartLine, len(self.transferItemsEndOffsets))
+        if processed > 0:
+            self.lastTransferOffset = self.transferItemsEndOffsets[processed - 1]
+        self.lastTransferLine = self.transferItemsStartLine + processed
+        path = config.args.last_offset_path
+        with writePath(path) as w:
+            w.write(str(self.lastTransferOffset))
         path = config.args.last_line_path
         with writePath(path) as w:
             w.write(str(self.lastTransferLine))
 
     def readTransferItems(self):
         """
-        Reading transferItems (whole files) from task_process/transfers.txt
+        Reading transferItems from task_process/transfers.txt, only lines after
+        lastTransferOffset are read. Lines which are not in the index yet
+        are added to LFN2transferItemMap.
+        Items of first job in the file are read into firstJobTransferItems.
         """
         path = config.args.transfers_txt_path
-        try:
-            with open(path, 'r', encoding='utf-8') as r:
-                for line in r:
-                    doc = json.loads(line)
-                    # Manipulate transfers dicts when running integration test
-                    if config.args.force_publishname:
-                        doc = manipulateOutputDataset(doc, config.args.force_publishname)
-                    self.transferItems.append(doc)
-        except FileNotFoundError as ex:
-            raise RucioTransferException(f'{path} does not exist. Probably no completed jobs in the task yet.') from ex
+        if not os.path.exists(path):
+            raise RucioTransferException(f'{path} does not exist. Probably no completed jobs in the task yet.')
+        self.transferItemsStartLine = self.lastTransferLine
+        newIndexEntries = []
+        startOffset = min(self.lastTransferOffset, self.LFN2transferItemMap.indexedOffset)
+        for line, nextOffset in readNewLines(path, startOffset):
+            doc = json.loads(line)
+            # Manipulate transfers dicts when running integration test
+            if config.args.force_publishname:
+                doc = manipulateOutputDataset(doc, config.args.force_publishname)
+            lineOffset = nextOffset - len(line.encode('utf-8'))
+            if lineOffset >= self.LFN2transferItemMap.indexedOffset:
+                newIndexEntries.append((doc, lineOffset, nextOffset))
+            if lineOffset >= self.lastTransferOffset:
+                self.transferItems.append(doc)
+                self.transferItemsEndOffsets.append(nextOffset)
+        self.LFN2transferItemMap.update(newIndexEntries)
+        self.logger.info(f'Got {len(self.transferItems)} new transfer items starting from line {self.lastTransferLine}.')
         if len(self.transferItems) == 0:
             raise RucioTransferException(f'{path} does not contain new entry.')
+        self.readFirstJobTransferItems()
+
+    def readFirstJobTransferItems(self):
+        """
+        Read the transferItems of the first job in task_process/transfers.txt,
+        i.e. from the beginning of the file until job_id changes.
+        """
+        self.firstJobTransferItems = []
+        for line, _ in readNewLines(config.args.transfers_txt_path):
+            doc = json.loads(line)
+            if config.args.force_publishname:
+                doc = manipulateOutputDataset(doc, config.args.force_publishname)
+            if self.firstJobTransferItems and doc['job_id'] != self.firstJobTransferItems[0]['job_id']:
+                break
+            self.firstJobTransferItems.append(doc)
 
     def buildLFN2transferItemMap(self):
         """
-        Create map from destination LFN to transferItem.
+        Load the map from destination LFN to transferItem from the index
+        file task_process/transfers/transfers_index.txt.
         Note that LFN2transferItemMap only point to latest `destination_lfn` in
         case job has been retry.
         """
-        self.LFN2transferItemMap = {}
-        for x in self.transferItems:
-            self.LFN2transferItemMap[x['destination_lfn']] = x
+        transform = None
+        if config.args.force_publishname:
+            transform = lambda doc: manipulateOutputDataset(doc, config.args.force_publishname)
+        self.LFN2transferItemMap = TransferItemsIndex(config.args.transfers_txt_path,
+                                                      config.args.transfers_index_path,
+                                                      transform)
+        self.LFN2transferItemMap.load()
 
     def readRESTInfo(self):
         """
@@ -167,8 +223,9 @@ class Transfer:
         Need to execute readTransferItems before this method.
         """
         # Get publish container name from the file that need to publish.
-        info = self.transferItems[0]
-        for t in self.transferItems:
+        # All jobs have the same outputs, so looking at the first one is enough.
+        info = self.firstJobTransferItems[0]
+        for t in self.firstJobTransferItems:
             if not t['outputdataset'].startswith('/FakeDataset'):
                 info = t
                 break
@@ -206,10 +263,7 @@ class Transfer:
         length, but only relies on validation from REST.
         """
         multiPubContainers = []
-        jobID = self.transferItems[0]['job_id']
-        for item in self.transferItems:
-            if item['job_id'] != jobID:
-                break
+        for item in self.firstJobTransferItems:
             if item['outputdataset'].startswith('/FakeDataset'):
                 filename = parseFileNameFromLFN(item['destination_lfn'])
                 # Alter Rucio container name from `/FakeDataset/fakefile/USER`
@@ -260,20 +314,12 @@ class Transfer:
     def readOKLocks(self):
         """
         Read bookkeepingOKLocks from task_process/transfers/transfers_ok.txt.
-        Initialize empty list in case of path not found or
+        Initialize empty set in case of path not found or
         `--ignore-transfer-ok` is `True`.
         """
-        if config.args.ignore_transfer_ok:
-            self.bookkeepingOKLocks = []
-            return
         path = config.args.transfer_ok_path
-        try:
-            with open(path, 'r', encoding='utf-8') as r:
-                self.bookkeepingOKLocks = r.read().splitlines()
-                self.logger.info(f'Got list of "OK" locks from bookkeeping: {self.bookkeepingOKLocks}')
-        except FileNotFoundError:
-            self.bookkeepingOKLocks = []
-            self.logger.info(f'Bookkeeping path "{path}" does not exist. Assume this is first time it run.')
+        self.bookkeepingOKLocks = BookkeepingSet(path, config.args.ignore_transfer_ok)
+        self.logger.info(f'Got {len(self.bookkeepingOKLocks)} "OK" locks from bookkeeping: {path}')
 
     def updateOKLocks(self, newLocks):
         """
@@ -282,46 +328,30 @@ class Transfer:
         :param newLocks: list of LFN
         :type newLocks: list of string
         """
-        self.bookkeepingOKLocks += newLocks
-        path = config.args.transfer_ok_path
-        self.logger.info(f'Bookkeeping transfer status OK: {self.bookkeepingOKLocks}')
-        self.logger.info(f'to file: {path}')
-        with writePath(path) as w:
-            for l in self.bookkeepingOKLocks:
-                w.write(f'{l}\n')
+        added = self.bookkeepingOKLocks.add(newLocks)
+        self.logger.info(f'Bookkeeping transfer status OK: {added}')
+        self.logger.info(f'to file: {self.bookkeepingOKLocks.path}')
 
     def readBlockComplete(self):
         """
-        Read bookkeepingBlockComplete from task_process/transfers/transfers_ok.txt.
-        Initialize empty list in case of path not found or
-        `--ignore-transfer-ok` is `True`.
+        Read bookkeepingBlockComplete from task_process/transfers/block_complete.txt.
+        Initialize empty set in case of path not found or
+        `--ignore-bookkeeping-block-complete` is `True`.
         """
-        if config.args.ignore_bookkeeping_block_complete:
-            self.bookkeepingBlockComplete = []
-            return
         path = config.args.bookkeeping_block_complete_path
-        try:
-            with open(path, 'r', encoding='utf-8') as r:
-                self.bookkeepingBlockComplete = r.read().splitlines()
-                self.logger.info(f'Got list of block complete from bookkeeping: {self.bookkeepingBlockComplete}')
-        except FileNotFoundError:
-            self.bookkeepingBlockComplete = []
-            self.logger.info(f'Bookkeeping block complete path "{path}" does not exist. Assume this is first time it run.')
+        self.bookkeepingBlockComplete = BookkeepingSet(path, config.args.ignore_bookkeeping_block_complete)
+        self.logger.info(f'Got {len(self.bookkeepingBlockComplete)} block complete from bookkeeping: {path}')
 
     def updateBlockComplete(self, newBlocks):
         """
-        update bookkeepingBlockComplete to task_process/transfers/transfers_ok.txt
+        update bookkeepingBlockComplete to task_process/transfers/block_complete.txt
 
-        :param newBlocks: list of LFN
+        :param newBlocks: list of block name
         :type newBlocks: list of string
         """
-        self.bookkeepingBlockComplete += newBlocks
-        path = config.args.bookkeeping_block_complete_path
-        self.logger.info (f'Bookkeeping block complete to file: {path}')
-        self.logger.debug(f'{self.bookkeepingBlockComplete}')
-        with writePath(path) as w:
-            for l in self.bookkeepingBlockComplete:
-                w.write(f'{l}\n')
+        added = self.bookkeepingBlockComplete.add(newBlocks)
+        self.logger.info (f'Bookkeeping block complete to file: {self.bookkeepingBlockComplete.path}')
+        self.logger.debug(f'{added}')
 
 
     def populateLFN2DatasetMap(self, container, rucioClient):
@@ -330,6 +360,9 @@ class Transfer:
         in `self.replicasInContainer` as a map of LFN to the dataset name it
         attaches to.
 
+        Content of datasets in `self.closedDatasets` can not change anymore,
+        so it is taken from bookkeeping and only open datasets are listed.
+
         :param container: container name
         :type: str
         :param rucioClient: Rucio client object
@@ -340,11 +373,50 @@ class Transfer:
         replicasInContainer = {}
         datasets = rucioClient.list_content(self.rucioScope, container)
         for ds in datasets:
-            files = rucioClient.list_content(self.rucioScope, ds['name'])
+            if ds['name'] in self.closedDatasets:
+                files = self.closedDatasets[ds['name']]
+            else:
+                files = [f['name'] for f in rucioClient.list_content(self.rucioScope, ds['name'])]
             for f in files:
-                replicasInContainer[f['name']] = ds['name']
+                replicasInContainer[f] = ds['name']
         return replicasInContainer
 
+    def readClosedDatasets(self):
+        """
+        Read `self.closedDatasets`, the map of datasets closed by
+        RegisterReplicas to the list of their LFNs, from
+        task_process/transfers/closed_datasets.json.
+        Initialize empty dict in case of path not found or
+        `--ignore-closed-datasets` is `True`.
+        """
+        if config.args.ignore_closed_datasets:
+            self.closedDatasets = {}
+            return
+        path = config.args.closed_datasets_path
+        try:
+            with open(path, 'r', encoding='utf-8') as r:
+                self.closedDatasets = json.load(r)
+                self.logger.info(f'Got {len(self.closedDatasets)} closed datasets from bookkeeping: {path}')
+        except FileNotFoundError:
+            self.closedDatasets = {}
+            self.logger.info(f'Bookkeeping closed datasets file "{path}" does not exist. Assume this is first time it run.')
+
+    def updateClosedDatasets(self, dataset, lfns):
+        """
+        Add `dataset` to `self.closedDatasets` and update
+        task_process/transfers/closed_datasets.json
+
+        :param dataset: dataset name
+        :type dataset: string
+        :param lfns: LFNs attached to dataset
+        :type lfns: list of string
+        """
+        self.closedDatasets[dataset] = list(lfns)
+        path = config.args.closed_datasets_path
+        self.logger.info(f'Bookkeeping closed dataset {dataset} to file: {path}')
+        with writePath(path) as w:
+            json.dump(self.closedDatasets, w)
+
     def readLFN2PFNMap(self):
         """
         Read LFN2PFNMap from task_process/transfers/lfn2pfn_map.json
@@ -377,33 +449,113 @@ class Transfer:
 
     def readCleanedFiles(self):
         """
-        Read `self.cleanedFiles` from task_process/transfers/cleaned_files.json
-        Initialize empty dict in case of path not found or
+        Read `self.cleanedFiles` from task_process/transfers/cleaned_files.txt
+        Initialize empty set in case of path not found or
         `--ignore-cleanup-files` is `True`.
+        Tasks started before it was a txt file have a cleaned_files.json list
+        instead, which is converted the first time.
         """
-        if config.args.ignore_cleaned_files:
-            self.cleanedFiles = []
-            return
         path = config.args.cleaned_files_path
-        try:
-            with open(path, 'r', encoding='utf-8') as r:
-                self.cleanedFiles = json.load(r)
-                self.logger.info(f'Got `cleanedFiles` from bookkeeping: {self.cleanedFiles}')
-        except FileNotFoundError:
-            self.cleanedFiles = []
-            self.logger.info(f'`cleanedFiles` "{path}" does not exist. Assume this is first time it run.')
+        self.cleanedFiles = BookkeepingSet(path, config.args.ignore_cleaned_files)
+        oldPath = os.path.splitext(path)[0] + '.json'
+        if not config.args.ignore_cleaned_files and not os.path.exists(path) and os.path.exists(oldPath):
+            with open(oldPath, 'r', encoding='utf-8') as r:
+                self.cleanedFiles.add(json.load(r))
+            self.logger.info(f'Converted `cleanedFiles` from old bookkeeping: {oldPath}')
+        self.logger.info(f'Got {len(self.cleanedFiles)} `cleanedFiles` from bookkeeping: {path}')
 
-    def updateCleanedFiles(self):
+    def updateCleanedFiles(self, newFiles):
         """
-        update LFN2PFNMap to task_process/transfers/lfn2pfn_map.json
-        Note that we did not check if dict in self.LFN2PFNMap are conform with
-        format we expected.
+        update `self.cleanedFiles` to task_process/transfers/cleaned_files.txt
+
+        :param newFiles: list of LFN
+        :type newFiles: list of string
         """
-        path = config.args.cleaned_files_path
-        self.logger.info (f'Bookkeeping `self.cleanedFiles` to file: {path}')
-        self.logger.debug(f'self.cleanedFiles: {self.cleanedFiles}')
-        with writePath(path) as w:
-            json.dump(self.cleanedFiles, w)
+        added = self.cleanedFiles.add(newFiles)
+        self.logger.info (f'Bookkeeping `self.cleanedFiles` to file: {self.cleanedFiles.path}')
+        self.logger.debug(f'new cleanedFiles: {added}')
+
+
+class TransferItemsIndex(dict):
+    """
+    Map of destination_lfn to transferItem for all lines of task_process/transfers.txt
+    which does not require to parse the whole file at every run.
+    It is backed by an append-only index file with one tab-separated line per
+    transferItem with its byte offset in transfers.txt and the (few) fields
+    which are used by the actions. The full transferItem is read from transfers.txt
+    only if some other field is requested.
+    """
+    FIELDS = ('destination_lfn', 'id', 'source', 'source_lfn', 'outputdataset')
+
+    def __init__(self, transfersPath, indexPath, transform=None):
+        super().__init__()
+        self.transfersPath = transfersPath
+        self.indexPath = indexPath
+        self.transform = transform
+        # byte offset in transfers.txt up to which lines are in the index
+        self.indexedOffset = 0
+
+    def load(self):
+        """
+        Read the index file. A line which is being written is left for next time.
+        """
+        if not os.path.exists(self.indexPath):
+            return
+        for line, _ in readNewLines(self.indexPath):
+            values = line.rstrip('\n').split('\t')
+            offset, nextOffset = int(values[0]), int(values[1])
+            self[values[2]] = TransferItem(self, offset, zip(self.FIELDS, values[2:]))
+            self.indexedOffset = max(self.indexedOffset, nextOffset)
+
+    def update(self, entries):  # pylint: disable=arguments-differ
+        """
+        Append new transferItems to the map and to the index file.
+
+        :param entries: list of tuple (transferItem, byte offset of the line, byte offset after the line)
+        :type entries: list
+        """
+        if not entries:
+            return
+        lines = []
+        for doc, offset, nextOffset in entries:
+            values = [str(doc[field]) for field in self.FIELDS]
+            lines.append('\t'.join([str(offset), str(nextOffset)] + values) + '\n')
+            item = TransferItem(self, offset, zip(self.FIELDS, values))
+            item.update(doc)
+            self[doc['destination_lfn']] = item
+            self.indexedOffset = max(self.indexedOffset, nextOffset)
+        with open(self.indexPath, 'a', encoding='utf-8') as w:
+            w.write(''.join(lines))
+
+    def readItem(self, offset):
+        """
+        Read full transferItem from the line at `offset` in transfers.txt
+        """
+        with open(self.transfersPath, 'rb') as r:
+            r.seek(offset)
+            doc = json.loads(r.readline().decode('utf-8'))
+        if self.transform:
+            doc = self.transform(doc)
+        return doc
+
+
+class TransferItem(dict):
+    """
+    transferItem from TransferItemsIndex. Fields which are not in the index
+    are read from transfers.txt on first access.
+    """
+    def __init__(self, index, offset, fields):
+        super().__init__(fields)
+        self.index = index
+        self.offset = offset
+        self.complete = False
+
+    def __missing__(self, key):
+        if self.complete:
+            raise KeyError(key)
+        self.update(self.index.readItem(self.offset))
+        self.complete = True
+        return self[key]
 
 
 def manipulateOutputDataset(transfer, forcePubName):
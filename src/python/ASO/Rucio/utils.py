@@ -4,6 +4,8 @@ The utility function of Rucio ASO.
 import shutil
 import re
 import os
+import json
+import time
 import itertools
 import subprocess
 from contextlib import contextmanager
@@ -29,6 +31,185 @@ def writePath(path):
         yield w
     shutil.move(tmpPath, path)
 
+
+class BookkeepingSet:
+    """
+    Set of names (LFN, block name, ...) persisted to an append-only file with
+    one name per line, for O(1) membership test and to only write the new
+    names at every run instead of rewriting the whole file.
+    Iteration follows insertion order.
+
+    :param path: path of bookkeeping file
+    :type path: str
+    :param ignore: ignore the content of existing file, which will be
+        overwritten on first `add()`
+    :type ignore: bool
+    """
+    def __init__(self, path, ignore=False):
+        self.path = path
+        self.items = {}
+        self.overwrite = ignore
+        if not ignore:
+            self.load()
+
+    def load(self):
+        """
+        Read names from file. Do nothing if file does not exist.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as r:
+                self.items = dict.fromkeys(r.read().splitlines())
+        except FileNotFoundError:
+            self.items = {}
+
+    def add(self, names):
+        """
+        Add names and append the ones which are not in the set yet to file.
+
+        :param names: names to add
+        :type names: iterable of str
+        :return: names which were not in the set
+        :rtype: list of str
+        """
+        newNames = [x for x in dict.fromkeys(names) if x not in self.items]
+        if not newNames and not self.overwrite:
+            return newNames
+        with open(self.path, 'w' if self.overwrite else 'a', encoding='utf-8') as w:
+            w.write(''.join(f'{x}\n' for x in newNames))
+        self.overwrite = False
+        self.items.update(dict.fromkeys(newNames))
+        return newNames
+
+    def __contains__(self, name):
+        return name in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class PFNPrefixCache:
+    """
+    Schedd-wide cache of the transfer scheme and of the LFN to PFN prefix
+    rules of each (source RSE, destination RSE) pair, resolved by
+    `RegisterReplicas.getSourcePFN()`. It is a json file shared by all
+    task_process of the schedd, so that in steady state no `get_protocols()`
+    or `lfns2pfns()` calls are needed. Entries older than `ttl` seconds are
+    ignored and resolved again.
+
+    lfn2pfn/TFC rules can depend on the path, so a PFN prefix is learned
+    separately for each area below `/store/temp/` (e.g. `/store/temp/user/`),
+    from the first `lfns2pfns()` result for a LFN in that area.
+
+    The file is rewritten with a per process temp file and `os.rename()`, so
+    concurrent writers can lose each other updates, but never corrupt it.
+    A file which is not owned by the user running this code is ignored
+    and never written, so that nobody else can feed us wrong PFNs.
+
+    :param path: path of the cache file
+    :type path: str
+    :param ttl: lifetime of the entries in seconds
+    :type ttl: int
+    """
+    TEMP_AREA = '/store/temp/'
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        self.loadTime = 0
+        self.usable = True
+
+    @staticmethod
+    def key(sourceRSE, destinationRSE):
+        """
+        Return key of the entry of the RSE pair.
+        """
+        return f'{sourceRSE}:{destinationRSE}'
+
+    @classmethod
+    def area(cls, lfn):
+        """
+        Return the area below `/store/temp/` of `lfn`, e.g. `/store/temp/user/`,
+        `None` if `lfn` is not in `/store/temp/`.
+        """
+        if not lfn.startswith(cls.TEMP_AREA):
+            return None
+        subdir = lfn[len(cls.TEMP_AREA):].split('/', 1)[0]
+        return f'{cls.TEMP_AREA}{subdir}/' if subdir else None
+
+    def load(self):
+        """
+        (Re)read the cache file, at most once per minute. A missing or
+        unreadable file is an empty cache.
+        """
+        if time.time() - self.loadTime < 60:
+            return
+        self.loadTime = time.time()
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as r:
+                if os.fstat(r.fileno()).st_uid != os.getuid():
+                    self.usable = False
+                    return
+                self.entries = json.load(r)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, sourceRSE, destinationRSE):
+        """
+        Return the entry of the RSE pair, `None` if not cached or expired.
+
+        :return: dict with `scheme`, `rules` ({area: pfnPrefix}) and `time` keys
+        :rtype: dict
+        """
+        self.load()
+        entry = self.entries.get(self.key(sourceRSE, destinationRSE))
+        if not entry or 'rules' not in entry or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry
+
+    def put(self, sourceRSE, destinationRSE, scheme, lfn, pfn):
+        """
+        Store scheme and the prefix rule for the area of `lfn` derived from
+        a resolved `lfn`, `pfn` couple, keeping the rules already known for
+        the other areas. The rule is only kept if `pfn` ends with `lfn`,
+        otherwise only the scheme is cached.
+        Failure to write the file is not fatal.
+        """
+        self.loadTime = 0
+        self.load()
+        if not self.usable:
+            return
+        entry = self.get(sourceRSE, destinationRSE)
+        if not entry or entry['scheme'] != scheme:
+            entry = {'scheme': scheme, 'rules': {}, 'time': time.time()}
+        area = self.area(lfn)
+        if area and pfn.endswith(lfn):
+            entry['rules'][area] = pfn[:len(pfn) - len(lfn)]
+        self.entries[self.key(sourceRSE, destinationRSE)] = entry
+        tmpPath = f'{self.path}.{os.getpid()}'
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+            with open(tmpPath, 'w', encoding='utf-8') as w:
+                json.dump(self.entries, w)
+            os.rename(tmpPath, self.path)
+        except OSError:
+            pass
+
+    @classmethod
+    def resolve(cls, entry, lfn):
+        """
+        Return PFN of `lfn` with the prefix rule of `entry` for its area,
+        `None` if the entry has no rule for it.
+        """
+        pfnPrefix = entry['rules'].get(cls.area(lfn))
+        if pfnPrefix is None:
+            return None
+        return pfnPrefix + lfn
+
 def chunks(l, n=1):
     """
     Yield successive n-sized chunks from l.
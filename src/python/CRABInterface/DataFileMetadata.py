@@ -1,6 +1,6 @@
 """ This module implement the data part of the filemetadata API (RESTFilemetadata)
     Its main method is inject (that corerspond to a PUT) that INSERT or UPDATE a file
-    (if it already exists)
+    (if it already exists), and injectMany which does the same for many files at once
 """
 
 import json
@@ -14,6 +14,9 @@ from CRABInterface.Utilities import getDBinstance
 class DataFileMetadata(object):
     """ DataFileMetadata class
     """
+    # max number of LFNs in one SQL query
+    LFN_CHUNK_SIZE = 1000
+
     @staticmethod
     def globalinit(dbapi, config):
         """ Called by RESTBaseAPI to initialize some parameters that are common between all the DataFileMetadata instances"""
@@ -36,13 +39,8 @@ class DataFileMetadata(object):
             binds = {'taskname': taskname, 'filetype': filetype, 'howmany': howmany}
             allRows = self.api.query_load_all_rows(None, None, self.FileMetaData.GetFromTaskAndType_sql, **binds)
         else:
-            allRows = []
             lfns = makeList(lfnList)  # from a string to a python list of strings
-            for lfn in lfns:
-                binds = {'taskname': taskname, 'lfn': lfn}
-                rows = self.api.query_load_all_rows(None, None, self.FileMetaData.GetFromTaskAndLfn_sql, **binds)
-                for row in rows:  # above call returns a generator, but we want a list
-                    allRows.append(row)
+            allRows = self.getRowsFromLfnList(taskname, lfns)
         for row in allRows:
             row = self.FileMetaData.GetFromTaskAndType_tuple(*row)
             filedict = {
@@ -70,15 +68,77 @@ class DataFileMetadata(object):
             }
             yield json.dumps(filedict)
 
+    def getRowsFromLfnList(self, taskname, lfns):
+        """ Query the metadata of a list of LFNs with one query for each chunk of at most
+            LFN_CHUNK_SIZE files (max number of items in an Oracle IN list).
+            Number of binds in the IN list is padded to a power of 2 (repeating the last
+            LFN) so that only a few different statements need to be parsed by Oracle.
+            Returns a generator, rows are fetched one chunk at a time.
+        """
+        for i in range(0, len(lfns), self.LFN_CHUNK_SIZE):
+            chunk = lfns[i:i + self.LFN_CHUNK_SIZE]
+            size = 1
+            while size < len(chunk):
+                size *= 2
+            size = min(size, self.LFN_CHUNK_SIZE)
+            chunk += [chunk[-1]] * (size - len(chunk))
+            binds = {'taskname': taskname}
+            for num, lfn in enumerate(chunk):
+                binds['lfn%d' % num] = lfn
+            sql = self.FileMetaData.GetFromTaskAndLfnList_sql % ', '.join(':lfn%d' % num for num in range(size))
+            for row in self.api.query_load_all_rows(None, None, sql, **binds):
+                yield row
+
     def inject(self, **kwargs):
         """ Insert or update a record in the database
         """
         self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
 
+        binds = dict((name, [value]) for name, value in self.fileBinds(kwargs).items())
+
+        #Changed to Select if exist, update, else insert
+        row = self.api.query(None, None, self.FileMetaData.GetCurrent_sql,
+                              outlfn=binds['outlfn'][0], taskname=binds['taskname'][0])
+        try:
+            #just one row is picked up by the previous query
+            row = next(row)
+        except StopIteration:
+            #StipIteration will be raised if no rows was found
+            self.logger.debug('No rows selected. Inserting new row into filemetadata')
+            self.api.modify(self.FileMetaData.New_sql, **binds)
+            return []
+        self.logger.debug('Changing filemetadata information about job %s' % row)
+        update_bind = {}
+        update_bind['outtmplocation'] = binds['outtmplocation']
+        update_bind['outsize'] = binds['outsize']
+        update_bind['taskname'] = binds['taskname']
+        update_bind['outlfn'] = binds['outlfn']
+        update_bind['outtmplfn'] = binds['outlfn']
+        self.api.modify(self.FileMetaData.Update_sql, **update_bind)
+        return []
+
+    def injectMany(self, taskname, filesmetadata):
+        """ Insert or update the records of many files (e.g. all input or output files
+            of a job) with a single array bound MERGE statement.
+            filesmetadata is a list of dictionaries with the same arguments as inject (but taskname)
+        """
+        self.logger.debug("Calling jobmetadata injectMany for %d files of task %s" % (len(filesmetadata), taskname))
+        binds = {}
+        for fileMetadata in filesmetadata:
+            fileMetadata = dict(fileMetadata, taskname=taskname)
+            for name, value in self.fileBinds(fileMetadata).items():
+                binds.setdefault(name, []).append(value)
+        self.api.modify(self.FileMetaData.Merge_sql, **binds)
+        return []
+
+    def fileBinds(self, kwargs):
+        """ Prepare the binds for the New_sql and Merge_sql statements
+            from the metadata of one file as passed to inject
+        """
         bindnames = set(kwargs.keys()) - set(['outfileruns', 'outfilelumis'])
         binds = {}
         for name in bindnames:
-            binds[name] = [kwargs[name]]
+            binds[name] = kwargs[name]
 
         # Modify all incoming metadata to have the structure 'lumi1:events1,lumi2:events2..'
         # instead of 'lumi1,lumi2,lumi3...' if necessary.
@@ -100,29 +160,9 @@ class DataFileMetadata(object):
             lumiEventList.append(lumiDict)
         runList = kwargs['outfileruns']
         # fmd_runlumi column in FILEMETADATA table is CLOB, so need to cast into a string here
-        binds['runlumi'] = [str(dict(zip(runList, lumiEventList)))]
-
-        #Changed to Select if exist, update, else insert
+        binds['runlumi'] = str(dict(zip(runList, lumiEventList)))
         binds['outtmplfn'] = binds['outlfn']
-        row = self.api.query(None, None, self.FileMetaData.GetCurrent_sql,
-                              outlfn=binds['outlfn'][0], taskname=binds['taskname'][0])
-        try:
-            #just one row is picked up by the previous query
-            row = next(row)
-        except StopIteration:
-            #StipIteration will be raised if no rows was found
-            self.logger.debug('No rows selected. Inserting new row into filemetadata')
-            self.api.modify(self.FileMetaData.New_sql, **binds)
-            return []
-        self.logger.debug('Changing filemetadata information about job %s' % row)
-        update_bind = {}
-        update_bind['outtmplocation'] = binds['outtmplocation']
-        update_bind['outsize'] = binds['outsize']
-        update_bind['taskname'] = binds['taskname']
-        update_bind['outlfn'] = binds['outlfn']
-        update_bind['outtmplfn'] = binds['outlfn']
-        self.api.modify(self.FileMetaData.Update_sql, **update_bind)
-        return []
+        return binds
 
     def changeState(self, **kwargs): #kwargs are (taskname, outlfn, filestate)
         """ UNUSED method that change the fmd_filestate column of a filemetadata record
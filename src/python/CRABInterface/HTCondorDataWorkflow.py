@@ -135,15 +135,14 @@ class HTCondorDataWorkflow(DataWorkflow):
         binds = {}
         binds['username'] = user
         binds['taskname'] = workflow
-        res = list(self.api.query(None, None, self.transferDB.GetTaskStatusForPublication_sql, **binds))
+        # results are already grouped by state: rows are (state, count)
+        res = list(self.api.query(None, None, self.transferDB.GetTaskPublicationStatusSummary_sql, **binds))
 
-        #group results by state
         statusDict = {}
-        for row in res:
-            status = row[2]
+        for status, count in res:
             statusStr = PUBLICATIONDB_STATES[status].lower()
             if status != 5:
-                statusDict[statusStr] = statusDict.setdefault(statusStr, 0) + 1
+                statusDict[statusStr] = count
 
         #format and return
         publicationInfo['status'] = statusDict
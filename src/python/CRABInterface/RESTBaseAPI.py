@@ -10,6 +10,7 @@ import cherrypy
 # WMCore dependecies here
 from WMCore.REST.Server import DatabaseRESTApi, rows
 from WMCore.REST.Format import JSONFormat
+from WMCore.REST.Error import MissingObject
 
 # CRABServer dependecies here
 from CRABInterface.RESTUserWorkflow import RESTUserWorkflow
@@ -80,6 +81,36 @@ class RESTBaseAPI(DatabaseRESTApi):
         cherrypy.request.db["handle"]["connection"].commit()
         return rows([{ "modified": c.rowcount }])
 
+    def modifymanywithcounts(self, sql, checkeach=False, **kwbinds):
+        """Run a modify statement for all the binds with a single executemany
+           call in one transaction, like `modifynocheck`, but return the number
+           of modified rows for each element of the binds.
+
+        :arg str sql: SQL modify statement.
+        :arg bool checkeach: if True, raise MissingObject (and do not commit)
+                             when any element of the binds did not modify exactly one row.
+        :arg dict kwbinds: Bind variables by keyword: dictionary of equal length lists.
+        :result: list of int, number of modified rows per element of the binds
+                 (None with MySQL, which does not provide it)."""
+        kwbinds = self.bindmap(**kwbinds)
+        if not kwbinds:
+            return []
+        if cherrypy.request.db['type'].__name__ == 'MySQLdb':
+            self.executemany(sql, kwbinds)
+            counts = [None] * len(kwbinds)
+        else:
+            c, _ = self.executemany(sql, kwbinds, arraydmlrowcounts=True)
+            counts = c.getarraydmlrowcounts()
+        if checkeach:
+            failed = [i for i, count in enumerate(counts) if count is not None and count != 1]
+            if failed:
+                raise MissingObject(info="%d of %d binds did not modify exactly one row, first one at position %d"
+                                         % (len(failed), len(counts), failed[0]))
+        trace = cherrypy.request.db["handle"]["trace"]
+        trace and cherrypy.log("%s commit" % trace)  # pylint: disable=expression-not-assigned
+        cherrypy.request.db["handle"]["connection"].commit()
+        return counts
+
     def execute(self, sql, *binds, **kwbinds):
         """overrides WMCore/REST/Server.py/DatabaseRESTApi.execute() function
            in order to measure time used by cursor.execute(). Code is copied
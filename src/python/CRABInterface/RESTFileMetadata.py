@@ -1,6 +1,8 @@
+import json
+
 # WMCore dependecies here
 from WMCore.REST.Error import InvalidParameter
-from WMCore.REST.Server import RESTEntity, restcall
+from WMCore.REST.Server import RESTEntity, RESTArgs, restcall
 from WMCore.REST.Validation import validate_str, validate_strlist, validate_num
 
 # CRABServer dependecies here
@@ -24,37 +26,22 @@ class RESTFileMetadata(RESTEntity):
 
         if method in ['PUT']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
-            validate_strlist("outfileruns", param, safe, RX_RUNS)
-            if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
-                raise InvalidParameter("The number of runs and the number of lumis lists are different")
-            validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
-            # inparentlfns will be inserted in Oracle as CLOB, so it must be a string
-            safe.kwargs['inparentlfns'] = str(safe.kwargs['inparentlfns'])
-            validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
-            validate_str("jobid", param, safe, RX_JOBID, optional=True)
-            validate_num("outsize", param, safe, optional=False)
-            validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
-            validate_str("appver", param, safe, RX_CMSSW, optional=False)
-            validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
-            validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
-            validate_num("checksumcksum", param, safe, optional=False)
-            validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
-            validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)
-            validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)
-            # need to use RX_PARENTLFN becasue same API is also used for input metadata
-            validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
-            validate_str("outtmplfn", param, safe, RX_LFN, optional=True)
-            validate_num("events", param, safe, optional=False)
-            validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
-            validate_num("directstageout", param, safe, optional=True)
-            safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+            if param.kwargs.get("filesmetadata", None):
+                # bulk upload: a JSON list with one dictionary per file, each one
+                # with the same parameters as the PUT of a single file (except taskname)
+                self.validateFilesMetadata(param, safe)
+            else:
+                safe.kwargs["filesmetadata"] = None
+                self.validateFileMetadata(param, safe)
         elif method in ['POST']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_str("outlfn", param, safe, RX_LFN, optional=False)
-            validate_str("filestate", param, safe, RX_FILESTATE, optional=False)
+            # a POST with lfnList is a bulk retrieval of metadata: the list of LFNs
+            # is in the body so it does not hit the URL length limit
+            validate_str("lfnList", param, safe, RX_ANYTHING, optional=True)
+            validate_str("filetype", param, safe, RX_OUTTYPES, optional=True)
+            bulkRetrieval = bool(safe.kwargs["lfnList"])
+            validate_str("outlfn", param, safe, RX_LFN, optional=bulkRetrieval)
+            validate_str("filestate", param, safe, RX_FILESTATE, optional=bulkRetrieval)
         elif method in ['GET']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
             validate_str("filetype", param, safe, RX_OUTTYPES, optional=True)
@@ -68,6 +55,64 @@ class RESTFileMetadata(RESTEntity):
                 raise InvalidParameter("You have to specify a taskname or a number of hours. Files of this task or created before the number of hours"+\
                                         " will be deleted. Only one of the two parameters can be specified.")
 
+    @staticmethod
+    def validateFileMetadata(param, safe):
+        """Validate the metadata of one file, as uploaded with PUT"""
+        validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
+        validate_strlist("outfileruns", param, safe, RX_RUNS)
+        if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
+            raise InvalidParameter("The number of runs and the number of lumis lists are different")
+        validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
+        # inparentlfns will be inserted in Oracle as CLOB, so it must be a string
+        safe.kwargs['inparentlfns'] = str(safe.kwargs['inparentlfns'])
+        validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
+        validate_str("jobid", param, safe, RX_JOBID, optional=True)
+        validate_num("outsize", param, safe, optional=False)
+        validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
+        validate_str("appver", param, safe, RX_CMSSW, optional=False)
+        validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
+        validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
+        validate_num("checksumcksum", param, safe, optional=False)
+        validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
+        validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)
+        validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)
+        # need to use RX_PARENTLFN becasue same API is also used for input metadata
+        validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
+        validate_str("outtmplfn", param, safe, RX_LFN, optional=True)
+        validate_num("events", param, safe, optional=False)
+        validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
+        validate_num("directstageout", param, safe, optional=True)
+        safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+
+    @staticmethod
+    def validateFilesMetadata(param, safe):
+        """Validate the filesmetadata parameter of a bulk PUT, i.e. a JSON list of
+           dictionaries with the metadata of one file each, validated as in validateFileMetadata.
+           The validated list of dictionaries is put in safe.kwargs["filesmetadata"]
+           and the parameters of the single file PUT are set to None
+        """
+        validate_str("filesmetadata", param, safe, RX_ANYTHING, optional=False)
+        try:
+            filesMetadata = json.loads(safe.kwargs["filesmetadata"])
+        except Exception as ex:
+            raise InvalidParameter("filesmetadata is not valid JSON") from ex
+        if not isinstance(filesMetadata, list) or not filesMetadata or \
+           not all(isinstance(fileMetadata, dict) for fileMetadata in filesMetadata):
+            raise InvalidParameter("filesmetadata must be a non empty list of dictionaries")
+        validated = []
+        for fileMetadata in filesMetadata:
+            fileParam = RESTArgs([], fileMetadata)
+            fileSafe = RESTArgs([], {})
+            RESTFileMetadata.validateFileMetadata(fileParam, fileSafe)
+            if fileParam.kwargs:
+                raise InvalidParameter(f"Excess keyword arguments in filesmetadata, not validated kwargs={fileParam.kwargs}")
+            validated.append(fileSafe.kwargs)
+        safe.kwargs["filesmetadata"] = validated
+        for argname in validated[0]:
+            safe.kwargs[argname] = None
+
     ## A few notes about how the following methods (put, post, get, delete) work when decorated with restcall.
     ## * The order of the arguments is irrelevant. For example, these two definitions are equivalent:
     ##   def get(self, a, b) or def get(self, b, a)
@@ -78,9 +123,12 @@ class RESTFileMetadata(RESTEntity):
     ## * The name of the arguments has to be the same as used in the http request, and the same as used in validate().
 
     @restcall
-    def put(self, taskname, outfilelumis, inparentlfns, globalTag, outfileruns, jobid, outsize, publishdataname, appver, outtype, checksummd5,\
+    def put(self, taskname, filesmetadata, outfilelumis, inparentlfns, globalTag, outfileruns, jobid, outsize, publishdataname, appver, outtype, checksummd5,\
             checksumcksum, checksumadler32, outlocation, outtmplocation, outdatasetname, acquisitionera, outlfn, events, filestate, directstageout, outtmplfn):
-        """Insert a new job metadata information"""
+        """Insert a new job metadata information, or those of many files
+           at once if filesmetadata is given"""
+        if filesmetadata:
+            return self.jobmetadata.injectMany(taskname=taskname, filesmetadata=filesmetadata)
         return self.jobmetadata.inject(taskname=taskname, outfilelumis=outfilelumis, inparentlfns=inparentlfns, globalTag=globalTag, outfileruns=outfileruns,\
                            jobid=jobid, outsize=outsize, publishdataname=publishdataname, appver=appver, outtype=outtype, checksummd5=checksummd5,\
                            checksumcksum=checksumcksum, checksumadler32=checksumadler32, outlocation=outlocation, outtmplocation=outtmplocation,\
@@ -88,9 +136,18 @@ class RESTFileMetadata(RESTEntity):
                            directstageout=directstageout)
 
     @restcall
-    def post(self, taskname, outlfn, filestate):
-        """Modifies and existing job metadata information"""
+    def post(self, taskname, outlfn, filestate, filetype, lfnList):
+        """Modifies and existing job metadata information, or if lfnList is given
+           retrieves the metadata of those files like `get` does.
 
+           :arg str taskname: unique name identifier of the task;
+           :arg str outlfn: the LFN of the file to modify;
+           :arg str filestate: the new state of the file;
+           :arg str filetype: filter the file type to return (only with lfnList);
+           :arg str lfnList: list of LFNs for which to retrieve metadata;
+           :return: generator looping through the resulting db rows, in case of lfnList."""
+        if lfnList:
+            return self.jobmetadata.getFiles(taskname, filetype, None, lfnList)
         return self.jobmetadata.changeState(taskname=taskname, outlfn=outlfn, filestate=filestate)
 
     @restcall
@@ -10,7 +10,7 @@ from CRABInterface.RESTExtensions import authz_login_valid, authz_operator_witho
 from CRABInterface.Regexps import RX_USERNAME, RX_VOPARAMS, RX_TASKNAME, RX_SUBGETTRANSFER, RX_SUBPOSTTRANSFER, \
                                   RX_CMSSITE, RX_ASO_WORKERNAME, RX_ANYTHING
 
-from ServerUtilities import TRANSFERDB_STATUSES, PUBLICATIONDB_STATUSES
+from ServerUtilities import TRANSFERDB_STATUSES, PUBLICATIONDB_STATUSES, MeasureTime
 # external dependecies here
 import time, logging
 
@@ -146,56 +146,46 @@ class RESTFileTransfers(RESTEntity):
             # Always required variables:
             # (str) asoworker: ASO Worker name to be set for transfers which were acquired
             ###############################################
-            binds['last_update'] = [timeNow]
+            # All ids are updated with a single executemany in one transaction.
+            # Returns the number of modified rows for each id.
+            ids = makeList(kwargs['list_of_ids'])
+            states = makeList(kwargs['list_of_transfer_state'])
+            binds['last_update'] = [timeNow for x in ids]
+            binds['asoworker'] = [kwargs['asoworker'] for x in ids]
+            binds['id'] = ids
+            binds['transfer_state'] = [TRANSFERDB_STATUSES[x] for x in states]
             # TODO: fix case: if 'fts_instance' in kwargs
             if kwargs['list_of_fts_instance']:
-                #del errorMsg
-                ids = makeList(kwargs['list_of_ids'])
-                states = makeList(kwargs['list_of_transfer_state'])
-                retry = [0 for x in states]
-                reasons = ["" for x in states]
-                instances = makeList(kwargs['list_of_fts_instance'])
-                fts_id = makeList(kwargs['list_of_fts_id'])
-
-                for num in range(len(ids)):
-                    binds['id'] = [ids[num]]
-                    binds['transfer_state'] = [TRANSFERDB_STATUSES[states[num]]]
-                    binds['fts_instance'] = [str(instances[num])]
-                    binds['fts_id'] = [str(fts_id[num])]
-                    binds['fail_reason'] = [reasons[num]]
-                    binds['retry_value'] = [int(retry[num])]
-                    self.api.modifynocheck(self.transferDB.UpdateTransfers_sql, **binds)
+                binds['fts_instance'] = [str(x) for x in makeList(kwargs['list_of_fts_instance'])]
+                binds['fts_id'] = [str(x) for x in makeList(kwargs['list_of_fts_id'])]
+                binds['fail_reason'] = ["" for x in ids]
+                binds['retry_value'] = [0 for x in ids]
             else:
-                ids = makeList(kwargs['list_of_ids'])
-                states = makeList(kwargs['list_of_transfer_state'])
-                retry = [0 for x in states]
-                reasons = ["" for x in states]
+                binds['fts_instance'] = [None for x in ids]
+                binds['fts_id'] = [None for x in ids]
+                binds['fail_reason'] = ["" for x in ids]
+                binds['retry_value'] = [0 for x in ids]
                 if kwargs['list_of_retry_value'] is not None:
-                    reasons = makeList(kwargs['list_of_failure_reason'])
-                    retry = makeList(kwargs['list_of_retry_value'])
-                for num in range(len(ids)):
-                    binds['id'] = [ids[num]]
-                    binds['transfer_state'] = [TRANSFERDB_STATUSES[states[num]]]
-                    binds['fts_instance'] = [None]
-                    binds['fts_id'] = [None]
-                    binds['fail_reason'] = [reasons[num]]
-                    binds['retry_value'] = [int(retry[num])]
-                    self.api.modifynocheck(self.transferDB.UpdateTransfers_sql, **binds)
+                    binds['fail_reason'] = makeList(kwargs['list_of_failure_reason'])
+                    binds['retry_value'] = [int(x) for x in makeList(kwargs['list_of_retry_value'])]
+            with MeasureTime(self.logger, modulename=__name__, label="post.updateTransfers") as _:
+                counts = self.api.modifymanywithcounts(self.transferDB.UpdateTransfers_sql, **binds)
+            return [{'id': oneId, 'modified': count} for oneId, count in zip(ids, counts)]
 
         elif subresource == 'updateRucioInfo':
-            binds['last_update'] = [timeNow]
             ids = makeList(kwargs['list_of_ids'])
-            blocknames = [None for x in ids]
-            blockcompletes = [None for x in ids]
+            binds['last_update'] = [timeNow for x in ids]
+            binds['asoworker'] = [kwargs['asoworker'] for x in ids]
+            binds['id'] = ids
+            binds['dbs_blockname'] = [None for x in ids]
+            binds['block_complete'] = [None for x in ids]
             if kwargs['list_of_dbs_blockname'] is not None:
-                blocknames = makeList(kwargs['list_of_dbs_blockname'])
+                binds['dbs_blockname'] = makeList(kwargs['list_of_dbs_blockname'])
             if kwargs['list_of_block_complete'] is not None:
-                blockcompletes = makeList(kwargs['list_of_block_complete'])
-            for num in range(len(ids)):
-                binds['id'] = [ids[num]]
-                binds['dbs_blockname'] = [blocknames[num]]
-                binds['block_complete'] = [blockcompletes[num]]
-                self.api.modifynocheck(self.transferDB.UpdateRucioInfo_sql, **binds)
+                binds['block_complete'] = makeList(kwargs['list_of_block_complete'])
+            with MeasureTime(self.logger, modulename=__name__, label="post.updateRucioInfo") as _:
+                counts = self.api.modifymanywithcounts(self.transferDB.UpdateRucioInfo_sql, **binds)
+            return [{'id': oneId, 'modified': count} for oneId, count in zip(ids, counts)]
 
         elif subresource == 'updatePublication':
             ###############################################
@@ -212,24 +202,26 @@ class RESTFileTransfers(RESTEntity):
             # Always required variables:
             # (str) asoworker: ASO Worker name for which acquire Publication.
             ###############################################
-            binds['last_update'] = [timeNow]
             #compareOut, errorMsg = self.compareLen(kwargs, ['list_of_ids', 'list_of_publication_state'])
             #if compareOut:
             #    del errorMsg
+            # As with `modify`, every id must match exactly one row, otherwise
+            # nothing is committed.
             ids = makeList(kwargs['list_of_ids'])
             states = makeList(kwargs['list_of_publication_state'])
-            retry = [0 for x in states]
-            reasons = ["" for x in states]
+            binds['last_update'] = [timeNow for x in ids]
+            binds['asoworker'] = [kwargs['asoworker'] for x in ids]
+            binds['id'] = ids
+            binds['publication_state'] = [PUBLICATIONDB_STATUSES[x] for x in states]
+            binds['fail_reason'] = ["" for x in ids]
+            binds['retry_value'] = [0 for x in ids]
             if kwargs['list_of_retry_value'] is not None:
-                reasons = makeList(kwargs['list_of_failure_reason'])
-                retry = makeList(kwargs['list_of_retry_value'])
-            for num in range(len(ids)):
-                binds['publication_state'] = [PUBLICATIONDB_STATUSES[states[num]]]
-                binds['id'] = [ids[num]]
-                binds['fail_reason'] = [reasons[num]]
-                binds['retry_value'] = [int(retry[num])]
-                binds['publish'] = [kwargs["publish_flag"] or -1]
-                self.api.modify(self.transferDB.UpdatePublication_sql, **binds)
+                binds['fail_reason'] = makeList(kwargs['list_of_failure_reason'])
+                binds['retry_value'] = [int(x) for x in makeList(kwargs['list_of_retry_value'])]
+            binds['publish'] = [kwargs["publish_flag"] or -1 for x in ids]
+            with MeasureTime(self.logger, modulename=__name__, label="post.updatePublication") as _:
+                counts = self.api.modifymanywithcounts(self.transferDB.UpdatePublication_sql, checkeach=True, **binds)
+            return [{'id': oneId, 'modified': count} for oneId, count in zip(ids, counts)]
 
         elif subresource == 'retryPublication':
             ###############################################
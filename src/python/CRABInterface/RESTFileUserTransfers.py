@@ -88,6 +88,7 @@ class RESTFileUserTransfers(RESTEntity):
             validate_str("id", param, safe, RX_TASKNAME, optional=True)
             validate_str("username", param, safe, RX_USERNAME, optional=True)
             validate_str("taskname", param, safe, RX_TASKNAME, optional=True)
+            validate_num("since", param, safe, optional=True)
         elif method in ['DELETE']:
             raise UnsupportedMethod('This method is not supported in this API!')
 
@@ -226,7 +227,7 @@ class RESTFileUserTransfers(RESTEntity):
             # For the future to allow users to retry Transfers
 
     @restcall
-    def get(self, subresource, id, username, taskname):
+    def get(self, subresource, id, username, taskname, since):
         """ Retrieve all columns for a specified task or
             """
         binds = {}
@@ -260,7 +261,12 @@ class RESTFileUserTransfers(RESTEntity):
             # Always required variables:
             # username: username
             # taskname: taskname
+            # Optional variables:
+            # since: only return files modified after this time (tm_last_update)
             ###############################################
+            if since:
+                binds['since'] = since
+                return self.api.query_load_all_rows(None, None, self.transferDB.GetTaskStatusForTransfersSince_sql, **binds)
             ret = self.api.query_load_all_rows(None, None, self.transferDB.GetTaskStatusForTransfers_sql, **binds)
             return ret
         elif subresource == 'getPublicationStatus':
@@ -275,6 +281,30 @@ class RESTFileUserTransfers(RESTEntity):
             # taskname: taskname
             ###############################################
             return self.api.query(None, None, self.transferDB.GetTaskStatusForPublication_sql, **binds)
+        elif subresource == 'getTransferStatusSummary':
+            ###############################################
+            # getTransferStatusSummary API
+            # ---------------------------------------------
+            # Description:
+            # Get number of files in each transfer state for specific task which belongs to user
+            # ---------------------------------------------
+            # Always required variables:
+            # username: username
+            # taskname: taskname
+            ###############################################
+            return self.api.query(None, None, self.transferDB.GetTaskTransferStatusSummary_sql, **binds)
+        elif subresource == 'getPublicationStatusSummary':
+            ###############################################
+            # getPublicationStatusSummary API
+            # ---------------------------------------------
+            # Description:
+            # Get number of files in each publication state for specific task which belongs to user
+            # ---------------------------------------------
+            # Always required variables:
+            # username: username
+            # taskname: taskname
+            ###############################################
+            return self.api.query(None, None, self.transferDB.GetTaskPublicationStatusSummary_sql, **binds)
         return {}
 
     @restcall
@@ -4,7 +4,7 @@
 from builtins import str
 from Utils.Utilities import decodeBytesToUnicode
 from WMCore.REST.Server import RESTEntity, restcall
-from WMCore.REST.Validation import validate_str, validate_num
+from WMCore.REST.Validation import validate_str, validate_num, validate_strlist
 from WMCore.REST.Error import InvalidParameter
 
 from ServerUtilities import getEpochFromDBTime
@@ -40,6 +40,10 @@ class RESTWorkerWorkflow(RESTEntity):
             validate_str("subresource", param, safe, RX_SUBPOSTWORKER, optional=True)
             validate_num("limit", param, safe, optional=True)
             validate_num("clusterid", param, safe, optional=True) #clusterid of the dag
+            # for bulkstate: lists with one element for each task
+            validate_strlist("workflows", param, safe, RX_TASKNAME)
+            validate_strlist("statuses", param, safe, RX_STATUS)
+            validate_strlist("commands", param, safe, RX_STATUS)
             # possible combinations to check
             # 1) taskname + status
             # 2) taskname + status + failure
@@ -47,6 +51,7 @@ class RESTWorkerWorkflow(RESTEntity):
             # 4) taskname + status == (1)
             # 5)            status + limit + getstatus + workername
             # 6) taskname + runs + lumis
+            # 7) taskname + status + command lists (bulkstate)
         elif method in ['GET']:
             validate_str("workername", param, safe, RX_WORKER_NAME, optional=True)
             validate_str("getstatus", param, safe, RX_STATUS, optional=True)
@@ -58,10 +63,16 @@ class RESTWorkerWorkflow(RESTEntity):
 
 
     @restcall
-    def post(self, workflow, status, command, subresource, failure, getstatus, workername, limit, clusterid):
+    def post(self, workflow, status, command, subresource, failure, getstatus, workername, limit, clusterid,
+             workflows, statuses, commands):
         """ Updates task information """
+        if subresource == 'bulkstate' and not (len(workflows) == len(statuses) == len(commands) > 0):
+            raise InvalidParameter("bulkstate needs the same number of workflows, statuses and commands")
         methodmap = {"state": {"args": (self.Task.SetStatusTask_sql,), "method": self.api.modify, "kwargs": {"status": [status],
                      "command": [command], "taskname": [workflow]}},
+                     # same as state for many tasks in one DB round-trip. Fails (and changes nothing) if any task is not found
+                     "bulkstate": {"args": (self.Task.SetStatusTasks_sql,), "method": self.api.modify, "kwargs": {"status": statuses,
+                                   "command": commands, "taskname": workflows}},
                      #TODO MM - I don't see where this start API is used
                      "start": {"args": (self.Task.SetReadyTasks_sql,), "method": self.api.modify, "kwargs": {"tm_task_status": [status],
                                "tm_taskname": [workflow]}},
@@ -107,7 +107,7 @@ RX_DATE = re.compile(r"^(19|20)\d\d[- /.](0[1-9]|1[012])[- /.](0[1-9]|[12][0-9]|
 ## user dn
 RX_DN = re.compile(r"^/(?:C|O|DC)=.*/CN=.")
 ## worker subresources
-RX_SUBPOSTWORKER = re.compile(r"^(state|start|failure|success|process|lumimask)$")
+RX_SUBPOSTWORKER = re.compile(r"^(state|bulkstate|start|failure|success|process|lumimask)$")
 
 # Schedulers
 RX_SCHEDULER = re.compile(r"^(condor)$")
@@ -140,7 +140,7 @@ RX_TRANSFER_STATE = re.compile(r"^[01234567]")
 RX_PUBLISH_STATE = re.compile(r"^[01234]")
 RX_ASO_WORKERNAME = RX_WORKER_NAME
 
-RX_SUBGETUSERTRANSFER = re.compile(r"^(getById|getTransferStatus|getPublicationStatus)$")
+RX_SUBGETUSERTRANSFER = re.compile(r"^(getById|getTransferStatus|getPublicationStatus|getTransferStatusSummary|getPublicationStatusSummary)$")
 RX_SUBPOSTUSERTRANSFER = re.compile(r"^(killTransfers|retryPublication|retryTransfers|killTransfersById|updateDoc)$")
 
 # CUDAVersion style,  i.e. 11.4, 515.43.04
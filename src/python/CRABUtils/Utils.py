@@ -40,3 +40,29 @@ def addToGZippedTarfile(fileList=None, tarFile=None):
     # non-atomic replace but compatible with both py2/py3.
     os.remove(tarFile)
     os.rename(tmp, tarFile)
+
+
+def mergeCompactLumiLists(compactLists=None):
+    """
+    merge many compact lumi lists like {'1': [[1, 33], [35, 35]], '2': [[1, 45]]}
+    collecting all ranges of each run and coalescing them in a single sort pass.
+    The result is the same as the compact list of the sum of the corresponding
+    WMCore LumiList's, w/o building a new LumiList for each addition
+    """
+    ranges = {}
+    for compactList in compactLists:
+        for run, pairs in compactList.items():
+            if pairs:
+                ranges.setdefault(str(run), []).extend(pairs)
+    merged = {}
+    for run, pairs in ranges.items():
+        pairs.sort()
+        unique = [list(pairs[0])]
+        for first, last in pairs[1:]:
+            if first <= unique[-1][1] + 1:
+                if last > unique[-1][1]:
+                    unique[-1][1] = last
+            else:
+                unique.append([first, last])
+        merged[run] = unique
+    return merged
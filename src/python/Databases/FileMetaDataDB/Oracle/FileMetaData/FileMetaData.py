@@ -95,6 +95,34 @@ class FileMetaData(object):
                     AND fmd_lfn = :lfn 
              """
 
+    # to be formatted with a list of bind names, e.g. ":lfn0, :lfn1, ..." (at most 1000 in Oracle)
+    GetFromTaskAndLfnList_sql = """SELECT \
+                           job_id AS jobid, \
+                           fmd_outdataset AS outdataset, \
+                           fmd_acq_era AS acquisitionera, \
+                           fmd_sw_ver AS swversion, \
+                           fmd_in_events AS inevents, \
+                           fmd_global_tag AS globaltag, \
+                           fmd_publish_name AS publishname, \
+                           fmd_location AS location, \
+                           fmd_tmp_location AS tmplocation, \
+                           fmd_runlumi AS runlumi, \
+                           fmd_adler32 AS adler32, \
+                           fmd_cksum AS cksum, \
+                           fmd_md5 AS md5, \
+                           fmd_lfn AS lfn, \
+                           fmd_size AS filesize, \
+                           fmd_parent AS parents, \
+                           fmd_filestate AS state, \
+                           fmd_creation_time AS created, \
+                           fmd_tmplfn AS tmplfn, \
+                           fmd_type AS type, \
+                           fmd_direct_stageout AS directstageout
+                    FROM filemetadata \
+                    WHERE tm_taskname = :taskname \
+                    AND fmd_lfn IN (%s)
+             """
+
     New_sql = "INSERT INTO filemetadata ( \
                tm_taskname, job_id, fmd_outdataset, fmd_acq_era, fmd_sw_ver, fmd_in_events, fmd_global_tag,\
                fmd_publish_name, fmd_location, fmd_tmp_location, fmd_runlumi, fmd_adler32, fmd_cksum, fmd_md5, fmd_lfn, fmd_size,\
@@ -106,6 +134,19 @@ class FileMetaData(object):
     Update_sql = """UPDATE filemetadata SET fmd_tmp_location = :outtmplocation, fmd_size = :outsize, fmd_tmplfn = :outtmplfn \
                     WHERE tm_taskname = :taskname AND fmd_lfn = :outlfn"""
 
+    # same as GetCurrent_sql followed by New_sql or Update_sql, in one statement which can be array bound
+    Merge_sql = "MERGE INTO filemetadata f \
+               USING (SELECT :taskname AS taskname, :outlfn AS lfn FROM dual) n \
+               ON (f.tm_taskname = n.taskname AND f.fmd_lfn = n.lfn) \
+               WHEN MATCHED THEN UPDATE SET fmd_tmp_location = :outtmplocation, fmd_size = :outsize, fmd_tmplfn = :outtmplfn \
+               WHEN NOT MATCHED THEN INSERT ( \
+               tm_taskname, job_id, fmd_outdataset, fmd_acq_era, fmd_sw_ver, fmd_in_events, fmd_global_tag,\
+               fmd_publish_name, fmd_location, fmd_tmp_location, fmd_runlumi, fmd_adler32, fmd_cksum, fmd_md5, fmd_lfn, fmd_size,\
+               fmd_type, fmd_parent, fmd_creation_time, fmd_filestate, fmd_direct_stageout, fmd_tmplfn) \
+               VALUES (:taskname, :jobid, :outdatasetname, :acquisitionera, :appver, :events, :globalTag,\
+                       :publishdataname, :outlocation, :outtmplocation, :runlumi, :checksumadler32, :checksumcksum, :checksummd5, :outlfn, :outsize,\
+                       :outtype, :inparentlfns, SYS_EXTRACT_UTC(SYSTIMESTAMP), :filestate, :directstageout, :outtmplfn)"
+
     #the field selected here is not used, the query is only executed to check if a filemetadata for the file was already uploaded or not
     GetCurrent_sql = "SELECT fmd_lfn from filemetadata WHERE tm_taskname = :taskname AND fmd_lfn = :outlfn"
 
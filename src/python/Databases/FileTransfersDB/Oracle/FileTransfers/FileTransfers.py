@@ -273,6 +273,20 @@ class FileTransfers():
     GetTaskStatusForPublication_sql = "SELECT tm_id, tm_jobid, tm_publication_state, tm_start_time, \
                                        tm_last_update FROM filetransfersdb \
                                        WHERE tm_username = :username AND tm_taskname = :taskname"  # ORDER BY tm_job_retry_count"
+    # same as GetTaskStatusForTransfers_sql but only for rows modified after :since,
+    # to refresh a cache of the statuses incrementally
+    GetTaskStatusForTransfersSince_sql = "SELECT tm_id, tm_jobid, tm_transfer_state, tm_start_time, \
+                                          tm_last_update, tm_fts_id, tm_fts_instance, tm_aso_worker \
+                                          FROM filetransfersdb \
+                                          WHERE tm_username = :username AND tm_taskname = :taskname \
+                                          AND tm_last_update > :since"
+    # number of files in each state, for summaries
+    GetTaskTransferStatusSummary_sql = "SELECT tm_transfer_state, count(*) FROM filetransfersdb \
+                                        WHERE tm_username = :username AND tm_taskname = :taskname \
+                                        GROUP BY tm_transfer_state"
+    GetTaskPublicationStatusSummary_sql = "SELECT tm_publication_state, count(*) FROM filetransfersdb \
+                                           WHERE tm_username = :username AND tm_taskname = :taskname \
+                                           GROUP BY tm_publication_state"
 
     GetActiveUsers_sql = "SELECT t.tm_username, t.tm_user_role, t.tm_user_group, count(*) \
                           FROM filetransfersdb f LEFT OUTER JOIN tasks t ON t.tm_taskname = f.tm_taskname \
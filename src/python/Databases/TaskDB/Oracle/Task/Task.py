@@ -144,6 +144,8 @@ class Task(object):
     SetStatusTask_sql = "UPDATE tasks SET tm_task_status = upper(:status), tm_task_command = upper(:command) WHERE tm_taskname = :taskname"
     #SetStatusTask -- Used by DataWorkflow.kill (crab kill). Really similar to SetStatusTask_sql but also set a warning.
     SetStatusWarningTask_sql = "UPDATE tasks SET tm_task_status = upper(:status), tm_task_command = upper(:command), tm_task_warnings = :warnings WHERE tm_taskname = :taskname"
+    #SetStatusTasks -- Used by the TW master to change status of many tasks at once. Executed with executemany, one row of binds per task
+    SetStatusTasks_sql = "UPDATE tasks SET tm_task_status = upper(:status), tm_task_command = upper(:command) WHERE tm_taskname = :taskname"
 
 
     # UpdateWorker simple version without ordering to ensure no race in case of multiple TWs
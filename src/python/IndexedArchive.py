@@ -0,0 +1,189 @@
+"""
+Indexed archive of small named text files. Used in place of tarballs with one
+file per job (e.g. the lumis and the input files of each job): a compressed tarball
+has no index, so reading one member means decompressing and scanning it from the start.
+
+An archive is made of two files:
+  <archiveName>      : the data, one json line [member name, content] per member.
+                       It is only appended to, offsets of existing lines never change
+  <archiveName>.idx  : an hash table of fixed size records (hash of member name, offset, length)
+                       pointing to the lines in the data file. It is rewritten (and
+                       atomically replaced) at each append
+A member is read with a couple of seeks, whatever the size of the archive.
+When a member with the same name is appended again, the index points to the last copy.
+
+This module only uses the standard library since it is shipped also to the
+worker nodes with the job wrapper (see cicd/crabtaskworker_pypi/buildTWTarballs.sh).
+"""
+import os
+import json
+import struct
+import hashlib
+import tarfile
+
+# the archive with the run/lumis and the input files of each job, written by DagmanCreator
+JOB_INPUTS_ARCHIVE = 'job_inputs.jsonl'
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'CRABIDX1'
+# magic, number of slots, number of members
+INDEX_HEADER = struct.Struct('<8sQQ')
+# hash of member name, offset and length of its line in the data file. Hash 0 marks an empty slot
+INDEX_RECORD = struct.Struct('<QQI')
+# fraction of used slots in the hash table
+INDEX_LOAD_FACTOR = 0.7
+
+
+def nameHash(name):
+    """ 64 bits hash of a member name, stable across processes and python versions """
+    digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def archiveExists(archiveName):
+    """ True if the archive has been created (the index is written last) """
+    return os.path.exists(archiveName + INDEX_SUFFIX)
+
+
+class ArchiveReader():
+    """
+    Reads members from an archive. Can be used as a context manager
+    """
+
+    def __init__(self, archiveName):
+        self.archiveName = archiveName
+        self.index = open(archiveName + INDEX_SUFFIX, 'rb')  # pylint: disable=consider-using-with
+        try:
+            magic, self.nSlots, self.nMembers = INDEX_HEADER.unpack(self.index.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{archiveName}{INDEX_SUFFIX} is not an archive index")
+            self.data = open(archiveName, 'rb')  # pylint: disable=consider-using-with
+        except Exception:
+            self.index.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ close the archive files """
+        self.index.close()
+        self.data.close()
+
+    def read(self, name):
+        """
+        returns the content of member name as a string
+        raises KeyError if there is no such member
+        """
+        wanted = nameHash(name)
+        slot = wanted % self.nSlots
+        for _ in range(self.nSlots):
+            self.index.seek(INDEX_HEADER.size + slot * INDEX_RECORD.size)
+            recordHash, offset, length = INDEX_RECORD.unpack(self.index.read(INDEX_RECORD.size))
+            if recordHash == 0:
+                break
+            if recordHash == wanted:
+                self.data.seek(offset)
+                memberName, content = json.loads(self.data.read(length).decode('utf-8'))
+                if memberName == name:
+                    return content
+            slot = (slot + 1) % self.nSlots
+        raise KeyError(f"filename {name!r} not found in {self.archiveName}")
+
+    def members(self):
+        """
+        iterates over all (name, content) in the data file, in the order they were
+        appended. Older copies of members which were appended again are included
+        """
+        self.data.seek(0)
+        for line in self.data:
+            name, content = json.loads(line.decode('utf-8'))
+            yield name, content
+
+
+def readIndexEntries(archiveName):
+    """ returns the list of (hash, offset, length) in the index of archiveName """
+    entries = []
+    with open(archiveName + INDEX_SUFFIX, 'rb') as fd:
+        magic, nSlots, _ = INDEX_HEADER.unpack(fd.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{archiveName}{INDEX_SUFFIX} is not an archive index")
+        table = fd.read(nSlots * INDEX_RECORD.size)
+    for record in INDEX_RECORD.iter_unpack(table):
+        if record[0]:
+            entries.append(record)
+    return entries
+
+
+def writeIndex(archiveName, entries):
+    """
+    write the index of archiveName for entries, a dictionary {hash: (offset, length)},
+    to a temporary file which then replaces the current index
+    """
+    nSlots = max(16, int(len(entries) / INDEX_LOAD_FACTOR) + 1)
+    table = bytearray(nSlots * INDEX_RECORD.size)
+    for recordHash, (offset, length) in entries.items():
+        slot = recordHash % nSlots
+        while INDEX_RECORD.unpack_from(table, slot * INDEX_RECORD.size)[0]:
+            slot = (slot + 1) % nSlots
+        INDEX_RECORD.pack_into(table, slot * INDEX_RECORD.size, recordHash, offset, length)
+    tmpName = f"{archiveName}{INDEX_SUFFIX}.{os.getpid()}"
+    with open(tmpName, 'wb') as fd:
+        fd.write(INDEX_HEADER.pack(INDEX_MAGIC, nSlots, len(entries)))
+        fd.write(table)
+    os.rename(tmpName, archiveName + INDEX_SUFFIX)
+
+
+def appendToArchive(archiveName, members):
+    """
+    append members, an iterable of (name, content) with content a string,
+    to archiveName, creating it if it does not exist, and rewrite the index.
+    Readers of the archive see either the old or the new members, never a mix
+    """
+    entries = {}
+    if archiveExists(archiveName):
+        for recordHash, offset, length in readIndexEntries(archiveName):
+            entries[recordHash] = (offset, length)
+    with open(archiveName, 'ab') as fd:
+        offset = fd.tell()
+        for name, content in members:
+            line = json.dumps([name, content]).encode('utf-8') + b'\n'
+            fd.write(line)
+            entries[nameHash(name)] = (offset, len(line))
+            offset += len(line)
+    writeIndex(archiveName, entries)
+
+
+def readMembers(archiveName, names, legacyTarball=None):
+    """
+    returns a dictionary {name: content} for the members in names.
+    If archiveName does not exist but legacyTarball does, members are read from
+    that tarball with one file per member (as used before this archive),
+    reading it only once.
+    raises KeyError if some name is not there
+    """
+    if not archiveExists(archiveName) and legacyTarball and os.path.exists(legacyTarball):
+        wanted = set(names)
+        result = {}
+        with tarfile.open(legacyTarball) as tf:
+            for member in tf:
+                if member.name in wanted and member.name not in result:
+                    with tf.extractfile(member) as fobj:
+                        result[member.name] = fobj.read().decode('utf-8')
+                    if len(result) == len(wanted):
+                        break
+        notFound = wanted - set(result)
+        if notFound:
+            raise KeyError(f"filename {sorted(notFound)[0]!r} not found in {legacyTarball}")
+        return result
+    with ArchiveReader(archiveName) as reader:
+        return {name: reader.read(name) for name in names}
+
+
+def readMember(archiveName, name, legacyTarball=None):
+    """
+    returns the content of member name, see readMembers
+    """
+    return readMembers(archiveName, [name], legacyTarball)[name]
@@ -8,6 +8,8 @@ import os
 import logging
 import json
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from random import uniform
 from datetime import datetime
 
@@ -15,11 +17,27 @@ from dbs.apis.dbsClient import DbsApi as DbsApiBase
 from dbs.exceptions.dbsClientException import dbsClientException
 from RestClient.ErrorHandling.RestClientExceptions import HTTPError
 
+from ServerUtilities import getLock
 from TaskWorker.WorkerExceptions import CannotMigrateException
 
 MAX_RETRY_ATTEMPTS = 3
 MIN_RETRY_DELAY = 10
 MAX_RETRY_DELAY = 3 * 60 # 3 minutes
+# DBS limits the length of logical_file_name lists to 1000
+MAX_LFNS_PER_DBS_QUERY = 1000
+PARENT_LOOKUP_THREADS = 8
+
+# Where parent files have been found, as (where, block_name) with where one of
+# 'destRead', 'source', 'global', None (not known to DBS) or 'invalid' (illegal LFN).
+# Keyed by (destination URL, source URL, lfn). Lives as long as the Publisher
+# slave process, i.e. one cycle, and is shared by the tasks/blocks it handles.
+# Files to be migrated are not cached since they will be in destination after migration.
+parentBlockCache = {}
+# DbsApi objects are not thread safe, each thread in the parent lookup pool has its own.
+threadLocalDbsApis = threading.local()
+# DBSApis dictionaries returned by setupDbsAPIs, keyed by its arguments, so that
+# a Publisher slave which publishes many tasks creates them only once
+dbsApisCache = {}
 
 class DbsApi(DbsApiBase):  # pylint: disable=too-few-public-methods
     """
@@ -89,6 +107,11 @@ def setupDbsAPIs(sourceURL=None, publishURL=None, DBSHost=None, logger=None):
 
     """
 
+    cacheKey = (sourceURL, publishURL, DBSHost)
+    if cacheKey in dbsApisCache:
+        logger.info("Reuse DBS APIs for %s and %s", sourceURL, publishURL)
+        return dbsApisCache[cacheKey]
+
     DBSApis = {}
 
     # When looking up parents may need to look in global DBS as well.
@@ -136,85 +159,127 @@ def setupDbsAPIs(sourceURL=None, publishURL=None, DBSHost=None, logger=None):
     DBSApis['destWrite'] = destApi
     DBSApis['global'] = globalApi
     DBSApis['migrate'] = migrateApi
-
+    dbsApisCache[cacheKey] = DBSApis
 
     return DBSApis
 
 
+def isIllegalLfnError(ex):
+    """
+    True if ex is DBS refusing the input of the query (HTTP code 400), e.g. because
+    of illegal DBS names (GH issue #6771). Any other error (timeouts, 5xx...) is not
+    telling anything about the files
+    """
+    return isinstance(ex, HTTPError) and ex.code == 400
+
+
+def lookupBlocksInBulk(api, lfns):
+    """
+    find the block of each LFN in one DBS instance using listFileArray with
+    lists of up to MAX_LFNS_PER_DBS_QUERY files
+    returns (found, failed): dictionary {lfn: block_name} for the files found and
+    list of files in the queries which DBS refused because of some illegal LFN
+    other errors are raised
+    """
+    found = {}
+    failed = []
+    for i in range(0, len(lfns), MAX_LFNS_PER_DBS_QUERY):
+        chunk = lfns[i:i + MAX_LFNS_PER_DBS_QUERY]
+        try:
+            filesDict = api.listFileArray(logical_file_name=chunk, detail=True)
+        except Exception as ex:
+            if not isIllegalLfnError(ex):
+                raise
+            failed.extend(chunk)
+            continue
+        for fileDict in filesDict:
+            found[fileDict['logical_file_name']] = fileDict['block_name']
+    return found, failed
+
+
+def lookupBlockOneByOne(url, lfn):
+    """
+    find the block of one LFN, to be run in the parent lookup thread pool
+    returns the block name, None if the file is not in DBS, 'invalid' if DBS refuses the LFN
+    other errors are raised
+    """
+    if not hasattr(threadLocalDbsApis, 'apis'):
+        threadLocalDbsApis.apis = {}
+    apis = threadLocalDbsApis.apis
+    if url not in apis:
+        apis[url] = DbsApi(url=url, debug=False)
+    try:
+        blocksDict = apis[url].listBlocks(logical_file_name=lfn)
+    except Exception as ex:
+        if not isIllegalLfnError(ex):
+            raise
+        return 'invalid'
+    return blocksDict[0]['block_name'] if blocksDict else None
+
+
 def findParentBlocks(listOfFileDicts=None, DBSApis=None,
                      logger=None, verbose=None):
     """ find parent blocks for a list of files"""
 
-    # Set of all the parent files from all the files requested to be published.
-    parentFiles = set()
-    # Set of parent files for which the migration to the destination DBS instance
-    # should be skipped (because they were not found in DBS).
-    parentsToSkip = set()
+    # Parent files are looked up first in the destination DBS instance (no need to migrate),
+    # then in the same DBS instance as the input dataset, then in global DBS.
+    # For each instance all files are queried in bulk, the ones which make DBS refuse the bulk
+    # query are retried one by one in a thread pool. Any other DBS error fails the lookup,
+    # and nothing is cached for it.
+    cacheKeyPrefix = (DBSApis['destRead'].url, DBSApis['source'].url)
+    parentFiles = {}  # where each parent file is, as in parentBlockCache
+    for file in listOfFileDicts:
+        if verbose:
+            logger.info(file)
+        for parentFile in file['parents']:
+            if parentFile not in parentFiles:
+                parentFiles[parentFile] = parentBlockCache.get(cacheKeyPrefix + (parentFile,))
+    toLookup = [lfn for lfn, where in parentFiles.items() if where is None]
+    for instance in ['destRead', 'source', 'global']:
+        if not toLookup:
+            break
+        found, failed = lookupBlocksInBulk(DBSApis[instance], toLookup)
+        if failed:
+            url = DBSApis[instance].url
+            with ThreadPoolExecutor(max_workers=PARENT_LOOKUP_THREADS) as pool:
+                blocks = pool.map(lambda lfn, url=url: lookupBlockOneByOne(url, lfn), failed)
+                for lfn, block in zip(failed, blocks):
+                    if block == 'invalid':
+                        parentFiles[lfn] = ('invalid', None)
+                    elif block:
+                        found[lfn] = block
+        for lfn, block in found.items():
+            parentFiles[lfn] = (instance, block)
+        toLookup = [lfn for lfn in toLookup if parentFiles[lfn] is None]
+    for lfn in toLookup:
+        # If this parent file is not in the destination DBS instance, is not
+        # the source DBS instance, and is not in global DBS instance, then it
+        # means it is not known to DBS and therefore we can not migrate it.
+        parentFiles[lfn] = (None, None)
+    for lfn, (where, block) in parentFiles.items():
+        if where not in ['source', 'global']:
+            parentBlockCache[cacheKeyPrefix + (lfn,)] = (where, block)
+
     # Set of parent files to migrate from the source DBS instance
     # to the destination DBS instance.
-    localParentBlocks = set()
+    localParentBlocks = {block for where, block in parentFiles.values() if where == 'source'}
     # Set of parent files to migrate from the global DBS instance
     # to the destination DBS instance.
-    globalParentBlocks = set()
+    globalParentBlocks = {block for where, block in parentFiles.values() if where == 'global'}
 
-    for file in listOfFileDicts:  # pylint: disable=too-many-nested-blocks
-        if verbose:
-            logger.info(file)
-        # Get the parent files and for each parent file do the following:
-        # 1) Add it to the list of parent files.
-        # 2) Find the block to which it belongs and insert that block name in
-        #    (one of) the set of blocks to be migrated to the destination DBS.
+    for file in listOfFileDicts:
         for parentFile in list(file['parents']):
-            if parentFile not in parentFiles:
-                parentFiles.add(parentFile)
-                # Is this parent file already in the destination DBS instance?
-                # (If yes, then we don't have to migrate this block.)
-                # some parent files are illegal DBS names (GH issue #6771),
-                # skip them
-                try:
-                    blocksDict = DBSApis['destRead'].listBlocks(
-                        logical_file_name=parentFile)
-                except Exception:
-                    file['parents'].remove(parentFile)
-                    continue
-                if not blocksDict:
-                    # No, this parent file is not in the destination DBS instance.
-                    # Maybe it is in the same DBS instance as the input
-                    # dataset?
-                    blocksDict = DBSApis['source'].listBlocks(
-                        logical_file_name=parentFile)
-                    if blocksDict:
-                        # Yes, this parent file is in the same DBS instance as the input dataset.
-                        # Add the corresponding block to the set of blocks from the source DBS
-                        # instance that have to be migrated to the destination
-                        # DBS.
-                        localParentBlocks.add(blocksDict[0]['block_name'])
-                    else:
-                        # No, this parent file is not in the same DBS instance as input dataset.
-                        # Maybe it is in global DBS instance?
-                        blocksDict = DBSApis['global'].listBlocks(
-                            logical_file_name=parentFile)
-                        if blocksDict:
-                            # Yes, this parent file is in global DBS instance.
-                            # Add the corresponding block to the set of blocks from global DBS
-                            # instance that have to be migrated to the
-                            # destination DBS.
-                            globalParentBlocks.add(blocksDict[0]['block_name'])
-                # If this parent file is not in the destination DBS instance, is not
-                # the source DBS instance, and is not in global DBS instance, then it
-                # means it is not known to DBS and therefore we can not migrate it.
-                # Put it in the set of parent files for which migration should
-                # be skipped.
-                if not blocksDict:
-                    parentsToSkip.add(parentFile)
+            where, _ = parentFiles[parentFile]
             # If this parent file should not be migrated because it is not known to DBS,
             # we remove it from the list of parents in the file-to-publish info dictionary
             # (so that when publishing, this "parent" file will not appear as a parent).
-            if parentFile in parentsToSkip:
+            # Some parent files are illegal DBS names (GH issue #6771), skip them silently
+            if where == 'invalid':
+                file['parents'].remove(parentFile)
+            elif where is None:
                 msg = f"Skipping parent file {parentFile}, as it doesn't seem to be known to DBS."
                 logger.info(msg)
-                if parentFile in file['parents']:
-                    file['parents'].remove(parentFile)
+                file['parents'].remove(parentFile)
     return (localParentBlocks, globalParentBlocks)
 
 
@@ -637,3 +702,154 @@ def checkBlockMigration(taskname, migrateApi, block, migLogDir, migrationAccount
         return inProgress, atDestination, failed
     # all OK, we got a usable status information
     return inProgress, atDestination, failed
+
+
+class MigrationManager():
+    """
+    Keeps track of the migrations of parent blocks needed by all blocks published
+    in one TaskPublish run, so that a block whose parents are being migrated can be
+    put aside while the other blocks are published, instead of waiting inside migrateByBlockDBS3.
+    Each parent block is requested only once, also across tasks in the same Publisher
+    cycle thanks to a registry of recently submitted migrations in migLogDir, and all
+    migrations in progress are checked together by poll()
+    """
+    # a migration submitted by another task less than this many seconds ago is not submitted again
+    RECENT_SUBMISSION_TIME = 600
+
+    def __init__(self, taskname, migrateApi, destReadApi, migLogDir, migrationAccounter, logger=None):
+        self.taskname = taskname
+        self.migrateApi = migrateApi
+        self.destReadApi = destReadApi
+        self.migLogDir = migLogDir
+        self.migrationAccounter = migrationAccounter
+        self.logger = logger if logger else logging.getLogger(taskname)
+        self.registryFile = os.path.join(migLogDir, 'submittedMigrations.txt')
+        # status of each block, one of 'inProgress', 'done', 'failed'
+        self.migrations = {}
+        self.verifiedDatasets = set()
+
+    def recentlySubmitted(self):
+        """
+        returns the set of blocks for which some task submitted a migration request
+        less than RECENT_SUBMISSION_TIME seconds ago, and rewrites the registry
+        without the older ones so that it does not grow across Publisher cycles
+        registry format is CSV: blockname, submission time in seconds from epoch
+        """
+        recent = set()
+        keptLines = []
+        now = time.time()
+        with getLock(self.registryFile):
+            try:
+                with open(self.registryFile, 'r', encoding='utf8') as fp:
+                    lines = fp.readlines()
+            except FileNotFoundError:
+                return recent
+            for line in lines:
+                block, _, submitted = line.strip().rpartition(',')
+                try:
+                    if now - int(submitted) < self.RECENT_SUBMISSION_TIME:
+                        recent.add(block)
+                        keptLines.append(line)
+                except ValueError:
+                    continue  # malformed line
+            if len(keptLines) < len(lines):
+                tmpFile = f"{self.registryFile}.{os.getpid()}"
+                with open(tmpFile, 'w', encoding='utf8') as fp:
+                    fp.write(''.join(keptLines))
+                os.replace(tmpFile, self.registryFile)
+        return recent
+
+    def register(self, blocks):
+        """ add the blocks for which a migration was submitted to the registry """
+        if not blocks:
+            return
+        now = int(time.time())
+        with getLock(self.registryFile):
+            with open(self.registryFile, 'a', encoding='utf8') as fp:
+                fp.write(''.join(f"{block},{now}\n" for block in blocks))
+
+    def request(self, sourceApi, blocks):
+        """
+        submit migration requests from sourceApi for the blocks not already being migrated
+        raises CannotMigrateException if some blocks have persistently failed migration
+        returns the number of blocks for which the migration request could not be submitted
+        """
+        newBlocks = [block for block in set(blocks) if self.migrations.get(block) not in ('inProgress', 'done')]
+        if not newBlocks:
+            return 0
+        badBlocks = self.migrationAccounter.checkForDoomedBlocks(newBlocks)
+        if badBlocks:
+            raise CannotMigrateException(f"Some blocks have persistently failed migration:\n{badBlocks}")
+        recent = self.recentlySubmitted()
+        submitted = []
+        numFailedSubmissions = 0
+        for block in newBlocks:
+            if block in recent:
+                self.logger.info("Migration of %s was already requested by another task", block)
+                self.migrations[block] = 'inProgress'
+                continue
+            if requestBlockMigration(self.taskname, self.migrateApi, sourceApi, block, self.migrationAccounter):
+                self.migrations[block] = 'inProgress'
+                submitted.append(block)
+            else:
+                self.migrations[block] = 'failed'
+                numFailedSubmissions += 1
+        self.register(submitted)
+        self.logger.info("%d block migration requests submitted, %d already submitted, %d failed to be submitted.",
+                         len(submitted), len(newBlocks) - len(submitted) - numFailedSubmissions,
+                         numFailedSubmissions)
+        return numFailedSubmissions
+
+    def inProgress(self):
+        """ returns the list of blocks whose migration is in progress """
+        return [block for block, status in self.migrations.items() if status == 'inProgress']
+
+    def poll(self):
+        """
+        check the status of all migrations in progress.
+        A migrated block is considered done only after its dataset is found in destination DBS
+        """
+        blocks = self.inProgress()
+        if not blocks:
+            return
+        self.logger.info("Checking status of %d block migrations in progress", len(blocks))
+        for block in blocks:
+            try:
+                _, atDestination, failed = checkBlockMigration(
+                    self.taskname, self.migrateApi, block, self.migLogDir, self.migrationAccounter)
+            except Exception as ex:
+                self.logger.error("Could not get migration status for %s:\n%s", block, ex)
+                continue  # will check status next time
+            if failed:
+                self.logger.error('Migration failed for %s', block)
+                self.migrations[block] = 'failed'
+            elif atDestination and self.verifyDataset(block.split('#')[0]):
+                self.logger.info('Migration completed for %s', block)
+                self.migrations[block] = 'done'
+
+    def verifyDataset(self, dataset):
+        """ returns True if the migrated dataset is present in destination DBS """
+        if dataset in self.verifiedDatasets:
+            return True
+        try:
+            migratedDataset = self.destReadApi.listDatasets(dataset=dataset, detail=True, dataset_access_type='*')
+        except Exception as ex:
+            self.logger.error("Migration check failed for %s: %s", dataset, ex)
+            return False
+        if not migratedDataset or migratedDataset[0].get('dataset', None) != dataset:
+            self.logger.info("Migrated dataset %s not yet visible in destination DBS", dataset)
+            return False
+        self.verifiedDatasets.add(dataset)
+        return True
+
+    def status(self, blocks):
+        """
+        returns the overall migration status of a list of blocks:
+        'failed' if any failed, else 'inProgress' if any is in progress, else 'done'
+        """
+        statuses = {self.migrations.get(block, 'failed') for block in blocks}
+        if 'failed' in statuses:
+            return 'failed'
+        if 'inProgress' in statuses:
+            return 'inProgress'
+        return 'done'
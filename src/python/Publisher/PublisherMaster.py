@@ -6,7 +6,7 @@ Here's the algorithm
 1. get active users
 2. choose N users where N is from the config
 3. create a multiprocessing Pool of size N
-4. spawn a process per task that publish their files
+4. each process in the pool publishes tasks one after the other
 """
 
 import argparse
@@ -17,7 +17,6 @@ import tempfile
 from datetime import datetime
 import time
 from pathlib import Path
-from multiprocessing import Process
 
 from WMCore.Configuration import loadConfigurationFile
 from WMCore.Services.Requests import Requests
@@ -27,7 +26,7 @@ from ServerUtilities import getHashLfn
 from ServerUtilities import getProxiedWebDir
 from TaskWorker.WorkerUtilities import getCrabserver
 
-from Publisher.PublisherUtils import createLogdir, setRootLogger, setSlaveLogger, logVersionAndConfig
+from Publisher.PublisherUtils import createLogdir, setRootLogger, setSlaveLogger, logVersionAndConfig, runSlavesPool
 from Publisher.PublisherUtils import getInfoFromFMD
 
 
@@ -249,45 +248,30 @@ class Master():  # pylint: disable=too-many-instance-attributes
             flag = '  OK' if acquiredFiles < 1000 else 'WARN'  # mark suspicious tasks
             self.logger.info('acquired_files: %s %5d : %s', flag, acquiredFiles, taskName)
 
-        processes = []
-        try:  # pylint: disable=too-many-nested-blocks
-            for task in tasks:
-                taskname = str(task[0][3])
-                # this IF is for testing on preprod or dev DB's, which are full of old unpublished tasks
-                if int(taskname[0:4]) < 2008:
-                    self.logger.info("Skipped %s. Ignore tasks created before August 2020.", taskname)
-                    continue
-                username = task[0][0]
-                if username in self.config.skipUsers:
-                    self.logger.info("Skipped user %s task %s", username, taskname)
-                    continue
-                if self.sequential:
-                    self.startSlave(task)   # sequentially do one task after another
-                    continue
-                # else deal with each task in a separate process
-                p = Process(target=self.startSlave, args=(task,))
-                p.start()
-                self.logger.info('Starting process %s  pid=%s', p, p.pid)
-                self.logger.info('PID %s will work on task %s', p.pid, taskname)
-                processes.append(p)
-                if len(processes) == maxSlaves:
-                    while len(processes) == maxSlaves:
-                        # wait until one process has completed
-                        time.sleep(10)
-                        for proc in processes.copy():
-                            if not proc.is_alive():
-                                self.logger.info('Terminated: %s pid=%s', proc, proc.pid)
-                                processes.remove(proc)
-
+        # tasks are processed by a pool of slaves, largest first so that they do not
+        # end up running alone at the end of the cycle while the other slaves are idle
+        tasksToDo = []
+        for task in tasks:
+            taskname = str(task[0][3])
+            # this IF is for testing on preprod or dev DB's, which are full of old unpublished tasks
+            if int(taskname[0:4]) < 2008:
+                self.logger.info("Skipped %s. Ignore tasks created before August 2020.", taskname)
+                continue
+            username = task[0][0]
+            if username in self.config.skipUsers:
+                self.logger.info("Skipped user %s task %s", username, taskname)
+                continue
+            tasksToDo.append(task)
+        tasksToDo.sort(key=lambda task: len(task[1]), reverse=True)
+        try:
+            if self.sequential:
+                for task in tasksToDo:
+                    self.startSlave(task)  # sequentially do one task after another
+            else:
+                runSlavesPool(master=self, tasks=[(str(task[0][3]), task) for task in tasksToDo],
+                              maxSlaves=maxSlaves, logger=self.logger)
         except Exception:  # pylint: disable=broad-except
             self.logger.exception("Error during process mapping")
-        self.logger.info('No more tasks to care for. Wait for remaining %d processes to terminate', len(processes))
-        while processes:
-            time.sleep(10)
-            for proc in processes.copy():
-                if not proc.is_alive():
-                    self.logger.info('Terminated: %s pid=%s', proc, proc.pid)
-                    processes.remove(proc)
 
         self.logger.info("Algorithm iteration completed")
         self.logger.info("Wait %d sec for next cycle", self.pollInterval())
@@ -429,7 +413,9 @@ class Master():  # pylint: disable=too-many-instance-attributes
                 else:
                     # retrieve information from FileMetadata
                     (publDescFiles_list, blackList) = getInfoFromFMD(
-                        crabServer=self.crabServer, taskname=workflow, lfns=lfn_ready, logger=logger)
+                        crabServer=self.crabServer, taskname=workflow, lfns=lfn_ready, logger=logger,
+                        chunkSize=getattr(self.config, 'fmdChunkSize', 200),
+                        maxThreads=getattr(self.config, 'fmdThreads', 4))
                     if blackList:
                         self.taskBlackList.append(workflow)  # notify this slave
                         filepath = Path(os.path.join(self.blackListedTaskDir, workflow))
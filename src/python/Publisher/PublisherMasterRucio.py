@@ -6,7 +6,7 @@ Here's the algorithm
 1. get active users
 2. choose N users where N is from the config
 3. create a multiprocessing Pool of size N
-4. spawn a process per task that publish their files
+4. each process in the pool publishes tasks one after the other
 """
 
 import argparse
@@ -15,16 +15,16 @@ import json
 import time
 
 from pathlib import Path
-from multiprocessing import Process
 
 from WMCore.Configuration import loadConfigurationFile
 
-from ServerUtilities import encodeRequest, oracleOutputMapping, executeCommand
+from ServerUtilities import encodeRequest
 from TaskWorker.WorkerUtilities import getCrabserver
 from RucioUtils import getNativeRucioClient
 
-from Publisher.PublisherUtils import createLogdir, setRootLogger, setSlaveLogger, logVersionAndConfig
+from Publisher.PublisherUtils import createLogdir, setRootLogger, setSlaveLogger, logVersionAndConfig, runSlavesPool
 from Publisher.PublisherUtils import getInfoFromFMD, markFailed
+from Publisher.TaskPublishRucio import publishInDBS3
 
 
 class Master():  # pylint: disable=too-many-instance-attributes
@@ -44,6 +44,7 @@ class Master():  # pylint: disable=too-many-instance-attributes
         config = loadConfigurationFile(confFile)
         self.config = config.General
         self.TPconfig = config.TaskPublisher
+        self.publisherConfig = config  # whole configuration, as needed by TaskPublishRucio
 
         # these are used for talking to DBS
         os.putenv('X509_USER_CERT', self.config.serviceCert)
@@ -89,7 +90,7 @@ class Master():  # pylint: disable=too-many-instance-attributes
         """
 
         self.logger.debug("Retrieving publications from oracleDB")
-        filesToPublish = []
+        taskDicts = {}  # {taskname: taskDict}
         asoworkers = self.config.asoworker
         # it is far from obvious that we will ever have same Publisher code for multiple asoworkers.. anyhow
         # asoworkers can be a string or a list of strings
@@ -120,50 +121,48 @@ class Master():  # pylint: disable=too-many-instance-attributes
             except Exception as ex:  # pylint: disable=broad-except
                 self.logger.error("Failed to acquire publications from crabserver: %s", ex)
                 return []
-            files = oracleOutputMapping(results)
-            self.logger.info("%s acquired publications retrieved for asoworker %s", len(files), asoworker)
-            filesToPublish.extend(files)
-
-        # a list of unique tasknames
-        unique_tasks = list(set((x['taskname'] for x in filesToPublish)))
-
-        taskList = []
-        for task in unique_tasks:
-            taskDict = {'taskname': task}
-            fileList = []
-            for file in filesToPublish:
-                if file['taskname'] == task:
-                    taskDict['username'] = file['username']
-                    if file['dbs_blockname']:  # Ruio_ASO puts there a scope:name DID
-                        (rucioScope, blockName) = file['dbs_blockname'].split(':')
-                        taskDict['scope'] = rucioScope
-                        file['dbs_blockname'] = blockName
-                    taskDict['destination'] = file['destination']
-                    fileList.append(file)
-            taskDict['fileDicts'] = fileList
-            taskList.append(taskDict)
-        return taskList
+            numFiles = self.groupFilesByTask(results, taskDicts)
+            self.logger.info("%s acquired publications retrieved for asoworker %s", numFiles, asoworker)
+
+        return list(taskDicts.values())
+
+    @staticmethod
+    def groupFilesByTask(results, taskDicts):
+        """
+        add the files in the acquiredPublication REST response to the taskDicts
+        dictionary {taskname: taskDict}, in a single pass over the rows.
+        Same as calling oracleOutputMapping and then selecting the files of each task,
+        but without scanning all files once per task
+        :return: the number of files in results
+        """
+        # Remove first 3 characters as they are tm_*, as in oracleOutputMapping
+        columns = [column[3:] for column in results[0]['desc']['columns']]
+        rows = results[0]['result']
+        for row in rows:
+            file = dict(zip(columns, row))
+            taskname = file['taskname']
+            taskDict = taskDicts.get(taskname)
+            if taskDict is None:
+                taskDict = {'taskname': taskname, 'fileDicts': []}
+                taskDicts[taskname] = taskDict
+            taskDict['username'] = file['username']
+            if file['dbs_blockname']:  # Ruio_ASO puts there a scope:name DID
+                (rucioScope, blockName) = file['dbs_blockname'].split(':')
+                taskDict['scope'] = rucioScope
+                file['dbs_blockname'] = blockName
+            taskDict['destination'] = file['destination']
+            taskDict['fileDicts'].append(file)
+        return len(rows)
 
     def runTaskPublish(self, workflow, logger):
         """
-        forks a process which will run TaskPublishRucio.py
+        runs TaskPublishRucio for this task inside this slave, so that e.g. DBS API's
+        can be reused for all tasks handled by the slave
         """
-        # find the location in the current environment of the script we want to run
-        import Publisher.TaskPublishRucio as tp  # pylint: disable=import-outside-toplevel
-        taskPublishScript = tp.__file__
-        cmd = f"python3 {taskPublishScript}"
-        cmd += f" --configFile={self.configurationFile}"
-        cmd += f" --taskname={workflow}"
-        if self.TPconfig.dryRun:
-            cmd += " --dry"
-        logger.info("Now execute: %s", cmd)
-        stdout, stderr, exitcode = executeCommand(cmd)
-        if exitcode != 0:
-            errorMsg = f"Failed to execute command: {cmd}.\n StdErr:\n {stderr}."
-            raise Exception(errorMsg)
-        logger.info('TaskPublishScript done : %s', stdout)
-
-        jsonSummary = stdout.split()[-1]
+        logger.info("Now run TaskPublishRucio for %s", workflow)
+        jsonSummary = publishInDBS3(config=self.publisherConfig, taskname=workflow, verbose=False, console=False)
+        logger.info('TaskPublishRucio done : %s', jsonSummary)
+
         with open(jsonSummary, 'r', encoding='utf8') as fd:
             summary = json.load(fd)
         result = summary['result']
@@ -219,45 +218,30 @@ class Master():  # pylint: disable=too-many-instance-attributes
             flag = '  OK' if acquiredFiles < 1000 else 'WARN'  # mark suspicious tasks
             self.logger.info('acquired_files: %s %5d : %s', flag, acquiredFiles, taskName)
 
-        processes = []
-        try:  # pylint: disable=too-many-nested-blocks
-            for task in tasks:
-                taskname = str(task['taskname'])
-                # this IF is for testing on preprod or dev DB's, which are full of old unpublished tasks
-                if int(taskname[0:6]) < 230712:
-                    self.logger.info("Skipped %s. Ignore tasks created before July 12 2023.", taskname)
-                    continue
-                username = task['username']
-                if username in self.config.skipUsers:
-                    self.logger.info("Skipped user %s task %s", username, taskname)
-                    continue
-                if self.sequential:
+        # tasks are processed by a pool of slaves, largest first so that they do not
+        # end up running alone at the end of the cycle while the other slaves are idle
+        tasksToDo = []
+        for task in tasks:
+            taskname = str(task['taskname'])
+            # this IF is for testing on preprod or dev DB's, which are full of old unpublished tasks
+            if int(taskname[0:6]) < 230712:
+                self.logger.info("Skipped %s. Ignore tasks created before July 12 2023.", taskname)
+                continue
+            username = task['username']
+            if username in self.config.skipUsers:
+                self.logger.info("Skipped user %s task %s", username, taskname)
+                continue
+            tasksToDo.append(task)
+        tasksToDo.sort(key=lambda task: len(task['fileDicts']), reverse=True)
+        try:
+            if self.sequential:
+                for task in tasksToDo:
                     self.startSlave(task)  # sequentially do one task after another
-                    continue
-                # deal with each task in a separate process
-                p = Process(target=self.startSlave, args=(task,))
-                p.start()
-                self.logger.info('Starting process %s  pid=%s', p, p.pid)
-                self.logger.info('PID %s will work on task %s', p.pid, taskname)
-                processes.append(p)
-                if len(processes) == maxSlaves:
-                    while len(processes) == maxSlaves:
-                        # wait until one process has completed
-                        time.sleep(10)
-                        for proc in processes.copy():
-                            if not proc.is_alive():
-                                self.logger.info('Terminated: %s pid=%s', proc, proc.pid)
-                                processes.remove(proc)
-
+            else:
+                runSlavesPool(master=self, tasks=[(str(task['taskname']), task) for task in tasksToDo],
+                              maxSlaves=maxSlaves, logger=self.logger)
         except Exception:  # pylint: disable=broad-except
             self.logger.exception("Error during process mapping")
-        self.logger.info('No more tasks to care for. Wait for remaining %d processes to terminate', len(processes))
-        while processes:
-            time.sleep(10)
-            for proc in processes.copy():
-                if not proc.is_alive():
-                    self.logger.info('Terminated: %s pid=%s', proc, proc.pid)
-                    processes.remove(proc)
 
         self.logger.info("Algorithm iteration completed")
         self.logger.info("Wait %d sec for next cycle", self.pollInterval())
@@ -326,7 +310,8 @@ class Master():  # pylint: disable=too-many-instance-attributes
                 return 0
             # get filemetadata info for all files which needs to be published
             (filesInfoFromFMD, blackList) = getInfoFromFMD(
-                crabServer=self.crabServer, taskname=workflow, lfns=lfnsToPublish, logger=logger)
+                crabServer=self.crabServer, taskname=workflow, lfns=lfnsToPublish, logger=logger,
+                chunkSize=getattr(self.config, 'fmdChunkSize', 200), maxThreads=getattr(self.config, 'fmdThreads', 4))
             if blackList:
                 self.taskBlackList.append(workflow)  # notify this slave
                 filepath = Path(os.path.join(self.blackListedTaskDir, workflow))
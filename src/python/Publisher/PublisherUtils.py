@@ -11,6 +11,9 @@ from tempfile import mkstemp
 import sys
 import time
 import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from logging import FileHandler
 from logging.handlers import TimedRotatingFileHandler
 import json
@@ -55,7 +58,16 @@ def setupLogging(config, taskname, verbose, console):
         logger.setLevel(logging.INFO)
     else:
         logger = logging.getLogger(taskname)
-        logging.basicConfig(filename=logfile, level=logging.INFO, format=config.TaskPublisher.logMsgFormat)
+        if logging.getLogger().handlers:
+            # running inside a Publisher slave, which already logs to the root logger
+            # and will run many tasks, so basicConfig is not an option
+            handler = FileHandler(logfile)
+            handler.setFormatter(logging.Formatter(config.TaskPublisher.logMsgFormat))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        else:
+            logging.basicConfig(filename=logfile, level=logging.INFO, format=config.TaskPublisher.logMsgFormat)
     if verbose:
         logger.setLevel(logging.DEBUG)
     # pass info around
@@ -93,6 +105,105 @@ def setSlaveLogger(logsDir, name):
     return logger
 
 
+def closeLogger(name):
+    """ close and remove all handlers of the logger with this name, i.e. the log files of one task """
+    logger = logging.getLogger(name)
+    for handler in logger.handlers.copy():
+        logger.removeHandler(handler)
+        handler.close()
+    logger.propagate = True
+
+
+# the Master object whose startSlave is called by the slaves in the pool, see runSlavesPool
+slavesPoolMaster = None
+# where the slaves tell the master which task they started
+slavesPoolStarted = None
+
+
+def initSlave(master, started):
+    """ initializer of the slaves in the pool """
+    global slavesPoolMaster, slavesPoolStarted  # pylint: disable=global-statement
+    slavesPoolMaster = master
+    slavesPoolStarted = started
+
+
+def runSlave(taskname, task):
+    """ work on one task inside a slave of the pool, returns the slave PID """
+    slavesPoolStarted.put(taskname)
+    try:
+        slavesPoolMaster.startSlave(task)
+    finally:
+        # slaves handle many tasks, do not leave log files of this one open
+        closeLogger(taskname)
+    return os.getpid()
+
+
+def runPool(context, master, tasks, maxSlaves, logger):
+    """
+    process tasks in one pool of maxSlaves processes, see runSlavesPool
+    returns the list of tasks which were not completed because the pool broke, i.e. a slave died,
+    and the set of names of the tasks which were started
+    """
+    started = context.SimpleQueue()
+    unfinished = []
+    with ProcessPoolExecutor(max_workers=maxSlaves, mp_context=context,
+                             initializer=initSlave, initargs=(master, started)) as pool:
+        futures = {}
+        for taskname, task in tasks:
+            try:
+                futures[pool.submit(runSlave, taskname, task)] = (taskname, task)
+            except BrokenProcessPool:
+                unfinished.append((taskname, task))
+        for future in as_completed(futures):
+            taskname = futures[future][0]
+            try:
+                pid = future.result()
+                logger.info('Task %s completed by slave pid=%s', taskname, pid)
+            except BrokenProcessPool:
+                unfinished.append(futures[future])
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('Slave failed while working on task %s', taskname)
+    startedNames = set()
+    while not started.empty():
+        startedNames.add(started.get())
+    return unfinished, startedNames
+
+
+def runSlavesPool(master=None, tasks=None, maxSlaves=1, logger=None):
+    """
+    process tasks with a pool of up to maxSlaves processes forked from master
+    which call master.startSlave for one task after the other, so that
+    each task does not pay for a new process and a free slave picks up next task right away.
+    tasks is a list of (taskname, task) tuples, in the order they should be processed.
+    If a slave dies (e.g. killed by the OOM killer) the pool is broken and all its remaining
+    tasks fail: those which were not started yet are resubmitted to a new pool, those which were
+    being worked on are retried one at a time, so that the one which kills its slave is found
+    and left for next cycle w/o blocking the others.
+    returns the names of the tasks whose slave died
+    """
+    # slaves need to inherit master (REST and Rucio clients, config...) not to unpickle it
+    context = multiprocessing.get_context('fork')
+    toDo = list(tasks)
+    suspects = []
+    killers = []
+    while toDo or suspects:
+        if toDo:
+            batch, toDo, nSlaves = toDo, [], maxSlaves
+        else:
+            batch, nSlaves = [suspects.pop(0)], 1
+        unfinished, started = runPool(context, master, batch, nSlaves, logger)
+        if not unfinished:
+            continue
+        if len(batch) == 1 and nSlaves == 1:
+            logger.error('Slave died while working on task %s, will retry next cycle', batch[0][0])
+            killers.append(batch[0][0])
+            continue
+        logger.error('A slave died, retrying %d unfinished tasks in a new pool', len(unfinished))
+        suspects += [task for task in unfinished if task[0] in started]
+        toDo += [task for task in unfinished if task[0] not in started]
+    return killers
+
+
 def setRootLogger(logsDir, logDebug=False, console=False):
     """Sets the root logger with the desired verbosity level
        The root logger logs to logs/log.txt and every single
@@ -251,33 +362,34 @@ def markFailed(files=None, crabServer=None, failureReason="", asoworker=None, lo
         logger.info('total of %s files, marked as Failed', nMarked)
 
 
-def getInfoFromFMD(crabServer=None, taskname=None, lfns=None, logger=None):
+def getInfoFromFMD(crabServer=None, taskname=None, lfns=None, logger=None,
+                   chunkSize=200, maxThreads=4):
     """
     Download and read the files describing what needs to be published
-    do on a small number of LFNs at a time (numFilesAtOneTime) to avoid
-    hitting the URL length limit in CMSWEB/Apache
+    LFNs are sent in the body of a POST (bulk retrieval) to avoid hitting
+    the URL length limit in CMSWEB/Apache, in chunks of chunkSize files
+    which are fetched concurrently by up to maxThreads threads
     input: lfns : list of strings - a list of LFNs
            taskname : string - the name of the task, needed to retrieve FMD
            crabServer: an instance of CRABRest - as configured via WorkerUtilities/getCrabserver
            logger: a logger
+           chunkSize: int - number of LFNs in each request
+           maxThreads: int - number of concurrent requests
     returns: a tuple: (FMDs, blackList)
              FMDs: a list of dictionaries, one per file, sorted by CRAB JobID
              blackList: boolean, True if this task has problem with FMD access and we need to blacklist it
     """
-    out = []
-    dataDict = {}
-    blackList = False
-    dataDict['taskname'] = taskname
-    i = 0
-    numFilesAtOneTime = 10
-    logger.debug('FMDATA: will retrieve data for %d files', len(lfns))
-    while i < len(lfns):
-        dataDict['lfnList'] = lfns[i: i + numFilesAtOneTime]
+
+    def getOneChunk(lfnChunk):
+        """
+        retrieve FMD for one chunk of LFNs
+        returns a tuple (FMDs, blackList, failed)
+        """
+        dataDict = {'taskname': taskname, 'lfnList': lfnChunk}
         data = encodeRequest(dataDict)
-        i += numFilesAtOneTime
         t1 = time.time()
         try:
-            res = crabServer.get(api='filemetadata', data=data)
+            res = crabServer.post(api='filemetadata', data=data)
             # res is a 3-ple: (result, exit code, status)
             res = res[0]
             t2 = time.time()
@@ -286,24 +398,31 @@ def getInfoFromFMD(crabServer=None, taskname=None, lfns=None, logger=None):
             logger.debug('FMDATA: retrieved data for %d files', len(res['result']))
             logger.debug('FMDATA: retrieved: %d MB in %d sec for %s', fmdata, elapsed, taskname)
             if elapsed > 60 and fmdata > 100:  # more than 1 minute and more than 100MB
-                blackList = True
-                return ([], blackList)
+                return ([], True, True)
         except Exception as ex:  # pylint: disable=broad-except
             t2 = time.time()
             elapsed = int(t2 - t1)
             logger.error("Error during metadata retrieving from crabserver:\n%s", ex)
-            if elapsed > 290:
-                blackList = True
-            return ([], blackList)
+            return ([], elapsed > 290, True)
         metadataList = [json.loads(md) for md in res['result']]  # CRAB REST returns a list of JSON objects
-        for md in metadataList:
-            out.append(md)
+        return (metadataList, False, False)
+
+    out = []
+    logger.debug('FMDATA: will retrieve data for %d files', len(lfns))
+    lfnChunks = [lfns[i: i + chunkSize] for i in range(0, len(lfns), chunkSize)]
+    with ThreadPoolExecutor(max_workers=maxThreads) as pool:
+        for metadataList, blackList, failed in pool.map(getOneChunk, lfnChunks):
+            if failed:
+                # do not wait for the chunks which were not started yet
+                pool.shutdown(wait=True, cancel_futures=True)
+                return ([], blackList)
+            out.extend(metadataList)
 
     logger.info('Got filemetadata for %d LFNs', len(out))
     # sort the list by jobId, makes it easier to compare https://stackoverflow.com/a/73050
     # sort by jobid as strings w/o converting to int becasue of https://github.com/dmwm/CRABServer/issues/7246
     sortedOut = sorted(out, key=lambda md: md['jobid'])
-    return (sortedOut, blackList)
+    return (sortedOut, False)
 
 
 def getDBSInputInformation(taskname=None, crabServer=None):
@@ -19,7 +19,7 @@ from Publisher.PublisherUtils import setupLogging, prepareDummySummary, saveSumm
     markGood, markFailed, getDBSInputInformation, FailedMigrationAccounter
 
 from Publisher.PublisherDbsUtils import format_file_3, setupDbsAPIs, findParentBlocks, \
-    prepareDbsPublishingConfigs, createBulkBlock, migrateByBlockDBS3
+    prepareDbsPublishingConfigs, createBulkBlock, MigrationManager
 
 
 def publishInDBS3(config, taskname, verbose, console):  # pylint: disable=too-many-statements, too-many-locals
@@ -45,17 +45,19 @@ def publishInDBS3(config, taskname, verbose, console):  # pylint: disable=too-ma
         DBSConfigs is a dictionary with common information to be inserted in DBS
         as returned returned by  prepareDbsPublishingConfigs
 
-        it has 2 possible outcomes and returns a dictionary:
+        it has 3 possible outcomes and returns a dictionary:
          if OK : {'status': 'OK', 'reason': None, 'dumpFile': None}
          if FAIL : {'status': 'FAIL', 'reason': reason, 'dumpFile': dumpFileName}
          When 'reason' is 'failedToInsertInDBS', 'dumpFile' is the full path to the
           file with the dump of the block. Otherwise is None.
+         if parent blocks are being migrated : {'status': 'PARKED', 'parentBlocks': set of blocks,
+          'dbsFiles': list of files}, the block can be inserted with insertBlockInDBS once
+          migrationManager reports that the migration of parentBlocks is done
         """
 
         # List of all files that must (and can) be published.
         dbsFiles = []  # list in the format DBS likes
         dictsOfFilesToBePublished = []  # list in the original dict from PublisherMasterRucio
-        nLumis = 0  # not sure we need to track this now
 
         for file in blockDict['files']:
             # Check if this file was already published
@@ -77,56 +79,49 @@ def publishInDBS3(config, taskname, verbose, console):  # pylint: disable=too-ma
         logger.info(msg)
 
         # Migrate parent blocks before publishing.
-        # First migrate the parent blocks that are in the same DBS instance
-        # as the input dataset.
-        if localParentBlocks:
-            msg = f"List of parent blocks that need to be migrated from {DBSApis['source'].url}:"
-            msg += f"\n {localParentBlocks}"
-            logger.info(msg)
-            if dryRun:
-                logger.info("DryRun: skipping migration request")
-            else:
-                try:
-                    statusCode, failureMsg = migrateByBlockDBS3(
-                        taskname,
-                        DBSApis['migrate'], DBSApis['destRead'], DBSApis['source'],
-                        localParentBlocks, log['migrationLogDir'],
-                        migrationAccounter, logger=logger, verbose=verbose)
-                except CannotMigrateException as ex:
-                    # there is nothing we can do in this case
-                    failureMsg = 'Cannot migrate. ' + str(ex)
-                    return {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
-                except Exception as ex:
-                    logger.exception('Exception raised inside migrateByBlockDBS3\n%s', ex)
-                    statusCode = 1
-                    failureMsg = 'Exception raised inside migrateByBlockDBS3'
-                if statusCode:
-                    failureMsg += " Not publishing any files."
-                    logger.info(failureMsg)
-                    return {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
-        # Then migrate the parent blocks that are in the global DBS instance.
-        if globalParentBlocks:
-            msg = f"List of parent blocks that need to be migrated from {DBSApis['global'].url}:"
-            msg += f"\n {globalParentBlocks}"
+        # Parent blocks can be in the same DBS instance as the input dataset or in the global one.
+        # Migrations are only requested here, this block is put aside until they are completed
+        blocksToMigrate = set()
+        for parentBlocks, sourceApi in ((localParentBlocks, DBSApis['source']),
+                                        (globalParentBlocks, DBSApis['global'])):
+            if not parentBlocks:
+                continue
+            msg = f"List of parent blocks that need to be migrated from {sourceApi.url}:"
+            msg += f"\n {parentBlocks}"
             logger.info(msg)
             if dryRun:
                 logger.info("DryRun: skipping migration request")
-            else:
-                try:
-                    statusCode, failureMsg = migrateByBlockDBS3(
-                        taskname,
-                        DBSApis['migrate'], DBSApis['destRead'], DBSApis['global'],
-                        globalParentBlocks, log['migrationLogDir'],
-                        migrationAccounter, logger=logger, verbose=verbose)
-                except Exception as ex:
-                    logger.exception('Exception raised inside migrateByBlockDBS3\n%s', ex)
-                    statusCode = 1
-                    failureMsg = 'Exception raised inside migrateByBlockDBS3'
-                if statusCode:
-                    failureMsg += " Not publishing any files."
-                    logger.info(failureMsg)
-                    return {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
-
+                continue
+            try:
+                migrationManager.request(sourceApi, parentBlocks)
+            except CannotMigrateException as ex:
+                # there is nothing we can do in this case
+                failureMsg = 'Cannot migrate. ' + str(ex)
+                return {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
+            except Exception as ex:
+                logger.exception('Exception raised while requesting migrations\n%s', ex)
+                failureMsg = 'Exception raised while requesting migrations. Not publishing any files.'
+                return {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
+            blocksToMigrate.update(parentBlocks)
+        if blocksToMigrate:
+            migrationStatus = migrationManager.status(blocksToMigrate)
+            if migrationStatus == 'failed':
+                failureMsg = "Migration of parent blocks failed. Not publishing any files."
+                logger.info(failureMsg)
+                return {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
+            if migrationStatus == 'inProgress':
+                logger.info("Block %s will be published when its parents are migrated", blockDict['block_name'])
+                return {'status': 'PARKED', 'parentBlocks': blocksToMigrate, 'dbsFiles': dbsFiles}
+
+        return insertBlockInDBS(blockDict=blockDict, dbsFiles=dbsFiles, DBSConfigs=DBSConfigs, logger=logger)
+
+    def insertBlockInDBS(blockDict=None, dbsFiles=None, DBSConfigs=None, logger=None):
+        """
+        insert in DBS a block whose parents are all in destination DBS
+        dbsFiles is the list of files to be published, in the format DBS likes
+        returns a dictionary as publishOneBlockInDBS
+        """
+        nLumis = 0  # not sure we need to track this now
         block_name = blockDict['block_name']
         originSite = blockDict['origin_site']
         files_to_publish = dbsFiles
@@ -236,6 +231,8 @@ def publishInDBS3(config, taskname, verbose, console):  # pylint: disable=too-ma
 
     # instantiate an accounter for failed migrations
     migrationAccounter = FailedMigrationAccounter(config=config, logger=logger)
+    migrationManager = MigrationManager(taskname, DBSApis['migrate'], DBSApis['destRead'],
+                                        log['migrationLogDir'], migrationAccounter, logger=logger)
 
     # pick a few params which are common to all blocks and files to be published
     aBlock = blocksToPublish[0]
@@ -304,13 +301,52 @@ def publishInDBS3(config, taskname, verbose, console):  # pylint: disable=too-ma
 
     dumpList = []  # keep a list of files where blocks which fail publication are dumped
 
-    # Publish one block at a time
+    # Publish one block at a time, putting aside those which need parent blocks to be migrated
+    results = {}
+    parkedBlocks = {}
     for block in blocksToPublish:
         blockDict = {'block_name': block['block_name']}
         blockDict['origin_site'] = block['origin_site']
         blockDict['files'] = block['files']
-        lfnsInBlock = [f['source_lfn'] for f in blockDict['files']]
         result = publishOneBlockInDBS(blockDict=blockDict, DBSConfigs=DBSConfigs, logger=logger)
+        if result['status'] == 'PARKED':
+            parkedBlocks[blockDict['block_name']] = (blockDict, result)
+        else:
+            results[blockDict['block_name']] = result
+
+    # Wait for up to migrationMaxWait seconds for the migrations, publishing blocks as their
+    # parents are migrated. Note that we don't fail or cancel any migration request,
+    # blocks which are still waiting will be retried by next Publisher cycle
+    waitTime = getattr(config.TaskPublisher, 'migrationPollInterval', 30)
+    maxWait = getattr(config.TaskPublisher, 'migrationMaxWait', 300)
+    waitStart = time.time()
+    while parkedBlocks and time.time() - waitStart < maxWait:
+        msg = f"{len(parkedBlocks)} blocks wait for {len(migrationManager.inProgress())} block migrations."
+        msg += f" Will check migrations status in {waitTime} seconds."
+        logger.info(msg)
+        time.sleep(waitTime)
+        migrationManager.poll()
+        for blockName, (blockDict, parked) in list(parkedBlocks.items()):
+            migrationStatus = migrationManager.status(parked['parentBlocks'])
+            if migrationStatus == 'inProgress':
+                continue
+            del parkedBlocks[blockName]
+            if migrationStatus == 'failed':
+                failureMsg = "Migration of parent blocks failed. Not publishing any files."
+                results[blockName] = {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
+            else:
+                results[blockName] = insertBlockInDBS(blockDict=blockDict, dbsFiles=parked['dbsFiles'],
+                                                      DBSConfigs=DBSConfigs, logger=logger)
+    for blockName in parkedBlocks:
+        failureMsg = "Migration of parent blocks is taking too long. Not publishing any files."
+        logger.info("Block %s: %s", blockName, failureMsg)
+        results[blockName] = {'status': 'FAIL', 'reason': failureMsg, 'dumpFile': None}
+
+    for block in blocksToPublish:
+        blockDict = {'block_name': block['block_name']}
+        blockDict['files'] = block['files']
+        lfnsInBlock = [f['source_lfn'] for f in blockDict['files']]
+        result = results[blockDict['block_name']]
         if result['status'] == 'OK':
             logger.info('Publish OK   for Block: %s', blockDict['block_name'])
             publishedBlocks += 1
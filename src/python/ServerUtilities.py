@@ -456,6 +456,38 @@ def atomicReplaceAcrossFS(src, dstDir, suffix=".tmp"):
     # from temp SPOOL to final SPOOL
     os.rename(tempDstPath, finalDstPath)     # OS.rename is atomic as long as tempDstPath and finalDstPath are on same FS
 
+
+def readNewLines(path, offset=0):
+    """
+    Generator over the lines which were appended to a text file, e.g. task_process/transfers.txt,
+    after byte offset `offset`. Only complete lines (i.e. terminated by a newline) are returned,
+    so that a line which is being written by a PostJob is left for next time.
+    yields: tuples (line, nextOffset) where nextOffset is the byte offset just after this line
+    """
+    with open(path, 'rb') as fp:
+        fp.seek(offset)
+        for line in fp:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            yield line.decode('utf-8'), offset
+
+
+def findLineOffset(path, lineNumber):
+    """
+    Convert a line number (i.e. number of lines already processed) into a byte offset
+    which can be used with readNewLines. Used when only the line number has been saved.
+    """
+    offset = 0
+    if lineNumber <= 0:
+        return offset
+    for count, (_, nextOffset) in enumerate(readNewLines(path), 1):
+        offset = nextOffset
+        if count == lineNumber:
+            break
+    return offset
+
+
 def getHashLfn(lfn):
     """ Provide a hashed lfn from an lfn.
     """
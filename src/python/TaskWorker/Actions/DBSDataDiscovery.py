@@ -4,8 +4,13 @@ Performing the data discovery through CMS DBS service.
 # avoid pylint complainging about non-elegfant code . It is old and works. Do not touch.
 # pylint: disable=too-many-locals, too-many-branches, too-many-nested-blocks, too-many-statements
 import os
+import json
 import logging
 import sys
+import time
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from http.client import HTTPException
 from urllib.parse import urlencode
@@ -22,6 +27,16 @@ from TaskWorker.WorkerExceptions import TaskWorkerException, TapeDatasetExceptio
 from TaskWorker.Actions.DataDiscovery import DataDiscovery
 from TaskWorker.Actions.RucioActions import RucioAction
 
+# defaults for config.TaskWorker.rucioLookupThreads and config.TaskWorker.rucioLocationsCacheTTL
+RUCIO_LOOKUP_THREADS = 8
+RUCIO_LOCATIONS_CACHE_TTL = 600  # seconds
+
+# block replicas found in Rucio are kept in files in this subdirectory of config.TaskWorker.scratchDir,
+# one per dataset, in the form {'time': lookupTime, 'replicas': {blockName: [[rse, state, bytes], ...]}},
+# so that tasks submitted in short sequence on the same dataset do not query Rucio again.
+# Files, not memory, since each task is handled in a new child process of the TW slave
+RUCIO_LOCATIONS_CACHE_DIR = 'rucioLocationsCache'
+
 
 class DBSDataDiscovery(DataDiscovery):
     """
@@ -30,9 +45,13 @@ class DBSDataDiscovery(DataDiscovery):
 
     # disable pylint warning in next line since they refer to conflict with the main()
     # at the bottom of this file which is only used for testing
-    def __init__(self, config, crabserver='', procnum=-1, rucioClient=None): # pylint: disable=redefined-outer-name
+    def __init__(self, config, crabserver='', procnum=-1, rucioClient=None, beforeTapeRecall=None): # pylint: disable=redefined-outer-name
         DataDiscovery.__init__(self, config, crabserver, procnum)
         self.rucioClient = rucioClient
+        # callable which is called before deciding about a tape recall, e.g. to wait for the checks
+        # running at the same time as this action (see Handler). The recall is not requested if it
+        # returns False, since it would create a rule and change the task status for a task which failed
+        self.beforeTapeRecall = beforeTapeRecall
 
     def checkDatasetStatus(self, dataset, kwargs):
         """ as the name says """
@@ -102,6 +121,83 @@ class DBSDataDiscovery(DataDiscovery):
         locationsMap.clear() # remove all blocks
         locationsMap.update(diskLocationsMap) # add only blocks with disk locations
 
+    def lookupBlockReplicas(self, scope, dataset, blocks):
+        """
+        find in Rucio the replicas of a list of blocks of a dataset
+        using a pool of threads, one list_dataset_replicas call per block.
+        Results are cached for config.TaskWorker.rucioLocationsCacheTTL seconds.
+        returns a dictionary {blockName: [(rse, state, bytes), ...]}
+        blocks for which the lookup failed are not in the dictionary.
+        """
+        ttl = getattr(self.config.TaskWorker, 'rucioLocationsCacheTTL', RUCIO_LOCATIONS_CACHE_TTL)
+        nThreads = getattr(self.config.TaskWorker, 'rucioLookupThreads', RUCIO_LOOKUP_THREADS)
+        cached = self.readLocationsCache(scope, dataset, ttl)
+        blockReplicas = {b: cached['replicas'][b] for b in blocks if b in cached['replicas']}
+        toLookup = [b for b in blocks if b not in blockReplicas]
+        self.logger.info("Replicas of %d blocks of %s found in cache, looking up %d blocks in Rucio",
+                         len(blockReplicas), dataset, len(toLookup))
+        if not toLookup:
+            return blockReplicas
+
+        def listReplicas(blockName):
+            response = self.rucioClient.list_dataset_replicas(scope=scope, name=blockName, deep=True)
+            return [(item['rse'], item['state'], item['bytes']) for item in response]
+
+        newReplicas = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(nThreads, len(toLookup)))) as executor:
+            futures = {executor.submit(listReplicas, blockName): blockName for blockName in toLookup}
+            for future in as_completed(futures):
+                try:
+                    newReplicas[futures[future]] = future.result()
+                except Exception as exc:  # pylint: disable=broad-except
+                    self.logger.warning("Rucio lookup failed for block %s with\n%s", futures[future], exc)
+        blockReplicas.update(newReplicas)
+        if ttl > 0 and newReplicas:
+            cached['replicas'].update(newReplicas)
+            self.writeLocationsCache(scope, dataset, cached)
+        return blockReplicas
+
+    def locationsCacheFile(self, scope, dataset):
+        """ name of the file where the block replicas of scope:dataset are cached, None if there is no scratchDir """
+        if not getattr(self.config.TaskWorker, 'scratchDir', None):
+            return None
+        digest = hashlib.sha1(f"{scope}:{dataset}".encode('utf-8')).hexdigest()
+        return os.path.join(self.config.TaskWorker.scratchDir, RUCIO_LOCATIONS_CACHE_DIR, f"{digest}.json")
+
+    def readLocationsCache(self, scope, dataset, ttl):
+        """
+        returns the cached block replicas of scope:dataset if not older than ttl seconds,
+        otherwise a new empty entry. Any problem with the cache only means a cache miss
+        """
+        now = time.time()
+        cacheFile = self.locationsCacheFile(scope, dataset)
+        if ttl > 0 and cacheFile:
+            try:
+                with open(cacheFile, 'r', encoding='utf-8') as fh:
+                    cached = json.load(fh)
+                if now - cached['time'] <= ttl and cached.get('scope') == scope and cached.get('dataset') == dataset:
+                    return cached
+                os.unlink(cacheFile)
+            except FileNotFoundError:
+                pass
+            except Exception as exc:  # pylint: disable=broad-except
+                self.logger.warning("Can not use Rucio locations cache %s: %s", cacheFile, exc)
+        return {'time': now, 'scope': scope, 'dataset': dataset, 'replicas': {}}
+
+    def writeLocationsCache(self, scope, dataset, cached):
+        """ atomically replace the cache file of scope:dataset, ignoring errors """
+        cacheFile = self.locationsCacheFile(scope, dataset)
+        if not cacheFile:
+            return
+        tmpFile = f"{cacheFile}.{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+            with open(tmpFile, 'w', encoding='utf-8') as fh:
+                json.dump(cached, fh)
+            os.replace(tmpFile, cacheFile)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.logger.warning("Can not write Rucio locations cache %s: %s", cacheFile, exc)
+
     def checkBlocksSize(self, blocks):
         """ Make sure no single blocks has too many lumis. See
             https://hypernews.cern.ch/HyperNews/CMS/get/dmDevelopment/2022/1/1/1/1/1/1/2.html
@@ -274,18 +370,18 @@ class DBSDataDiscovery(DataDiscovery):
                 scope = f"user.{self.username}"
             self.logger.info("Looking up data location with Rucio in %s scope.", scope)
             try:
-                for blockName in list(blocks):
+                blockReplicas = self.lookupBlockReplicas(scope, inputDataset, list(blocks))
+                for blockName, replicas in blockReplicas.items():
                     partialReplicas = set()
                     fullReplicas = set()
-                    response = self.rucioClient.list_dataset_replicas(scope=scope, name=blockName, deep=True)
                     sizeBytes = 0
-                    for item in response:
+                    for rse, state, nBytes in replicas:
                         # same as complete='y' used for PhEDEx
-                        if item['state'].upper() == 'AVAILABLE':
-                            fullReplicas.add(item['rse'])
+                        if state.upper() == 'AVAILABLE':
+                            fullReplicas.add(rse)
                         else:
-                            partialReplicas.add(item['rse'])
-                        sizeBytes = item['bytes']
+                            partialReplicas.add(rse)
+                        sizeBytes = nBytes
                     if fullReplicas:  # only fill map for blocks which have at least one location
                         locationsMap[blockName] = fullReplicas
                         totalSizeBytes += sizeBytes  # this will be used for tapeRecall
@@ -348,13 +444,10 @@ class DBSDataDiscovery(DataDiscovery):
             else:
                 self.logger.info("Trying data location of secondary dataset blocks with Rucio")
                 try:
-                    for blockName in list(secondaryBlocks):
-                        replicas = set()
-                        response = self.rucioClient.list_dataset_replicas(scope=scope, name=blockName, deep=True)
-                        for item in response:
-                            # same as complete='y' used for PhEDEx
-                            if item['state'].upper() == 'AVAILABLE':
-                                replicas.add(item['rse'])
+                    blockReplicas = self.lookupBlockReplicas(scope, secondaryDataset, list(secondaryBlocks))
+                    for blockName, blockReplicaList in blockReplicas.items():
+                        # same as complete='y' used for PhEDEx
+                        replicas = {rse for rse, state, _ in blockReplicaList if state.upper() == 'AVAILABLE'}
                         if replicas:  # only fill map for blocks which have at least one location
                             secondaryLocationsMap[blockName] = replicas
                 except Exception as exc:  # pylint: disable=broad-except
@@ -401,6 +494,8 @@ class DBSDataDiscovery(DataDiscovery):
         # check for tape recall
         #if set(locationsMap.keys()) != set(blocksWithLocation):
         if requestTapeRecall:
+            if self.beforeTapeRecall and not self.beforeTapeRecall():
+                raise TaskWorkerException("Tape recall not requested since the task failed other checks")
             msg = self.executeTapeRecallPolicy(inputDataset, inputBlocks, totalSizeBytes)
             dataToRecall = inputDataset if not inputBlocks else list(blocksWithLocation)
             self.requestTapeRecall(dataToRecall=dataToRecall, sizeToRecall=totalSizeBytes,
@@ -9,9 +9,11 @@ Generates the condor submit files and the master DAG.
 # there just one very long line in the HTCondor JDL template
 # pylint: disable=line-too-long
 
+import io
 import os
 import re
 import json
+import time
 import shutil
 import pickle
 import random
@@ -25,6 +27,7 @@ from ServerUtilities import MAX_DISK_SPACE, MAX_IDLE_JOBS, MAX_POST_JOBS, TASKLI
 from ServerUtilities import checkS3Object, getColumn, pythonListToClassAdExprTree, atomicReplaceAcrossFS
 
 from CRABUtils.Utils import addToGZippedTarfile
+from IndexedArchive import ArchiveReader, appendToArchive, JOB_INPUTS_ARCHIVE, INDEX_SUFFIX
 
 import TaskWorker.DataObjects.Result
 from TaskWorker.Actions.TaskAction import TaskAction
@@ -747,48 +750,43 @@ class DagmanCreator(TaskAction):
             with tarfile.open('CMSRunAnalysis.tar.gz') as tf:
                 tf.extractall(tarballDir)
         os.chdir(tarballDir)
-        # use new tmp directory to create run_and_lumis.tar.gz and input_files.tar.gz
-        runAndLumisDir = tempfile.mkdtemp()
-        inputFilesDir = tempfile.mkdtemp()
-        if not self.runningInTW:
-            # pre-populate those directories with files from previous DagmanCreator steps
-            with tarfile.open('run_and_lumis.tar.gz') as tf:
-                tf.extractall(runAndLumisDir)
-            with tarfile.open('input_files.tar.gz') as tf:
-                tf.extractall(inputFilesDir)
-        # now add run_lumi and input_files from this DAG
-        # add current runs_and_lumis and input_files lists in the temp directories
+        # add run and lumis and input files of the jobs of this DAG to the indexed archive,
+        # which in the AP already has the ones from previous DagmanCreator steps. One member
+        # for each job and kind, named as the files in the tarballs used before
+        members = []
         for dagSpec in dagSpecs:
-            # run and lumis, one file for each job in standard lumi format
-            # beware that this file is called .json but it is a string, not a json format !!
-            # in order to change here we'd need to change at least where dagSpecs is created
-            # and TweakPSet.py which reads this file
-            job_lumis_file = os.path.join(runAndLumisDir, f"job_lumis_{dagSpec['count']}.json")
-            with open(job_lumis_file, "w", encoding='utf-8') as fd:
-                fd.write(str(dagSpec['runAndLumiMask']))
-            # for input files, a .txt file for each jobs with a list, again as strings
-            # could be turned into json with some effort
-            job_input_file_list = os.path.join(inputFilesDir, f"job_input_file_list_{dagSpec['count']}.txt")
-            with open(job_input_file_list, "w", encoding='utf-8') as fd:
-                fd.write(str(dagSpec['inputFiles']))
-        # make tarballs, if those file exists in tarballDir, they will be overwritten
-        os.chdir(tarballDir)
-        with tarfile.open('run_and_lumis.tar.gz', "w:gz") as tf:
-            # use arcname='' to have only filename in the archive. w/o dir
-            tf.add(runAndLumisDir, arcname='')
-        with tarfile.open('input_files.tar.gz', 'w:gz') as tf:
-            tf.add(inputFilesDir, arcname='')
-        shutil.rmtree(runAndLumisDir)
-        shutil.rmtree(inputFilesDir)
+            # run and lumis in standard lumi format, input files as a list. Both are json strings
+            members.append((f"job_lumis_{dagSpec['count']}.json", str(dagSpec['runAndLumiMask'])))
+            members.append((f"job_input_file_list_{dagSpec['count']}.txt", str(dagSpec['inputFiles'])))
+        appendToArchive(JOB_INPUTS_ARCHIVE, members)
+        # run_and_lumis.tar.gz and input_files.tar.gz are still created for the task web directory,
+        # where the client (crab report) and users read them. They are rebuilt in full from the
+        # archive each time, but w/o extracting the old ones
+        tarballs = {'run_and_lumis.tar.gz': 'job_lumis_', 'input_files.tar.gz': 'job_input_file_list_'}
+        tarballMembers = {tarball: {} for tarball in tarballs}
+        with ArchiveReader(JOB_INPUTS_ARCHIVE) as reader:
+            for name, content in reader.members():
+                for tarball, prefix in tarballs.items():
+                    if name.startswith(prefix):
+                        tarballMembers[tarball][name] = content.encode('utf-8')
+        for tarball, tarMembers in tarballMembers.items():
+            with tarfile.open(tarball, "w:gz") as tf:
+                for name, content in tarMembers.items():
+                    tarInfo = tarfile.TarInfo(name)
+                    tarInfo.size = len(content)
+                    tarInfo.mtime = time.time()
+                    tf.addfile(tarInfo, io.BytesIO(content))
+        jobInputsFiles = [JOB_INPUTS_ARCHIVE, JOB_INPUTS_ARCHIVE + INDEX_SUFFIX] + list(tarballs)
         if self.runningInTW:
-            # simply put tarballs in correct directory, CMSRunAnalysis.tar.gz will be created later on
-            shutil.copy('run_and_lumis.tar.gz', workingDir)
-            shutil.copy('input_files.tar.gz', workingDir)
+            # simply put files in correct directory, CMSRunAnalysis.tar.gz will be created later on
+            for fileName in jobInputsFiles:
+                shutil.copy(fileName, workingDir)
         else:
-            # still need to put run_and_lumis in SPOOL_DIR since automatic splitting code will
-            # need access e.g. in PostJob.saveAutomaticSplittingData
-            atomicReplaceAcrossFS('run_and_lumis.tar.gz', workingDir)
-            atomicReplaceAcrossFS('input_files.tar.gz', workingDir)
+            # still need to put them in SPOOL_DIR since automatic splitting code will
+            # need access e.g. in PostJob.saveAutomaticSplittingData. The data file
+            # is replaced before the index, since the old index is valid for the new data
+            for fileName in jobInputsFiles:
+                atomicReplaceAcrossFS(fileName, workingDir)
         # now list of input arguments needed for each jobs, again prepare it in the temp dir
         argdicts = self.prepareJobArguments(dagSpecs)
         argFileName = "input_args.json"
@@ -844,12 +842,14 @@ class DagmanCreator(TaskAction):
           site.ad.json : sites assigned to jobs in each job group (info from Splitter)
         FILES TO BE USED BY THE JOB WRAPPER IN THE WorkerNode  TO BE PLACED IN CMSRunAnalysis.tar.gz
           input_args.json : the arguments needed by CMSRunAnalysis.py for each job
-          run_and_lumis.tar.gz : contains one json file for each jobs with run/lumis to process
-          input_files.tar.gz : contains one line for each jon with the list of input files to process
+          job_inputs.jsonl(.idx) : indexed archive (see IndexedArchive.py) with run/lumis and list
+                                   of input files to process for each job
+          run_and_lumis.tar.gz : contains one json file for each jobs with run/lumis to process, for crab report
+          input_files.tar.gz : contains one line for each job with the list of input files to process, for the web dir
 
         Those side effects require special care when this is called by PreDag during automatic splitting,
         since following files already exists in the CMSRunAnalysis.tar.gz tarball which was sent byt TW
-          input_args.json, run_and_lumis.tar.gz, input_files.tar.gz
+          input_args.json, job_inputs.jsonl(.idx), run_and_lumis.tar.gz, input_files.tar.gz
          Therefore when running in the scheduler (HTC AccessPoing) we will move to a temp directory,
          expand CMSRunAnalysis.tar.gz in there, do all the work, and create a new tarball to be places
          in SPOOL_DIR to be used in next submissions by the created DAGs
@@ -1284,7 +1284,8 @@ class DagmanCreator(TaskAction):
         addToGZippedTarfile(filesToAdd, 'TaskManagerRun.tar.gz')
 
         # files to be transferred to remote WN's via Job.submmit. Add to the "code" tarball files created by TW
-        filesToAdd = ['run_and_lumis.tar.gz', 'input_files.tar.gz', 'input_args.json']
+        filesToAdd = [JOB_INPUTS_ARCHIVE, JOB_INPUTS_ARCHIVE + INDEX_SUFFIX, 'run_and_lumis.tar.gz', 'input_files.tar.gz',
+                      'input_args.json']
         addToGZippedTarfile(filesToAdd, 'CMSRunAnalysis.tar.gz')
 
         # files to be transferred to the scheduler by DagmanSubmitter (these will all be placed in InputFiles.tar.gz)
@@ -4,13 +4,12 @@ import os
 import time
 import logging
 import tempfile
+import threading
 import traceback
-import copy
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from RESTInteractions import CRABRest
-from RucioUtils import getNativeRucioClient
-
-from TaskWorker import __version__
+from TaskWorker.WorkerUtilities import getClientRegistry
 from TaskWorker.Actions.Splitter import Splitter
 from TaskWorker.Actions.DagmanKiller import DagmanKiller
 from TaskWorker.Actions.MyProxyLogon import MyProxyLogon
@@ -47,6 +46,10 @@ class TaskHandler():
         self.config = config
         self.workFunction = workFunction
         self.work = []
+        self.dependencies = {}
+        # {action: True if it succeeded, False if it failed or did not run}, for the actions which are over
+        self.actionsOver = {}
+        self.actionsOverChanged = threading.Condition()
         self.task = task
         self.taskname = task['tm_taskname']
         self.tempDir = None
@@ -74,12 +77,22 @@ class TaskHandler():
         return tempDir
 
 
-    def addWork(self, work):
+    def addWork(self, work, dependsOn=None):
         """Appending a new action to be performed on the task
 
-        :arg callable work: a new callable to be called :)"""
+        :arg callable work: a new callable to be called :)
+        :arg list dependsOn: the actions, already added, which must be completed before this one starts.
+                             The result of the first of them is the input of this action.
+                             By default the action depends on the one added before it, so that
+                             actions are chained one after the other."""
         if work not in self.work:
+            if dependsOn is None:
+                dependsOn = self.work[-1:]
+            for dependency in dependsOn:
+                if dependency not in self.work:
+                    raise ValueError(f"{dependency} must be added before {work}, which depends on it")
             self.work.append(work)
+            self.dependencies[work] = list(dependsOn)
 
 
     def getWorks(self):
@@ -123,41 +136,112 @@ class TaskHandler():
         return output
 
 
-    def actionWork(self, *args, **kwargs): #pylint: disable=unused-argument
-        """Performing the set of actions"""
-        nextinput = args
-
-        #Loop that iterates over the actions to be performed
-        for action in self.getWorks():
-            self.logger.debug("Starting %s on %s", str(action), self.taskname)
-            t0 = time.time()
-            retryCount = 0
-            #execute the current action dealing with retriesz
-            maxRetries = 5
-            while retryCount < maxRetries:
-                try:
-                    output = self.executeAction(nextinput, action)
-                except WorkerHandlerException as whe:
-                    retryCount += 1
-                    if whe.retry is False or retryCount >= maxRetries:
-                        raise
-                    time.sleep(60 * retryCount)
-                else:
-                    break
-            t1 = time.time()
-            #log entry below is used for logs parsing, therefore, changing it might require to update logstash configuration
-            self.logger.info("Finished %s on %s in %d seconds", str(action), self.taskname, t1 - t0)
-
-            # if there is a next action to do, the result field of the Result object returned by this action (!)
-            # will contain the needed input for the next action. I also hate this, but could not find a better way
+    def runAction(self, nextinput, action):
+        """ Execute an action retrying it if needed, and log how long it took """
+        self.logger.debug("Starting %s on %s", str(action), self.taskname)
+        t0 = time.time()
+        retryCount = 0
+        #execute the current action dealing with retriesz
+        maxRetries = 5
+        while retryCount < maxRetries:
             try:
-                nextinput = output.result
-            except AttributeError:
-                nextinput = output
-
+                output = self.executeAction(nextinput, action)
+            except WorkerHandlerException as whe:
+                retryCount += 1
+                if whe.retry is False or retryCount >= maxRetries:
+                    raise
+                time.sleep(60 * retryCount)
+            else:
+                break
+        t1 = time.time()
+        #log entry below is used for logs parsing, therefore, changing it might require to update logstash configuration
+        self.logger.info("Finished %s on %s in %d seconds", str(action), self.taskname, t1 - t0)
         return output
 
 
+    def setActionOver(self, action, succeeded):
+        """ Record that action is over and wake up who waits for it """
+        with self.actionsOverChanged:
+            self.actionsOver.setdefault(action, succeeded)
+            self.actionsOverChanged.notify_all()
+
+
+    def waitForActions(self, actions):
+        """ Wait until actions are over. To be called by an action which runs at the same time as them
+
+        :arg list actions: actions added to this handler
+        :return: True if all of them succeeded"""
+        for action in actions:
+            if action not in self.work:
+                raise ValueError(f"{action} has not been added")
+        with self.actionsOverChanged:
+            self.actionsOverChanged.wait_for(lambda: all(action in self.actionsOver for action in actions))
+            return all(self.actionsOver[action] for action in actions)
+
+
+    def actionInput(self, action, outputs, args):
+        """ The input of action: the output of the first action it depends on, or args if it depends on none """
+        if not self.dependencies[action]:
+            return args
+        output = outputs[self.dependencies[action][0]]
+        # the result field of the Result object returned by that action (!)
+        # will contain the needed input for this action. I also hate this, but could not find a better way
+        try:
+            return output.result
+        except AttributeError:
+            return output
+
+
+    def actionWork(self, *args, **kwargs): #pylint: disable=unused-argument
+        """Performing the set of actions
+
+        Each action starts as soon as the actions it depends on are completed, so actions
+        which do not depend on each other run at the same time, each in its own thread.
+        When an action fails no further action is started and, once the running ones
+        are over, the exception of the first failed one (in the order they were added) is raised.
+        """
+        outputs = {}
+        failures = {}
+        pending = list(self.work)
+        running = {}
+        pool = None
+        try:
+            while running or (pending and not failures):
+                ready = [] if failures else [action for action in pending
+                                             if all(dep in outputs for dep in self.dependencies[action])]
+                for action in ready:
+                    pending.remove(action)
+                if len(ready) == 1 and not running:
+                    # nothing to run alongside, no need for threads
+                    outputs[ready[0]] = self.runAction(self.actionInput(ready[0], outputs, args), ready[0])
+                    self.setActionOver(ready[0], True)
+                    continue
+                if ready and pool is None:
+                    pool = ThreadPoolExecutor(max_workers=len(self.work))
+                for action in ready:
+                    running[pool.submit(self.runAction, self.actionInput(action, outputs, args), action)] = action
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    action = running.pop(future)
+                    try:
+                        outputs[action] = future.result()
+                    except Exception as ex:  # pylint: disable=broad-except
+                        failures[action] = ex
+                    self.setActionOver(action, action in outputs)
+        finally:
+            # actions which did not run are over too, for who waits for them
+            for action in self.work:
+                self.setActionOver(action, action in outputs)
+            # do not wait for threads still running if we are leaving because of an exception
+            # in this thread, e.g. the timeout of the ChildWorker
+            if pool is not None:
+                pool.shutdown(wait=False)
+        if failures:
+            raise failures[next(action for action in self.work if action in failures)]
+
+        return outputs[self.work[-1]] if self.work else None
+
+
 def handleNewTask(resthost, dbInstance, config, task, procnum, *args, **kwargs):
     """Performs the injection of a new task
 
@@ -168,37 +252,45 @@ def handleNewTask(resthost, dbInstance, config, task, procnum, *args, **kwargs):
     :arg int procnum: the process number taking care of the work
     :*args and *kwargs: extra parameters currently not defined
     :return: the handler."""
-    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
-                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
-    crabserver.setDbInstance(dbInstance)
+    clients = getClientRegistry(config)
+    crabserver = clients.getCrabserver(resthost, dbInstance, config, logging.getLogger(str(procnum)))
     handler = TaskHandler(task, procnum, crabserver, config, 'handleNewTask', createTempDir=True)
-    rucioClient = getNativeRucioClient(config=config, logger=handler.logger)
+    rucioClient = clients.getRucioClient(config, handler.logger)
     # Temporary use `crab_input` account to checking other account quota.
     # See discussion in https://mattermost.web.cern.ch/cms-o-and-c/pl/ej7zwkr747rifezzcyyweisx9r
-    tmpConfig = copy.deepcopy(config)
-    tmpConfig.Services.Rucio_account = 'crab_input'
-    privilegedRucioClient = getNativeRucioClient(tmpConfig, handler.logger)
+    privilegedRucioClient = clients.getRucioClient(config, handler.logger, account='crab_input')
 
     # start to work
     handler.addWork(MyProxyLogon(config=config, crabserver=crabserver, procnum=procnum, myproxylen=60 * 60 * 24))
-    handler.addWork(SiteInfoResolver(config=config, crabserver=crabserver, procnum=procnum))
-    handler.addWork(StageoutCheck(config=config, crabserver=crabserver, procnum=procnum, rucioClient=privilegedRucioClient))
+    siteInfo = SiteInfoResolver(config=config, crabserver=crabserver, procnum=procnum)
+    handler.addWork(siteInfo)
+    # the stageout check and the data discovery do not use each other results, they run at the same time.
+    # But a tape recall creates a Rucio rule and changes the task status, so the data discovery
+    # requests it only after the stageout check succeeded
+    stageoutCheck = StageoutCheck(config=config, crabserver=crabserver, procnum=procnum, rucioClient=privilegedRucioClient)
+    handler.addWork(stageoutCheck)
+    discovery = None
     if task['tm_job_type'] == 'Analysis':
         if task.get('tm_input_dataset'):
             if ':' in task.get('tm_input_dataset'):  # Rucio DID is scope:name
-                handler.addWork(RucioDataDiscovery(config=config, crabserver=crabserver,
-                                                 procnum=procnum, rucioClient=rucioClient))
+                discovery = RucioDataDiscovery(config=config, crabserver=crabserver,
+                                               procnum=procnum, rucioClient=rucioClient)
             else:
-                handler.addWork(DBSDataDiscovery(config=config, crabserver=crabserver,
-                                                 procnum=procnum, rucioClient=rucioClient))
+                discovery = DBSDataDiscovery(config=config, crabserver=crabserver,
+                                             procnum=procnum, rucioClient=rucioClient,
+                                             beforeTapeRecall=partial(handler.waitForActions, [stageoutCheck]))
 
         elif task.get('tm_user_files'):
-            handler.addWork(UserDataDiscovery(config=config, crabserver=crabserver, procnum=procnum))
+            discovery = UserDataDiscovery(config=config, crabserver=crabserver, procnum=procnum)
         else:
             raise SubmissionRefusedException("Neither inputDataset nor userInputFiles specified", retry=0)
     elif task['tm_job_type'] == 'PrivateMC':
-        handler.addWork(MakeFakeFileSet(config=config, crabserver=crabserver, procnum=procnum))
-    handler.addWork(Splitter(config=config, crabserver=crabserver, procnum=procnum))
+        discovery = MakeFakeFileSet(config=config, crabserver=crabserver, procnum=procnum)
+    splitterDependencies = None
+    if discovery:
+        handler.addWork(discovery, dependsOn=[siteInfo])
+        splitterDependencies = [discovery, stageoutCheck]
+    handler.addWork(Splitter(config=config, crabserver=crabserver, procnum=procnum), dependsOn=splitterDependencies)
     handler.addWork(
         DagmanCreator(
             config=config,
@@ -227,9 +319,7 @@ def handleResubmit(resthost, dbInstance, config, task, procnum, *args, **kwargs)
     :arg int procnum: the process number taking care of the work
     :*args and *kwargs: extra parameters currently not defined
     :return: the result of the handler operation."""
-    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
-                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
-    crabserver.setDbInstance(dbInstance)
+    crabserver = getClientRegistry(config).getCrabserver(resthost, dbInstance, config, logging.getLogger(str(procnum)))
     handler = TaskHandler(task, procnum, crabserver, config, 'handleResubmit')
     handler.addWork(MyProxyLogon(config=config, crabserver=crabserver, procnum=procnum, myproxylen=60 * 60 * 24))
     handler.addWork(SiteInfoResolver(config=config, crabserver=crabserver, procnum=procnum))
@@ -248,9 +338,7 @@ def handleKill(resthost, dbInstance, config, task, procnum, *args, **kwargs):
     :arg int procnum: the process number taking care of the work
     :*args and *kwargs: extra parameters currently not defined
     :return: the result of the handler operation."""
-    crabserver = CRABRest(resthost, config.TaskWorker.cmscert, config.TaskWorker.cmskey, retry=20,
-                          logger=logging.getLogger(str(procnum)), userAgent='CRABTaskWorker', version=__version__)
-    crabserver.setDbInstance(dbInstance)
+    crabserver = getClientRegistry(config).getCrabserver(resthost, dbInstance, config, logging.getLogger(str(procnum)))
     handler = TaskHandler(task, procnum, crabserver, config, 'handleKill')
     handler.addWork(MyProxyLogon(config=config, crabserver=crabserver, procnum=procnum, myproxylen=60 * 5))
     handler.addWork(DagmanKiller(config=config, crabserver=crabserver, procnum=procnum))
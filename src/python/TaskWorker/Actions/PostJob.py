@@ -85,13 +85,11 @@ import json
 import uuid
 import pprint
 import signal
-import tarfile
 import logging
 import logging.handlers
 import subprocess
 import unittest
 import datetime
-import tempfile
 import pickle
 import traceback
 import random
@@ -115,6 +113,7 @@ from ServerUtilities import TRANSFERDB_STATES, PUBLICATIONDB_STATES
 from ServerUtilities import isFailurePermanent, mostCommon, encodeRequest, oracleOutputMapping
 from ServerUtilities import getLock, getHashLfn
 from RESTInteractions import CRABRest
+from IndexedArchive import readMember, JOB_INPUTS_ARCHIVE
 
 
 
@@ -1083,13 +1082,36 @@ class ASOServerJob():
                     self.logger.debug("Changing query_view back to true")
                     query_view = True
                     break
+            # When the cache is kept up to date by task_process/transfer_status.py
+            # do not query the DB, ask task_process for a refresh instead.
+            owned_by_task_process = aso_info.get("query_owner") == "task_process" and \
+                (time.time() - last_query < 3 * aso_info.get("refresh_interval", 120))
+            if query_view and owned_by_task_process:
+                with open("task_process/transfer_status_refresh", 'w'):
+                    pass
+                msg = ("Transfer cache is maintained by task_process but it is not up to date for this job yet. "
+                       "Requested a refresh. Deferring the postjob.")
+                raise TransferCacheLoadError(msg)
         if query_view:
-            self.logger.debug("Querying ASO RDBMS database.")
+            # If the cache was filled successfully, refresh it incrementally: only query
+            # documents modified after the last query and merge them in the cache.
+            # Use a margin because tm_last_update is set before the DB transaction is committed.
+            # Do a full query once per hour anyhow.
+            full_query_timestamp = aso_info.get("full_query_timestamp", 0)
+            since = None
+            if aso_info.get("query_succeded") and (time.time() - full_query_timestamp < 3600):
+                since = int(aso_info["query_timestamp"]) - 300
+            else:
+                full_query_timestamp = time.time()
+            self.logger.debug("Querying ASO RDBMS database%s.", " for changes since %s" % since if since else "")
+            queryData = {'subresource': 'getTransferStatus',
+                         'username': str(self.job_ad['CRAB_UserHN']),
+                         'taskname': self.reqname}
+            if since:
+                queryData['since'] = since
             try:
                 view_results = self.crabserver.get(api='fileusertransfers',
-                                                   data=encodeRequest({'subresource': 'getTransferStatus',
-                                                                       'username': str(self.job_ad['CRAB_UserHN']),
-                                                                       'taskname': self.reqname}))
+                                                   data=encodeRequest(queryData))
                 view_results_dict = oracleOutputMapping(view_results, 'id')
                 # There is so much noise values in aso_status.json file. So lets provide a new file structure.
                 # We will not run ever for one task which can use also RDBMS
@@ -1102,8 +1124,13 @@ class ASOServerJob():
                 self.logger.exception(msg)
                 self.build_failed_cache()
                 raise TransferCacheLoadError(msg) from ex
+            if since:
+                results = aso_info["results"]
+                results.update(view_results_dict)
+                view_results_dict = results
             aso_info = {
                 "query_timestamp": time.time(),
+                "full_query_timestamp": full_query_timestamp,
                 "query_succeded": True,
                 "query_jobid": self.job_id,
                 "results": view_results_dict,
@@ -1866,16 +1893,9 @@ class PostJob():
         if self.stage == 'probe':
             return
         self.logger.info("====== Starting to parse the lumi file")
-        try:
-            tmpdir = tempfile.mkdtemp()
-            fn = "job_lumis_{0}.json".format(self.job_id)
-            with tarfile.open("run_and_lumis.tar.gz") as f:
-                f.extract(fn, path=tmpdir)
-            with open(os.path.join(tmpdir, fn)) as fd:
-                injson = json.load(fd)
-                inlumis = LumiList(compactList=injson)
-        finally:
-            shutil.rmtree(tmpdir)
+        fn = "job_lumis_{0}.json".format(self.job_id)
+        injson = json.loads(readMember(JOB_INPUTS_ARCHIVE, fn, legacyTarball="run_and_lumis.tar.gz"))
+        inlumis = LumiList(compactList=injson)
 
         outlumis = LumiList()
         for input_ in self.job_report['steps']['cmsRun']['input']['source']:
@@ -2415,6 +2435,7 @@ class PostJob():
             self.logger.info("Skipping input filemetadata upload as no inputs were found")
             return
         direct_stageout = int(self.job_report.get('direct_stageout', 0))
+        files_metadata = []
         for ifile in self.job_report['steps']['cmsRun']['input']['source']:
             if ifile['input_source_class'] != 'PoolSource' or ifile.get('input_type', '') != "primaryFiles":
                 continue
@@ -2468,16 +2489,9 @@ class PostJob():
             for lumis in outfilelumis:
                 configreq.append(("outfilelumis", lumis))
 
-            rest_api = 'filemetadata'
-            msg = "Uploading input metadata for %s to https://%s: %s" % (lfn, self.rest_url+rest_api, configreq)
-            self.logger.debug(msg)
-            try:
-                self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
-            except HTTPException as hte:
-                msg = "HTTP Error uploading input file metadata: %s" % (str(hte.headers))
-                self.logger.error(msg)
-                raise
-            self.logger.info("====== Finished upload of input files metadata.")
+            files_metadata.append((lfn, configreq))
+        self.upload_files_metadata(files_metadata, 'input')
+        self.logger.info("====== Finished upload of input files metadata.")
 
     # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -2489,6 +2503,7 @@ class PostJob():
         if os.environ.get('TEST_POSTJOB_NO_STATUS_UPDATE', False):
             return
         output_datasets = set()
+        files_metadata = []
         for file_info in self.output_files_info:
             outdataset = file_info['output_dataset']
             if not 'FakeDataset' in outdataset:
@@ -2534,18 +2549,57 @@ class PostJob():
                     if lfn:
                         configreq.append(("inparentlfns", lfn))
             filename = file_info['pfn'].split('/')[-1]
-            rest_api = 'filemetadata'
-            msg = "Uploading output metadata for %s to https://%s: %s" % (filename, self.rest_url+rest_api, configreq)
+            files_metadata.append((filename, configreq))
+        self.upload_files_metadata(files_metadata, 'output')
+        self.logger.info("====== Finished upload of output files metadata.")
+
+    # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def upload_files_metadata(self, files_metadata, kind):
+        """
+        Upload the metadata of all input or output (kind) files of the job with a
+        single bulk PUT to the filemetadata API, which inserts or updates all of them at once.
+        files_metadata is a list of (filename, configreq) with configreq the list of
+        (key, value) pairs for the PUT of one file.
+        If the bulk upload fails (e.g. the REST does not support it) upload one file at a time.
+        """
+        if not files_metadata:
+            return
+        rest_api = 'filemetadata'
+        taskname = None
+        records = []
+        for _, configreq in files_metadata:
+            record = {'outfileruns': [], 'outfilelumis': [], 'inparentlfns': []}
+            for key, value in configreq:
+                if key == 'taskname':
+                    taskname = value
+                    continue
+                if key in record and isinstance(record[key], list):
+                    record[key].append(str(value))
+                else:
+                    record[key] = str(value)
+            records.append(record)
+        configreq = {'taskname': taskname, 'filesmetadata': json.dumps(records)}
+        msg = "Uploading %s metadata for %d files to https://%s" % (kind, len(records), self.rest_url+rest_api)
+        self.logger.info(msg)
+        try:
+            self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
+            return
+        except HTTPException as hte:
+            msg = "HTTP Error uploading %s files metadata in bulk: %s" % (kind, str(hte.headers))
+            msg += "\nWill upload metadata one file at a time"
+            self.logger.warning(msg)
+        for filename, configreq in files_metadata:
+            msg = "Uploading %s metadata for %s to https://%s: %s" % (kind, filename, self.rest_url+rest_api, configreq)
             self.logger.debug(msg)
             try:
                 self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
             except HTTPException as hte:
                 # BrianB. Suppressing this exception is a tough decision.
                 # If the file made it back alright, I suppose we can proceed.
-                msg = "HTTP Error uploading output file metadata: %s" % (str(hte.headers))
+                msg = "HTTP Error uploading %s file metadata: %s" % (kind, str(hte.headers))
                 self.logger.error(msg)
                 raise
-            self.logger.info("====== Finished upload of output files metadata.")
 
     # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
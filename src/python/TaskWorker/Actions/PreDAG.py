@@ -26,11 +26,7 @@ import json
 import copy
 import errno
 import pickle
-import shutil
 import logging
-import tarfile
-import tempfile
-import functools
 import subprocess
 from ast import literal_eval
 
@@ -39,7 +35,8 @@ from WMCore.DataStructs.LumiList import LumiList
 from ServerUtilities import getLock, newX509env, MAX_IDLE_JOBS, MAX_POST_JOBS, uploadToS3
 from RESTInteractions import CRABRest
 from RucioUtils import getNativeRucioClient
-from CRABUtils.Utils import addToGZippedTarfile
+from CRABUtils.Utils import addToGZippedTarfile, mergeCompactLumiLists
+from IndexedArchive import readMembers, JOB_INPUTS_ARCHIVE
 from TaskWorker.Actions.Splitter import Splitter
 from TaskWorker.Actions.DagmanCreator import DagmanCreator
 from TaskWorker.Actions.Recurring.BanDestinationSites import CRAB3BanDestinationSites
@@ -361,21 +358,18 @@ class PreDAG():
         if len(available) == 0 and len(failed) == 0:
             return False
 
-        missing = LumiList()
+        # collect all compact lists and merge them once
+        compactLists = []
         for missingFile in available:
             with open(os.path.join(missingDir, missingFile), 'r', encoding='utf-8') as fd:
                 self.logger.info("Adding missing lumis from job %s", missingFile)
-                missing = missing + LumiList(compactList=literal_eval(fd.read()))
-        for failedId in failed:
-            tmpdir = tempfile.mkdtemp()
-            with tarfile.open("run_and_lumis.tar.gz") as f:
-                fn = f"job_lumis_{failedId}.json"
-                f.extract(fn, path=tmpdir)
-                with open(os.path.join(tmpdir, fn), 'r', encoding='utf-8') as fd:
-                    injson = json.load(fd)
-                    missing = missing + LumiList(compactList=injson)
-                    self.logger.info("Adding lumis from failed job %s", failedId)
-            shutil.rmtree(tmpdir)
+                compactLists.append(literal_eval(fd.read()))
+        if failed:
+            jobLumis = readMembers(JOB_INPUTS_ARCHIVE, [f"job_lumis_{failedId}.json" for failedId in failed],
+                                   legacyTarball="run_and_lumis.tar.gz")
+            compactLists.extend(json.loads(content) for content in jobLumis.values())
+            self.logger.info("Adding lumis from failed jobs %s", sorted(failed))
+        missing = LumiList(compactList=mergeCompactLumiLists(compactLists))
         missignCompact = missing.getCompactList()
         runs = missing.getRuns()
         # Compact list is like
@@ -386,7 +380,7 @@ class PreDAG():
         # Now we turn lumis it into something like:
         # lumis=['1, 33, 35, 35, 37, 47, 49, 75, 77, 130, 133, 136','1,45,50,80']
         # which is the format expected by buildLumiMask in the splitting algorithm
-        lumis = [",".join(str(l) for l in functools.reduce(lambda x, y: x + y, missignCompact[run])) for run in runs]
+        lumis = [",".join(str(l) for pair in missignCompact[run] for l in pair) for run in runs]
 
         task['tm_split_args']['runs'] = runs
         task['tm_split_args']['lumis'] = lumis
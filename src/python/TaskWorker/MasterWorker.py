@@ -16,7 +16,7 @@ from MultiProcessingLog import MultiProcessingLog
 
 #CRAB dependencies
 from RESTInteractions import CRABRest
-from ServerUtilities import newX509env
+from ServerUtilities import newX509env, encodeRequest
 from ServerUtilities import SERVICE_INSTANCES
 from TaskWorker import __version__
 from TaskWorker.TestWorker import TestWorker
@@ -341,11 +341,14 @@ class MasterWorker(object):
             return False
 
         try:
-            # Update the status of each selected task to 'NEW'
-            for task in selected_tasks:
-                task_name = task['tm_taskname']
-                updateTaskStatus(crabserver=self.crabserver, taskName=task_name, status='NEW', logger=self.logger)
-                self.logger.info("Task %s status updated to 'NEW'.", task_name)
+            # Update the status of all selected tasks to 'NEW' at once, one by one if that fails
+            if self.updateWorks([(task['tm_taskname'], 'SUBMIT', 'NEW') for task in selected_tasks]):
+                self.logger.info("Status of %d tasks updated to 'NEW'.", len(selected_tasks))
+            else:
+                for task in selected_tasks:
+                    task_name = task['tm_taskname']
+                    updateTaskStatus(crabserver=self.crabserver, taskName=task_name, status='NEW', logger=self.logger)
+                    self.logger.info("Task %s status updated to 'NEW'.", task_name)
 
             # Prune the task queue if necessary
             self._pruneTaskQueue()
@@ -466,6 +469,30 @@ class MasterWorker(object):
         return False #failure
 
 
+    def updateWorks(self, works):
+        """ Same as updateWork for many tasks in a single request
+            :arg list works: list of (taskname, command, status) tuples
+            Return True if all changes succeded, False otherwise (in which case no task was changed)
+        """
+        if not works:
+            return True
+        configreq = {'subresource': 'bulkstate',
+                     'workflows': [taskname for taskname, _, _ in works],
+                     'commands': [command for _, command, _ in works],
+                     'statuses': [status for _, _, status in works]}
+        try:
+            self.crabserver.post(api='workflowdb', data=encodeRequest(configreq, listParams=['workflows', 'commands', 'statuses']))
+        except HTTPException as hte:
+            msg = "HTTP Error during updateWorks: %s\n" % str(hte)
+            msg += "HTTP Headers are %s: " % hte.headers
+            self.logger.error(msg)
+        except Exception: #pylint: disable=broad-except
+            self.logger.exception("Server could not process the updateWorks request for %d tasks", len(works))
+        else:
+            return True #success
+        return False #failure
+
+
     def restartQueuedTasks(self):
         """ This method is used at the TW startup and it restarts QUEUED tasks
             setting them  back again to NEW.
@@ -587,13 +614,19 @@ class MasterWorker(object):
                 self.logger.info("Retrieved a total of %d works", len(pendingwork))
                 self.logger.debug("Retrieved the following works: \n%s", str(tasksInfo))
 
-            toInject = []
+            toQueue = []
             for task in pendingwork:
                 if self.failBannedTask(task):
                     continue
                 if self.skipRejectedCommand(task):
                     continue
-                if self.updateWork(task['tm_taskname'], task['tm_task_command'], 'QUEUED'):
+                toQueue.append(task)
+            # move all tasks to QUEUED with one request. If that fails (e.g. one of them
+            # was changed meanwhile) fall back to one request per task
+            bulkQueued = self.updateWorks([(task['tm_taskname'], task['tm_task_command'], 'QUEUED') for task in toQueue])
+            toInject = []
+            for task in toQueue:
+                if bulkQueued or self.updateWork(task['tm_taskname'], task['tm_task_command'], 'QUEUED'):
                     worktype, failstatus = STATE_ACTIONS_MAP[task['tm_task_command']]
                     toInject.append((worktype, task, failstatus, None))
                 else:
@@ -621,8 +654,11 @@ class MasterWorker(object):
                     self.logger.info(f"      wid {wid} : {work['workflow']}")
             self.logger.info(' - tasks pending in queue: %d', self.slaves.pendingTasks())
 
-            time.sleep(self.config.TaskWorker.polling)
-
-            dummyFinished = self.slaves.checkFinished()
+            # wait for some work to finish, at most polling seconds. Do not wait at all if all
+            # slots were filled and there are still free ones, since more work may be waiting
+            timeout = self.config.TaskWorker.polling
+            if toInject and len(pendingwork) >= limit and self.slaves.queueableTasks() > 0:
+                timeout = 0
+            dummyFinished = self.slaves.checkFinished(timeout=timeout)
 
         self.logger.debug("Master Worker Exiting Main Cycle.")
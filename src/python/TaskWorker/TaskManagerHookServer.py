@@ -0,0 +1,325 @@
+"""
+Long lived server which runs the DAG PRE/POST scripts (PreJob, PostJob, PreDAG)
+of one task, started by dag_bootstrap_startup.sh in the spool directory.
+
+Without it, every PRE and POST script of every node starts a new python
+interpreter and imports WMCore, htcondor, Rucio etc. in TaskManagerBootstrap.
+The server imports them once, listens on a Unix socket in the spool directory
+and for every request forks a child which runs TaskManagerBootstrap.bootstrap()
+with the arguments, environment, working directory and stdin/stdout/stderr of
+the dag_hook_client.py which sent the request. The exit code of the child is
+sent back to the client, which exits with it.
+
+Requests are handled in a single thread: the socket is polled and the children
+are reaped in the same loop, so forking never happens while other threads
+hold locks. The server exits when the DAGMan process is gone.
+
+Protocol (see also scripts/dagman/dag_hook_client.py):
+ client -> server: 4 bytes payload length (network order) with the stdin,
+                   stdout and stderr fds attached as SCM_RIGHTS, then the
+                   payload: json {"argv": [...], "env": {...}, "cwd": "..."}
+ server -> client: 4 bytes signed exit code (network order)
+"""
+import os
+import sys
+import json
+import time
+import array
+import random
+import select
+import signal
+import socket
+import struct
+import logging
+import argparse
+import importlib
+import traceback
+
+SOCKET_NAME = 'dag_hook_server.sock'
+# seconds to wait for a complete request from a client
+REQUEST_TIMEOUT = 10
+# seconds between checks that DAGMan is still running
+DAGMAN_CHECK_INTERVAL = 60
+# signals which the bootstrapped modules (e.g. PostJob) set handlers for at import time
+CHILD_SIGNALS = (signal.SIGHUP, signal.SIGINT, signal.SIGTERM)
+
+
+def exitCodeFromStatus(status):
+    """
+    convert a waitpid status to an exit code the way a shell does
+    """
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def recvRequest(conn):
+    """
+    read a request from a client connection
+    :return: (request dictionary, list of the 3 fds of the client)
+    """
+    fds = array.array('i')
+    msg, ancdata, _, _ = conn.recvmsg(4, socket.CMSG_LEN(3 * fds.itemsize))
+    for level, kind, data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    if len(msg) != 4 or len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        raise ValueError("Malformed request header")
+    size = struct.unpack('!I', msg)[0]
+    payload = b''
+    while len(payload) < size:
+        chunk = conn.recv(size - len(payload))
+        if not chunk:
+            for fd in fds:
+                os.close(fd)
+            raise ValueError("Truncated request")
+        payload += chunk
+    return json.loads(payload.decode('utf-8')), list(fds)
+
+
+class HookServer():
+    """
+    Accepts requests from dag_hook_client.py and runs them in forked children
+    """
+
+    def __init__(self, bootstrapModule, socketName, dagmanPid, logger):
+        self.bootstrapModule = bootstrapModule
+        self.socketName = socketName
+        self.dagmanPid = dagmanPid
+        self.logger = logger
+        self.children = {}
+        self.childHandlers = {}
+        self.sock = None
+        self.socketInode = None
+        self.wakeupPipe = None
+
+    def start(self):
+        """
+        import the bootstrap module and listen on the socket
+        """
+        self.bootstrapModule = importlib.import_module(self.bootstrapModule)
+        # keep the handlers set at import time for the children, but the server itself
+        # must be stoppable as usual
+        for sig in CHILD_SIGNALS:
+            self.childHandlers[sig] = signal.getsignal(sig)
+            signal.signal(sig, signal.SIG_DFL)
+        if os.path.exists(self.socketName):
+            os.unlink(self.socketName)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        oldUmask = os.umask(0o077)
+        try:
+            self.sock.bind(self.socketName)
+        finally:
+            os.umask(oldUmask)
+        self.socketInode = os.stat(self.socketName).st_ino
+        self.sock.listen(64)
+        # wake up the main loop as soon as a child exits
+        self.wakeupPipe = os.pipe()
+        for fd in self.wakeupPipe:
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self.wakeupPipe[1])
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        self.logger.info("Listening on %s with %s", self.socketName, self.bootstrapModule.__name__)
+
+    def dagmanRunning(self):
+        """
+        True if DAGMan process is still there (or if we do not know its pid)
+        """
+        if not self.dagmanPid:
+            return True
+        try:
+            os.kill(self.dagmanPid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def removeSocket(self):
+        """
+        remove the socket file, unless it was replaced by the one of a new server
+        (e.g. when DAGMan is restarted before this one noticed it)
+        """
+        try:
+            if os.stat(self.socketName).st_ino == self.socketInode:
+                os.unlink(self.socketName)
+        except OSError:
+            pass
+
+    def serve(self):
+        """
+        main loop
+        """
+        lastCheck = time.time()
+        while True:
+            clients = {conn: pid for pid, conn in self.children.items() if conn is not None}
+            readable, _, _ = select.select([self.sock, self.wakeupPipe[0]] + list(clients), [], [], 1)
+            for conn in readable:
+                if conn is self.sock:
+                    self.accept()
+                elif conn == self.wakeupPipe[0]:
+                    try:
+                        os.read(self.wakeupPipe[0], 4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    # clients only wait for the exit code, so this is EOF: the
+                    # client was killed (e.g. condor_rm of the DAG) and so is its job
+                    self.stopChild(clients[conn], conn)
+            self.reap()
+            if time.time() - lastCheck > DAGMAN_CHECK_INTERVAL:
+                lastCheck = time.time()
+                if not self.dagmanRunning():
+                    self.logger.info("DAGMan process %s is gone, exiting", self.dagmanPid)
+                    break
+        self.sock.close()
+        self.removeSocket()
+        # let running children finish and report to their clients
+        while self.children:
+            self.reap()
+            time.sleep(1)
+
+    def accept(self):
+        """
+        read one request and fork a child to run it
+        """
+        conn, _ = self.sock.accept()
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+            request, fds = recvRequest(conn)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("Failed to read request")
+            conn.close()
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.runChild(conn, request, fds)
+        for fd in fds:
+            os.close(fd)
+        self.children[pid] = conn
+        self.logger.info("Started child %d for %s", pid, request['argv'][:1])
+
+    def stopChild(self, pid, conn):
+        """
+        the client of a child went away, stop the child as a signal to the client would
+        """
+        self.logger.info("Client of child %d is gone, sending SIGTERM", pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        conn.close()
+        self.children[pid] = None
+
+    def reap(self):
+        """
+        collect the exit codes of the finished children and send them to the clients
+        """
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            if pid not in self.children:
+                continue
+            conn = self.children.pop(pid)
+            exitCode = exitCodeFromStatus(status)
+            self.logger.info("Child %d exited with %d", pid, exitCode)
+            if conn is None:
+                continue
+            try:
+                conn.sendall(struct.pack('!i', exitCode))
+            except OSError:
+                self.logger.warning("Client of child %d is gone", pid)
+            conn.close()
+
+    def runChild(self, conn, request, fds):
+        """
+        in the forked child: set up the client process context and run
+        the bootstrap the same way TaskManagerBootstrap.__main__ does.
+        Never returns.
+        """
+        exitCode = 1
+        try:
+            self.sock.close()
+            conn.close()
+            for otherConn in self.children.values():
+                if otherConn is not None:
+                    otherConn.close()
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+                handler.close()
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for fd in self.wakeupPipe:
+                os.close(fd)
+            for sig, handler in self.childHandlers.items():
+                signal.signal(sig, handler)
+            random.seed()
+            for i, fd in enumerate(fds):
+                os.dup2(fd, i)
+                os.close(fd)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.argv = [self.bootstrapModule.__file__] + request['argv']
+            try:
+                retval = self.bootstrapModule.bootstrap()
+                print(f"Ended TaskManagerBootstrap with code {retval}")
+                sys.exit(retval)
+            except SystemExit as ex:
+                if ex.code is None:
+                    exitCode = 0
+                elif isinstance(ex.code, int):
+                    exitCode = ex.code
+                else:
+                    print(ex.code, file=sys.stderr)
+                    exitCode = 1
+            except Exception as ex:  # pylint: disable=broad-except
+                print(f"Got a fatal exception: {ex}")
+                traceback.print_exc()
+                exitCode = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(exitCode)  # pylint: disable=protected-access
+
+
+def main():
+    """
+    parse arguments and run the server in the current (spool) directory
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--dagman-pid', type=int, default=0,
+                        help="exit when this process is gone")
+    parser.add_argument('--socket', default=SOCKET_NAME,
+                        help="path of the Unix socket, relative to the spool directory")
+    parser.add_argument('--bootstrap-module', default='TaskWorker.TaskManagerBootstrap',
+                        help="module with the bootstrap() function to run")
+    args = parser.parse_args()
+
+    logger = logging.getLogger('TaskManagerHookServer')
+    handler = logging.FileHandler('dag_hook_server.log')
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    server = HookServer(args.bootstrap_module, args.socket, args.dagman_pid, logger)
+    try:
+        server.start()
+        server.serve()
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Hook server failed")
+        server.removeSocket()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
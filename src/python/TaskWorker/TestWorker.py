@@ -1,3 +1,5 @@
+import time
+
 class TestWorker(object):
     """ TestWorker class providing a sequential execution of the work in the same thread of the caller
         This is useful for debugging purposes because because there are problems executing pdb with
@@ -32,7 +34,8 @@ class TestWorker(object):
                 func(self.resthost, self.dbInstance, self.config, task, 0, args)
             except Exception:
                 pass
-    def checkFinished(self):
+    def checkFinished(self, timeout=0):
+        time.sleep(timeout)
         return []
 
     def end(self):
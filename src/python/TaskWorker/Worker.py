@@ -15,12 +15,12 @@ if sys.version_info >= (3, 0):
 if sys.version_info < (3, 0):
     from urllib import urlencode
 
-from RESTInteractions import CRABRest
 from TaskWorker.DataObjects.Result import Result
 from ServerUtilities import truncateError, executeCommand, FEEDBACKMAIL
 from TaskWorker.WorkerExceptions import WorkerHandlerException, TapeDatasetException,\
     ChildUnexpectedExitException, ChildTimeoutException, SubmissionRefusedException
 from TaskWorker.ChildWorker import startChildWorker
+from TaskWorker.WorkerUtilities import getClientRegistry
 
 
 ## Creating configuration globals to avoid passing these around at every request
@@ -72,6 +72,22 @@ def removeTaskLogHandler(logger, taskhandler):
     logger.removeHandler(taskhandler)
 
 
+def warmUpClients(work, resthost, dbInstance, logger):
+    """
+    Create in the slave the clients which the work will get from the
+    ClientRegistry, so that all child workers inherit them instead of
+    creating and authenticating them for every task
+    """
+    clients = getClientRegistry(WORKER_CONFIG)
+    try:
+        clients.getCrabserver(resthost, dbInstance, WORKER_CONFIG, logger)
+        if work.__name__ == 'handleNewTask':
+            clients.getRucioClient(WORKER_CONFIG, logger)
+            clients.getRucioClient(WORKER_CONFIG, logger, account='crab_input')
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Failed to create clients, child worker will try again")
+
+
 def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, logsDir):
     procName = "Process-%s" % procnum
     while True:
@@ -102,6 +118,7 @@ def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, lo
                hasattr(WORKER_CONFIG.FeatureFlags, 'childWorker') and \
                WORKER_CONFIG.FeatureFlags.childWorker:
                 logger.debug(f'Run {work.__name__} in childWorker.')
+                warmUpClients(work, resthost, dbInstance, logger)
                 args = (resthost, dbInstance, WORKER_CONFIG, task, procnum, inputargs)
                 workOutput = startChildWorker(WORKER_CONFIG, work, args, logger)
             else:
@@ -136,9 +153,7 @@ def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, lo
             msg += "\n" + str(traceback.format_exc())
         finally:
             if msg:
-                crabserver = CRABRest(resthost, WORKER_CONFIG.TaskWorker.cmscert, WORKER_CONFIG.TaskWorker.cmskey,
-                                      retry=20, logger=logger, userAgent='CRABTaskWorker')
-                crabserver.setDbInstance(dbInstance)
+                crabserver = getClientRegistry(WORKER_CONFIG).getCrabserver(resthost, dbInstance, WORKER_CONFIG, logger)
                 failTask(task['tm_taskname'], crabserver, msg, logger, failstatus)
         t1 = time.time()
         workType = task.get('tm_task_command', 'RECURRING')
@@ -276,18 +291,26 @@ class Worker(object):
             workid += 1
         self.logger.debug("Injection completed.")
 
-    def checkFinished(self):
-        """Verifies if there are any finished jobs in the output queue
+    def checkFinished(self, timeout=0):
+        """Verifies if there are any finished jobs in the output queue.
+           If timeout is given, waits up to timeout seconds for the first one to finish,
+           returning as soon as it does, so that the caller can refill the free slaves.
 
+           :arg int timeout: maximum number of seconds to wait
            :return Result: the output of the work completed."""
         if len(self.working.keys()) == 0:
+            if timeout:
+                time.sleep(timeout)
             return []
         allout = []
         self.logger.info("%d work on going, checking if some has finished", len(self.working.keys()))
-        for _ in range(len(self.working.keys())):
+        for i in range(len(self.working.keys())):
             out = None
             try:
-                out = self.results.get_nowait()
+                if i == 0 and timeout:
+                    out = self.results.get(timeout=timeout)
+                else:
+                    out = self.results.get_nowait()
             except Empty:
                 pass
             if out is not None:
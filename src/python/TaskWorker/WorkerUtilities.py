@@ -2,6 +2,9 @@
 Common functions to be reused around TW and Publisher
 """
 
+import os
+import copy
+import time
 import logging
 import functools
 
@@ -10,7 +13,9 @@ from urllib.parse import urlencode
 
 from ServerUtilities import truncateError, tempSetLogLevel, SERVICE_INSTANCES
 from RESTInteractions import CRABRest
+from RucioUtils import getNativeRucioClient
 from WMCore.Services.CRIC.CRIC import CRIC
+from TaskWorker import __version__
 from TaskWorker.WorkerExceptions import ConfigException
 
 def getCrabserver(restConfig=None, agentName='crabtest', logger=None):
@@ -142,3 +147,90 @@ class CRICService(CRIC):
     def PNNstoPSNs(self, *args, **kwargs):
         """ maps PhexedNodeNames (i.e. RSE's) to ProcessingSiteNames (i.e. sites) """
         return super().PNNstoPSNs(*args, **kwargs)
+
+
+class ClientRegistry():
+    """
+    Registry of the CRAB REST and Rucio clients used by the actions of a
+    TaskWorker slave, so that they are created (and authenticated) once and
+    reused for all the tasks the slave works on, instead of once per task.
+    A client is created again when the certificate or key it uses is
+    changed on disk, or when it is older than maxAge seconds.
+    Clients created before a fork (e.g. by the slave before starting a child
+    worker) are reused by the child, but the connections they have open are
+    dropped in the child, so that the two processes never share a socket.
+    """
+
+    def __init__(self, maxAge=3600):
+        self.maxAge = maxAge
+        self.clients = {}
+
+    def _getClient(self, key, credentials, create, logger):
+        """
+        Return the client registered with key, calling create() to make
+        a new one if needed.
+        :param credentials: paths of the files the client authenticates with
+        """
+        stamp = [os.path.getmtime(f) if f and os.path.exists(f) else None for f in credentials]
+        entry = self.clients.get(key)
+        if entry and (entry['stamp'] != stamp or time.time() - entry['created'] > self.maxAge):
+            logger.info("Refreshing client %s", key)
+            entry = None
+        if entry is None:
+            entry = {'client': create(), 'stamp': stamp, 'created': time.time(), 'pid': os.getpid()}
+            self.clients[key] = entry
+        elif entry['pid'] != os.getpid():
+            session = getattr(entry['client'], 'session', None)
+            if session:
+                session.close()
+            entry['pid'] = os.getpid()
+        return entry['client']
+
+    def getCrabserver(self, resthost, dbInstance, config, logger):
+        """
+        Return a CRABRest object for resthost/dbInstance using the TaskWorker
+        certificate. Requests are logged with logger.
+        """
+        cert, key = config.TaskWorker.cmscert, config.TaskWorker.cmskey
+
+        def create():
+            crabserver = CRABRest(resthost, cert, key, retry=20, logger=logger,
+                                  userAgent='CRABTaskWorker', version=__version__)
+            crabserver.setDbInstance(dbInstance)
+            return crabserver
+
+        crabserver = self._getClient(('crabserver', resthost, dbInstance), (cert, key), create, logger)
+        crabserver.server.logger = logger
+        return crabserver
+
+    def getRucioClient(self, config, logger, account=None):
+        """
+        Return a native Rucio client for account, by default the one
+        in config.Services.Rucio_account
+        """
+        defaultAccount = config.Services.Rucio_account
+        account = account or defaultAccount
+
+        def create():
+            rucioConfig = config
+            if account != defaultAccount:
+                rucioConfig = copy.deepcopy(config)
+                rucioConfig.Services.Rucio_account = account
+            return getNativeRucioClient(rucioConfig, logger)
+
+        credentials = (config.Services.Rucio_cert, config.Services.Rucio_key)
+        return self._getClient(('rucio', account), credentials, create, logger)
+
+
+CLIENT_REGISTRY = None
+
+
+def getClientRegistry(config):
+    """
+    Return the ClientRegistry of this process. Clients expire after
+    config.TaskWorker.clientsMaxAge seconds (default 1 hour)
+    """
+    global CLIENT_REGISTRY  # pylint: disable=global-statement
+    if CLIENT_REGISTRY is None:
+        CLIENT_REGISTRY = ClientRegistry(maxAge=getattr(config.TaskWorker, 'clientsMaxAge', 3600))
+    return CLIENT_REGISTRY
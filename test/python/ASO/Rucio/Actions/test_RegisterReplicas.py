@@ -103,6 +103,69 @@ def test_getSourcePFN(mock_Transfer, mock_rucioClient):
     mock_rucioClient.get_protocols.assert_called()
     mock_rucioClient.lfns2pfns.assert_called_once()
 
+def test_getSourcePFN_cache(mock_Transfer, mock_rucioClient, tmp_path):
+    srcRSE = 'T3_US_FNALLPC'
+    dstRSE = 'T2_CH_CERN'
+    srcLFN = '/store/temp/user/tseethon.d6830fc3715ee01030105e83b81ff3068df7c8e0/tseethon/test-workflow/GenericTTbar/autotest-1679671056/230324_151740/0000/output_17.root'
+    srcPFN = 'davs://cmseos.fnal.gov:9000/eos/uscms/store/temp/user/tseethon.d6830fc3715ee01030105e83b81ff3068df7c8e0/tseethon/test-workflow/GenericTTbar/autotest-1679671056/230324_151740/0000/output_17.root'
+    srcDid = f'{mock_Transfer.rucioScope}:{srcLFN}'
+    mock_rucioClient.lfns2pfns.return_value = {srcDid: srcPFN}
+    config.args = Namespace(rse_pfn_cache_path=str(tmp_path / 'rse_pfn_cache.json'), rse_pfn_cache_ttl=3600)
+    with patch('ASO.Rucio.Actions.RegisterReplicas.find_matching_scheme', autospec=True) as mock_find_matching_scheme:
+        mock_find_matching_scheme.return_value = ('', 'davs', '', '')
+        r = RegisterReplicas(mock_Transfer, mock_rucioClient, Mock())
+        assert r.getSourcePFN(srcLFN, srcRSE, dstRSE) == srcPFN
+        # new instance (e.g. another task_process) reads the cache file
+        r = RegisterReplicas(mock_Transfer, mock_rucioClient, Mock())
+        otherLFN = srcLFN.replace('output_17', 'output_18')
+        assert r.getSourcePFN(otherLFN, srcRSE, dstRSE) == srcPFN.replace('output_17', 'output_18')
+        mock_find_matching_scheme.assert_called_once()
+    mock_rucioClient.lfns2pfns.assert_called_once()
+    config.args = None
+
+def test_getSourcePFN_cache_per_area(mock_Transfer, mock_rucioClient, tmp_path):
+    srcRSE = 'T3_US_FNALLPC'
+    dstRSE = 'T2_CH_CERN'
+    userLFN = '/store/temp/user/tseethon.d6830fc3715ee01030105e83b81ff3068df7c8e0/tseethon/output_17.root'
+    groupLFN = '/store/temp/group/tseethon.d6830fc3715ee01030105e83b81ff3068df7c8e0/tseethon/output_17.root'
+    userPFN = f'davs://cmseos.fnal.gov:9000/eos/uscms{userLFN}'
+    groupPFN = f'davs://cmseos.fnal.gov:9000/eos/uscms/group{groupLFN}'
+    mock_rucioClient.lfns2pfns.side_effect = [{f'{mock_Transfer.rucioScope}:{userLFN}': userPFN},
+                                              {f'{mock_Transfer.rucioScope}:{groupLFN}': groupPFN}]
+    config.args = Namespace(rse_pfn_cache_path=str(tmp_path / 'rse_pfn_cache.json'), rse_pfn_cache_ttl=3600)
+    with patch('ASO.Rucio.Actions.RegisterReplicas.find_matching_scheme', autospec=True) as mock_find_matching_scheme:
+        mock_find_matching_scheme.return_value = ('', 'davs', '', '')
+        r = RegisterReplicas(mock_Transfer, mock_rucioClient, Mock())
+        assert r.getSourcePFN(userLFN, srcRSE, dstRSE) == userPFN
+        # the rule learned for /store/temp/user/ is not applied to /store/temp/group/
+        r = RegisterReplicas(mock_Transfer, mock_rucioClient, Mock())
+        assert r.getSourcePFN(groupLFN, srcRSE, dstRSE) == groupPFN
+        # both rules are kept
+        r = RegisterReplicas(mock_Transfer, mock_rucioClient, Mock())
+        assert r.getSourcePFN(userLFN.replace('output_17', 'output_18'), srcRSE, dstRSE) == userPFN.replace('output_17', 'output_18')
+        assert r.getSourcePFN(groupLFN.replace('output_17', 'output_18'), srcRSE, dstRSE) == groupPFN.replace('output_17', 'output_18')
+    assert mock_rucioClient.lfns2pfns.call_count == 2
+    config.args = None
+
+def test_addReplicasToContainer_fill_datasets(mock_Transfer, mock_rucioClient):
+    container = '/TestPrimary/test-dataset_TRANSFER/USER'
+    # open dataset already has 3 files, limit is 5
+    replicasInContainer = {f'/store/user/rucio/cmscrab/old_{i}.root': f'{container}#1' for i in range(3)}
+    mock_Transfer.populateLFN2DatasetMap.return_value = replicasInContainer
+    mock_Transfer.containerRuleID = 'b43a554244c54dba954aa29cb2fdde0a'
+    fileDocs = [{'id': str(i), 'name': f'/store/user/rucio/cmscrab/new_{i}.root'} for i in range(6)]
+    config.args = Namespace(replicas_chunk_size=2, max_file_per_dataset=5)
+    with patch('ASO.Rucio.Actions.RegisterReplicas.BuildDBSDataset', autospec=True) as mock_BuildDBSDataset:
+        mock_BuildDBSDataset.return_value.getOrCreateDataset.side_effect = [f'{container}#1', f'{container}#2']
+        r = RegisterReplicas(mock_Transfer, mock_rucioClient, Mock())
+        ret = r.addReplicasToContainer(fileDocs, container)
+    assert [x['dataset'] for x in ret] == [f'{container}#1']*2 + [f'{container}#2']*4
+    assert [len(c.args[0][0]['dids']) for c in mock_rucioClient.add_files_to_datasets.call_args_list] == [2, 2, 2]
+    mock_rucioClient.list_content.assert_not_called()
+    mock_rucioClient.close.assert_called_once_with(mock_Transfer.rucioScope, f'{container}#1')
+    closedLFNs = list(replicasInContainer) + [x['name'] for x in fileDocs[:2]]
+    mock_Transfer.updateClosedDatasets.assert_called_once_with(f'{container}#1', closedLFNs)
+
 def test_prepare_single_xdict(mock_Transfer, mock_rucioClient):
     # input
     prepareInput = [{
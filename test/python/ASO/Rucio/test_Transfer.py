@@ -3,10 +3,11 @@
 import pytest
 import builtins
 import json
+import os
 from unittest.mock import patch, mock_open, MagicMock
 from argparse import Namespace
 
-from ASO.Rucio.Transfer import Transfer
+from ASO.Rucio.Transfer import Transfer, TransferItemsIndex
 from ASO.Rucio.exception import RucioTransferException
 import ASO.Rucio.config as config
 #from .fixtures import mock_rucioClient
@@ -357,27 +358,142 @@ def test_updateLFN2PFNMap(LFN2PFNMapJSON, fs):
         fileContent = json.loads(mock_file.read())
         assert fileContent == LFN2PFNMapJSON
 
-def test_readCleanedFiles(cleanedFiles):
-    path = '/path/to/files.txt'
-    config.args = Namespace(cleaned_files_path=path, ignore_cleaned_files=False)
-    with patch('ASO.Rucio.Transfer.open', new_callable=mock_open, read_data=json.dumps(cleanedFiles)) as mo:
-        t = Transfer()
-        t.readCleanedFiles()
-        # check if open correct file
-        mo.assert_called_once_with(path, 'r', encoding='utf-8')
-        assert t.cleanedFiles == cleanedFiles
+def test_readCleanedFiles(cleanedFiles, tmp_path):
+    path = tmp_path / 'files.txt'
+    path.write_text(''.join(f'{x}\n' for x in cleanedFiles), encoding='utf-8')
+    config.args = Namespace(cleaned_files_path=str(path), ignore_cleaned_files=False)
+    t = Transfer()
+    t.readCleanedFiles()
+    assert list(t.cleanedFiles) == cleanedFiles
+    assert cleanedFiles[0] in t.cleanedFiles
+
+def test_readCleanedFiles_old_json(cleanedFiles, tmp_path):
+    path = tmp_path / 'cleaned_files.txt'
+    (tmp_path / 'cleaned_files.json').write_text(json.dumps(cleanedFiles[:2]), encoding='utf-8')
+    config.args = Namespace(cleaned_files_path=str(path), ignore_cleaned_files=False)
+    t = Transfer()
+    t.readCleanedFiles()
+    assert list(t.cleanedFiles) == cleanedFiles[:2]
+    # converted once, from now on only the txt file is used
+    assert path.read_text(encoding='utf-8').splitlines() == cleanedFiles[:2]
+    t.updateCleanedFiles(cleanedFiles)
+    t = Transfer()
+    t.readCleanedFiles()
+    assert list(t.cleanedFiles) == cleanedFiles
 
-def test_updateCleanedFiles(cleanedFiles, fs):
-    path = '/path/to/files.txt'
-    config.args = Namespace(cleaned_files_path=path, ignore_cleaned_files=False)
-    fs.create_file(path)
-    with open(path, 'w', encoding='utf-8') as mock_file:
-        with patch('ASO.Rucio.Transfer.writePath') as mock_writePath:
-            mock_writePath.return_value.__enter__.return_value = mock_file
-            t = Transfer()
-            t.cleanedFiles = cleanedFiles
-            t.updateCleanedFiles()
-            mock_writePath.assert_called_once_with(path)
-    with open(path, 'r', encoding='utf-8') as mock_file:
-        fileContent = json.loads(mock_file.read())
-        assert fileContent == cleanedFiles
+def test_updateCleanedFiles(cleanedFiles, tmp_path):
+    path = tmp_path / 'files.txt'
+    config.args = Namespace(cleaned_files_path=str(path), ignore_cleaned_files=False)
+    t = Transfer()
+    t.readCleanedFiles()
+    t.updateCleanedFiles(cleanedFiles[:2])
+    # only new files are appended
+    t.updateCleanedFiles(cleanedFiles)
+    fileContent = path.read_text(encoding='utf-8').splitlines()
+    assert fileContent == cleanedFiles
+
+def makeTransferItem(jobId, i):
+    """ a line of transfers.txt """
+    return {'id': f'id_{jobId}_{i}', 'username': 'cmsbot', 'job_id': jobId, 'source': 'T2_CH_CERN',
+            'source_lfn': f'/store/temp/user/cmsbot/output_{jobId}_{i}.root',
+            'destination_lfn': f'/store/user/cmsbot/output_{jobId}_{i}.root',
+            'outputdataset': '/GenericTTbar/cmsbot-test-00000000000000000000000000000000/USER',
+            'checksums': {'adler32': f'{jobId:08x}'}}
+
+@pytest.fixture(name='transfersArgs')
+def fixture_transfersArgs(tmp_path):
+    """ paths of transfers.txt and its bookkeeping files in tmp_path """
+    config.args = Namespace(transfers_txt_path=str(tmp_path / 'transfers.txt'),
+                            transfers_index_path=str(tmp_path / 'transfers_index.txt'),
+                            last_line_path=str(tmp_path / 'last_transfer.txt'),
+                            last_offset_path=str(tmp_path / 'last_transfer_offset.txt'),
+                            force_last_line=None, force_publishname=None)
+    return config.args
+
+def appendTransferItems(path, items, partial=''):
+    """ append the lines of items and an incomplete line to transfers.txt """
+    with open(path, 'a', encoding='utf-8') as w:
+        w.write(''.join(json.dumps(item) + '\n' for item in items) + partial)
+
+def test_readLastTransferLine_offset_from_line(transfersArgs):
+    items = [makeTransferItem(1, i) for i in range(3)]
+    appendTransferItems(transfersArgs.transfers_txt_path, items)
+    # bookkeeping of a task started before the offset was saved
+    with open(transfersArgs.last_line_path, 'w', encoding='utf-8') as w:
+        w.write('2')
+    t = Transfer()
+    t.readLastTransferLine()
+    assert t.lastTransferLine == 2
+    assert t.lastTransferOffset == len(''.join(json.dumps(item) + '\n' for item in items[:2]))
+    # as for the other runs, once saved
+    with open(transfersArgs.last_offset_path, 'w', encoding='utf-8') as w:
+        w.write('10')
+    t.readLastTransferLine()
+    assert t.lastTransferOffset == 10
+
+def test_readTransferItems_partial_line(transfersArgs):
+    items = [makeTransferItem(1, i) for i in range(3)] + [makeTransferItem(2, i) for i in range(2)]
+    lastLine = json.dumps(makeTransferItem(3, 0)) + '\n'
+    # a PostJob is writing the last line
+    appendTransferItems(transfersArgs.transfers_txt_path, items, lastLine[:20])
+    t = Transfer()
+    t.readLastTransferLine()
+    t.buildLFN2transferItemMap()
+    t.readTransferItems()
+    assert t.transferItems == items
+    assert t.firstJobTransferItems == items[:3]
+    assert sorted(t.LFN2transferItemMap) == sorted(item['destination_lfn'] for item in items)
+    t.updateLastTransferLine(5)
+    # next run: only the completed line is new
+    appendTransferItems(transfersArgs.transfers_txt_path, [], lastLine[20:])
+    t = Transfer()
+    t.readLastTransferLine()
+    assert t.lastTransferLine == 5
+    t.buildLFN2transferItemMap()
+    t.readTransferItems()
+    assert t.transferItems == [makeTransferItem(3, 0)]
+    assert t.firstJobTransferItems == items[:3]
+    assert len(t.LFN2transferItemMap) == 6
+    t.updateLastTransferLine(6)
+    with open(transfersArgs.last_offset_path, 'r', encoding='utf-8') as r:
+        assert int(r.read()) == os.path.getsize(transfersArgs.transfers_txt_path)
+    t = Transfer()
+    t.readLastTransferLine()
+    t.buildLFN2transferItemMap()
+    with pytest.raises(RucioTransferException):
+        t.readTransferItems()
+
+def test_TransferItemsIndex(transfersArgs):
+    items = [makeTransferItem(1, i) for i in range(3)]
+    # a retry of the job: the map points to the latest transfer of a destination LFN
+    retry = dict(items[1], id='id_1_1_retry', source='T2_US_Nebraska')
+    appendTransferItems(transfersArgs.transfers_txt_path, items + [retry])
+    t = Transfer()
+    t.lastTransferLine, t.lastTransferOffset = 0, 0
+    t.buildLFN2transferItemMap()
+    t.readTransferItems()
+    # a new run reads the index, not transfers.txt
+    index = TransferItemsIndex(transfersArgs.transfers_txt_path, transfersArgs.transfers_index_path)
+    index.load()
+    assert index.indexedOffset == os.path.getsize(transfersArgs.transfers_txt_path)
+    assert sorted(index) == sorted(item['destination_lfn'] for item in items)
+    item = index[retry['destination_lfn']]
+    assert {field: item[field] for field in TransferItemsIndex.FIELDS} == \
+        {field: retry[field] for field in TransferItemsIndex.FIELDS}
+    assert not item.complete
+    # other fields are read from transfers.txt when needed
+    with patch.object(index, 'readItem', wraps=index.readItem) as readItem:
+        assert item['checksums'] == retry['checksums']
+        assert item['job_id'] == 1
+        readItem.assert_called_once()
+    assert item.complete
+    assert dict(item) == retry
+    with pytest.raises(KeyError):
+        item['not_a_field']  # pylint: disable=pointless-statement
+    assert item.get('not_a_field') is None
+    # a line of the index which is being written is ignored
+    with open(transfersArgs.transfers_index_path, 'a', encoding='utf-8') as w:
+        w.write('1000\t2000\t/store/user/cmsbot/partial')
+    index = TransferItemsIndex(transfersArgs.transfers_txt_path, transfersArgs.transfers_index_path)
+    index.load()
+    assert len(index) == 3
@@ -0,0 +1,39 @@
+"""
+unittest for CRABUtils.Utils
+"""
+import random
+
+from WMCore.DataStructs.LumiList import LumiList
+
+from CRABUtils.Utils import mergeCompactLumiLists
+
+
+def makeJobLumis(rng, nRuns=5):
+    """ a compact list like the job_lumis_<id>.json written by DagmanCreator """
+    compactList = {}
+    for run in rng.sample(range(1, 50), nRuns):
+        first = rng.randint(1, 2000)
+        pairs = []
+        for _ in range(rng.randint(1, 4)):
+            last = first + rng.randint(0, 20)
+            pairs.append([first, last])
+            first = last + rng.randint(1, 5)
+        compactList[str(run)] = pairs
+    return compactList
+
+
+def test_mergeCompactLumiLists():
+    merged = mergeCompactLumiLists([{'1': [[5, 8], [1, 2]]}, {1: [[3, 3], [10, 12]], '2': []}, {'1': [[11, 20], [6, 6]]}])
+    assert merged == {'1': [[1, 3], [5, 8], [10, 20]]}
+    assert mergeCompactLumiLists([]) == {}
+
+
+def test_mergeCompactLumiLists_same_as_LumiList_sum():
+    rng = random.Random(12345)
+    compactLists = [makeJobLumis(rng) for _ in range(300)]
+    expected = LumiList()
+    for compactList in compactLists:
+        expected = expected + LumiList(compactList=compactList)
+    merged = LumiList(compactList=mergeCompactLumiLists(compactLists))
+    assert merged.getCompactList() == expected.getCompactList()
+    assert merged.getRuns() == expected.getRuns()
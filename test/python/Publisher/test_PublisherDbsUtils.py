@@ -0,0 +1,270 @@
+"""
+unittest for Publisher.PublisherDbsUtils, with mocked DBS APIs
+"""
+import os
+import time
+import logging
+from unittest.mock import MagicMock
+
+import threading
+import pytest
+
+from RestClient.ErrorHandling.RestClientExceptions import HTTPError
+from TaskWorker.WorkerExceptions import CannotMigrateException
+from Publisher import PublisherDbsUtils
+from Publisher.PublisherDbsUtils import MigrationManager, findParentBlocks, lookupBlocksInBulk
+
+DATASET = '/Parent/Run2024-v1/MINIAOD'
+
+
+def migrationStatus(status):
+    """ what migrateApi.statusMigration returns for a migration in this status """
+    return [{'migration_status': status, 'migration_request_id': 1234, 'retry_count': 0,
+             'creation_date': int(time.time())}]
+
+
+@pytest.fixture(name='migrateApi')
+def fixture_migrateApi():
+    """ a DBS migrate API where every migration is in progress, unless changed in statuses """
+    migrateApi = MagicMock()
+    migrateApi.statuses = {}
+    migrateApi.submitMigration.side_effect = lambda data: [{'migration_input': data['migration_input']}]
+    migrateApi.statusMigration.side_effect = lambda block_name: migrationStatus(migrateApi.statuses.get(block_name, 1))
+    return migrateApi
+
+
+@pytest.fixture(name='destReadApi')
+def fixture_destReadApi():
+    """ a DBS reader API where the migrated dataset is present """
+    destReadApi = MagicMock()
+    destReadApi.listDatasets.side_effect = lambda dataset, **kwargs: [{'dataset': dataset}]
+    return destReadApi
+
+
+def makeManager(taskname, migrateApi, destReadApi, migLogDir, doomed=()):
+    """ a MigrationManager with a FailedMigrationAccounter which knows the doomed blocks """
+    migrationAccounter = MagicMock()
+    migrationAccounter.checkForDoomedBlocks.side_effect = lambda blocks: [b for b in blocks if b in doomed]
+    return MigrationManager(taskname, migrateApi, destReadApi, str(migLogDir), migrationAccounter,
+                            logger=logging.getLogger(taskname))
+
+
+def test_request_once(migrateApi, destReadApi, tmp_path):
+    sourceApi = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/phys03/DBSReader')
+    blocks = [f"{DATASET}#{i}" for i in range(3)]
+    manager = makeManager('task1', migrateApi, destReadApi, tmp_path)
+    assert manager.request(sourceApi, blocks) == 0
+    assert sorted(manager.inProgress()) == blocks
+    # blocks shared with a second block of the same task
+    assert manager.request(sourceApi, blocks[1:] + [f"{DATASET}#3"]) == 0
+    # another task in the same Publisher cycle
+    other = makeManager('task2', migrateApi, destReadApi, tmp_path)
+    assert other.request(sourceApi, blocks) == 0
+    assert sorted(other.inProgress()) == blocks
+    submitted = [call.args[0]['migration_input'] for call in migrateApi.submitMigration.call_args_list]
+    assert sorted(submitted) == blocks + [f"{DATASET}#3"]
+    with open(tmp_path / 'submittedMigrations.txt', 'r', encoding='utf8') as fd:
+        assert sorted(line.rpartition(',')[0] for line in fd) == blocks + [f"{DATASET}#3"]
+
+
+def test_request_failures(migrateApi, destReadApi, tmp_path):
+    sourceApi = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/global/DBSReader')
+    manager = makeManager('task1', migrateApi, destReadApi, tmp_path, doomed=[f"{DATASET}#doomed"])
+    with pytest.raises(CannotMigrateException):
+        manager.request(sourceApi, [f"{DATASET}#1", f"{DATASET}#doomed"])
+    migrateApi.submitMigration.assert_not_called()
+    migrateApi.submitMigration.side_effect = Exception("Connection refused")
+    assert manager.request(sourceApi, [f"{DATASET}#1"]) == 1
+    assert manager.status([f"{DATASET}#1"]) == 'failed'
+    # not in the registry, can be requested again by the next task
+    assert not os.path.exists(tmp_path / 'submittedMigrations.txt')
+
+
+def test_registry_pruned(migrateApi, destReadApi, tmp_path):
+    now = int(time.time())
+    with open(tmp_path / 'submittedMigrations.txt', 'w', encoding='utf8') as fd:
+        fd.write(f"{DATASET}#old,{now - MigrationManager.RECENT_SUBMISSION_TIME - 10}\n"
+                 f"{DATASET}#recent,{now - 10}\n"
+                 "malformed line\n")
+    manager = makeManager('task1', migrateApi, destReadApi, tmp_path)
+    assert manager.recentlySubmitted() == {f"{DATASET}#recent"}
+    with open(tmp_path / 'submittedMigrations.txt', 'r', encoding='utf8') as fd:
+        assert fd.read() == f"{DATASET}#recent,{now - 10}\n"
+    # the expired one is submitted again
+    sourceApi = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/global/DBSReader')
+    manager.request(sourceApi, [f"{DATASET}#old", f"{DATASET}#recent"])
+    assert [call.args[0]['migration_input'] for call in migrateApi.submitMigration.call_args_list] == \
+        [f"{DATASET}#old"]
+
+
+def test_poll(migrateApi, destReadApi, tmp_path):
+    sourceApi = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/global/DBSReader')
+    blocks = {status: f"{DATASET}#{status}" for status in (1, 2, 4, 9)}
+    blocks['noDataset'] = "/Other/Run2024-v1/MINIAOD#2"
+    manager = makeManager('task1', migrateApi, destReadApi, tmp_path)
+    manager.request(sourceApi, list(blocks.values()))
+    migrateApi.statuses = {blocks[1]: 1, blocks[2]: 2, blocks[4]: 4, blocks[9]: 9, blocks['noDataset']: 2}
+    destReadApi.listDatasets.side_effect = lambda dataset, **kwargs: [{'dataset': dataset}] if dataset == DATASET else []
+    manager.poll()
+    assert manager.migrations == {blocks[1]: 'inProgress', blocks[2]: 'done', blocks[4]: 'done',
+                                  blocks[9]: 'failed', blocks['noDataset']: 'inProgress'}
+    manager.migrationAccounter.addOrUpdateFailedMigration.assert_called_once_with(blocks[9])
+    assert os.path.exists(tmp_path / 'TerminallyFailedLog.txt')
+    assert manager.status([blocks[2], blocks[4]]) == 'done'
+    assert manager.status([blocks[2], blocks[1]]) == 'inProgress'
+    assert manager.status([blocks[1], blocks[9]]) == 'failed'
+    # only the migrations in progress are checked again, and the dataset is looked up once
+    migrateApi.statusMigration.reset_mock()
+    migrateApi.statuses = {blocks[1]: 2, blocks['noDataset']: 2}
+    destReadApi.listDatasets.side_effect = lambda dataset, **kwargs: [{'dataset': dataset}]
+    manager.poll()
+    assert sorted(call.kwargs['block_name'] for call in migrateApi.statusMigration.call_args_list) == \
+        sorted([blocks[1], blocks['noDataset']])
+    assert not manager.inProgress()
+    assert destReadApi.listDatasets.call_count == 3
+    # as in migrateByBlockDBS3, a failed status query fails the migration for this Publisher cycle
+    manager.request(sourceApi, [f"{DATASET}#new"])
+    migrateApi.statusMigration.side_effect = Exception("HTTP 502")
+    manager.poll()
+    assert manager.status([f"{DATASET}#new"]) == 'failed'
+
+
+class FakeDbsApi():
+    """ a DBS instance with the files in blocks, which refuses with HTTP 400 the LFNs containing 'illegal' """
+    instances = {}
+
+    def __init__(self, url, blocks=None, debug=False):  # pylint: disable=unused-argument
+        self.url = url
+        self.blocks = blocks if blocks is not None else self.instances[url].blocks
+        self.error = None
+        self.singleError = None
+        self.bulkQueries = []
+        self.singleQueries = []
+        self.lock = threading.Lock()
+        if blocks is not None:
+            self.instances[url] = self
+
+    def check(self, lfns, error=None):
+        """ raise the errors DBS would """
+        if error:
+            raise HTTPError(self.url, error, 'Internal Server Error', None, '[]')
+        if any('illegal' in lfn for lfn in lfns):
+            raise HTTPError(self.url, 400, 'Bad Request', None, '[]')
+
+    def listFileArray(self, logical_file_name, detail):  # pylint: disable=unused-argument
+        """ as DbsApi.listFileArray """
+        self.bulkQueries.append(list(logical_file_name))
+        self.check(logical_file_name, self.error)
+        return [{'logical_file_name': lfn, 'block_name': self.blocks[lfn]}
+                for lfn in logical_file_name if lfn in self.blocks]
+
+    def listBlocks(self, logical_file_name):
+        """ as DbsApi.listBlocks, called in the parent lookup threads """
+        instance = self.instances[self.url]
+        with instance.lock:
+            instance.singleQueries.append(logical_file_name)
+        self.check([logical_file_name], instance.singleError)
+        return [{'block_name': self.blocks[logical_file_name]}] if logical_file_name in self.blocks else []
+
+
+@pytest.fixture(name='DBSApis')
+def fixture_DBSApis(monkeypatch):
+    """
+    destination, source and global DBS instances with one block each, and an empty cache of the parent lookups
+    the lookups are done in chunks of 3 files
+    """
+    monkeypatch.setattr(FakeDbsApi, 'instances', {})
+    monkeypatch.setattr(PublisherDbsUtils, 'DbsApi', FakeDbsApi)
+    monkeypatch.setattr(PublisherDbsUtils, 'parentBlockCache', {})
+    monkeypatch.setattr(PublisherDbsUtils, 'threadLocalDbsApis', threading.local())
+    monkeypatch.setattr(PublisherDbsUtils, 'MAX_LFNS_PER_DBS_QUERY', 3)
+    files = {where: {f"/store/{where}/{i}.root": f"/{where}/dataset/TIER#1" for i in range(4)}
+             for where in ('destRead', 'source', 'global')}
+    return {'destRead': FakeDbsApi('https://dest/DBSReader', files['destRead']),
+            'source': FakeDbsApi('https://source/DBSReader', files['source']),
+            'global': FakeDbsApi('https://global/DBSReader', files['global'])}
+
+
+def makeFiles(*parents):
+    """ files to publish with these parents, two parents per file """
+    return [{'lfn': f"/store/user/output_{i}.root", 'parents': list(parents[i:i + 2])}
+            for i in range(0, len(parents), 2)]
+
+
+def test_lookupBlocksInBulk(DBSApis):
+    api = DBSApis['source']
+    lfns = [f"/store/source/{i}.root" for i in range(4)] + ['/store/source/illegal file.root', '/store/none.root']
+    found, failed = lookupBlocksInBulk(api, lfns)
+    assert api.bulkQueries == [lfns[:3], lfns[3:]]
+    assert found == {lfn: '/source/dataset/TIER#1' for lfn in lfns[:3]}
+    # the whole chunk with the illegal LFN is retried one by one
+    assert failed == lfns[3:]
+
+
+def test_findParentBlocks_fallback_order(DBSApis):
+    parents = ['/store/destRead/0.root', '/store/source/0.root', '/store/global/0.root', '/store/none.root',
+               '/store/source/1.root', '/store/destRead/1.root']
+    files = makeFiles(*parents)
+    local, globalBlocks = findParentBlocks(files, DBSApis=DBSApis, logger=logging.getLogger('test'))
+    assert local == {'/source/dataset/TIER#1'}
+    assert globalBlocks == {'/global/dataset/TIER#1'}
+    # each instance is only asked for the files not found in the previous ones
+    assert DBSApis['destRead'].bulkQueries == [parents[:3], parents[3:]]
+    assert sorted(lfn for query in DBSApis['source'].bulkQueries for lfn in query) == \
+        sorted(['/store/source/0.root', '/store/global/0.root', '/store/none.root', '/store/source/1.root'])
+    assert [lfn for query in DBSApis['global'].bulkQueries for lfn in query] == \
+        ['/store/global/0.root', '/store/none.root']
+    # files unknown to DBS are removed from the parents
+    assert [file['parents'] for file in files] == [parents[:2], parents[2:3], parents[4:]]
+
+
+def test_findParentBlocks_illegal_lfn(DBSApis):
+    parents = ['/store/source/0.root', '/store/illegal name.root', '/store/destRead/0.root',
+               '/store/global/0.root', '/store/source/1.root']
+    files = makeFiles(*parents)
+    local, globalBlocks = findParentBlocks(files, DBSApis=DBSApis, logger=logging.getLogger('test'))
+    assert local == {'/source/dataset/TIER#1'}
+    assert globalBlocks == {'/global/dataset/TIER#1'}
+    # the first chunk is refused and retried one by one, the illegal LFN is not looked up elsewhere
+    assert DBSApis['destRead'].bulkQueries == [parents[:3], parents[3:]]
+    assert sorted(DBSApis['destRead'].singleQueries) == sorted(parents[:3])
+    assert DBSApis['source'].bulkQueries == [['/store/source/0.root', '/store/global/0.root', '/store/source/1.root']]
+    assert DBSApis['global'].bulkQueries == [['/store/global/0.root']]
+    assert not DBSApis['source'].singleQueries and not DBSApis['global'].singleQueries
+    # the illegal LFN is dropped silently
+    assert [file['parents'] for file in files] == [parents[:1], parents[2:4], parents[4:]]
+    assert PublisherDbsUtils.parentBlockCache[('https://dest/DBSReader', 'https://source/DBSReader',
+                                               '/store/illegal name.root')] == ('invalid', None)
+
+
+@pytest.mark.parametrize("failing, error", [('destRead', 'error'), ('global', 'error'), ('destRead', 'singleError')])
+def test_findParentBlocks_errors(DBSApis, failing, error):
+    # the illegal LFN makes destination DBS refuse the bulk query, its files are then looked up one by one
+    parents = ['/store/destRead/0.root', '/store/none.root', '/store/illegal name.root']
+    setattr(DBSApis[failing], error, 500)
+    with pytest.raises(HTTPError):
+        findParentBlocks(makeFiles(*parents), DBSApis=DBSApis, logger=logging.getLogger('test'))
+    # nothing is cached, the next lookup asks DBS again
+    assert not PublisherDbsUtils.parentBlockCache
+    setattr(DBSApis[failing], error, None)
+    files = makeFiles(*parents)
+    assert findParentBlocks(files, DBSApis=DBSApis, logger=logging.getLogger('test')) == (set(), set())
+    assert [file['parents'] for file in files] == [parents[:1], []]
+
+
+def test_findParentBlocks_cache(DBSApis):
+    parents = ['/store/destRead/0.root', '/store/source/0.root', '/store/global/0.root', '/store/none.root',
+               '/store/illegal name.root']
+    assert findParentBlocks(makeFiles(*parents), DBSApis=DBSApis, logger=logging.getLogger('test')) == \
+        ({'/source/dataset/TIER#1'}, {'/global/dataset/TIER#1'})
+    for api in DBSApis.values():
+        api.bulkQueries.clear()
+        api.singleQueries.clear()
+    files = makeFiles(*parents)
+    assert findParentBlocks(files, DBSApis=DBSApis, logger=logging.getLogger('test')) == \
+        ({'/source/dataset/TIER#1'}, {'/global/dataset/TIER#1'})
+    # files found in destination, unknown or illegal are not looked up again,
+    # files to be migrated are since they will be in destination after the migration
+    assert DBSApis['destRead'].bulkQueries == [['/store/source/0.root', '/store/global/0.root']]
+    assert not any(api.singleQueries for api in DBSApis.values())
+    assert [file['parents'] for file in files] == [parents[:2], parents[2:3], []]
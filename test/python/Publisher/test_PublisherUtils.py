@@ -0,0 +1,45 @@
+"""
+unittest for the pool of slaves of the Publisher in PublisherUtils.runSlavesPool
+"""
+import os
+import logging
+
+import pytest
+
+from Publisher.PublisherUtils import runSlavesPool
+
+
+class FakeMaster():
+    """ a master whose slaves leave a file for each task they complete, and die on some tasks """
+    def __init__(self, doneDir, killers=()):
+        self.doneDir = doneDir
+        self.killers = killers
+
+    def startSlave(self, task):
+        """ same signature as PublisherMaster.startSlave """
+        if task in self.killers:
+            # as if killed by the OOM killer, w/o any cleanup
+            os._exit(1)  # pylint: disable=protected-access
+        if task == 'raises':
+            raise RuntimeError("publication failed")
+        with open(os.path.join(self.doneDir, task), 'w', encoding='utf-8'):
+            pass
+
+
+@pytest.mark.parametrize("maxSlaves", [1, 3])
+def test_runSlavesPool(tmp_path, maxSlaves):
+    tasks = [(f"task{i}", f"task{i}") for i in range(10)] + [('raises', 'raises')]
+    assert not runSlavesPool(master=FakeMaster(str(tmp_path)), tasks=tasks, maxSlaves=maxSlaves,
+                             logger=logging.getLogger('test_PublisherUtils'))
+    assert sorted(os.listdir(tmp_path)) == sorted(f"task{i}" for i in range(10))
+
+
+@pytest.mark.parametrize("maxSlaves", [1, 3])
+def test_runSlavesPool_slave_dies(tmp_path, maxSlaves):
+    tasks = [(f"task{i}", f"task{i}") for i in range(20)]
+    master = FakeMaster(str(tmp_path), killers=('task3', 'task12'))
+    killers = runSlavesPool(master=master, tasks=tasks, maxSlaves=maxSlaves,
+                            logger=logging.getLogger('test_PublisherUtils'))
+    # all other tasks are done in this cycle
+    assert sorted(killers) == ['task12', 'task3']
+    assert sorted(os.listdir(tmp_path)) == sorted(f"task{i}" for i in range(20) if i not in (3, 12))
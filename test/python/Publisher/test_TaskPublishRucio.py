@@ -0,0 +1,153 @@
+"""
+unittest for the publication of blocks whose parents are being migrated in TaskPublishRucio.publishInDBS3,
+with mocked DBS APIs, CRAB REST and clock
+"""
+import os
+import json
+import time
+import logging
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from WMCore.Configuration import ConfigurationEx
+from Publisher import TaskPublishRucio
+
+TASKNAME = '241111_174546:user_crab_parked'
+OUTPUT = '/Primary/user-Output-0123456789abcdef/USER'
+PARENT = '/Primary/Run2024-v1/MINIAOD'
+
+# parent blocks of the files of each block to publish
+PARENTS = {
+    f"{OUTPUT}#noParents": set(),
+    f"{OUTPUT}#migrated": {f"{PARENT}#1", f"{PARENT}#2"},
+    f"{OUTPUT}#sameParents": {f"{PARENT}#2"},
+    f"{OUTPUT}#slowParents": {f"{PARENT}#1", f"{PARENT}#slow"},
+    f"{OUTPUT}#failedParents": {f"{PARENT}#failed"},
+}
+
+
+class FakeClock():
+    """ time.time and time.sleep for TaskPublishRucio, where sleeping only moves the clock forward """
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        """ the fake time """
+        return self.now
+
+    def sleep(self, seconds):
+        """ move the clock forward """
+        self.now += seconds
+
+
+@pytest.fixture(name='dbs')
+def fixture_dbs(tmp_path, monkeypatch):
+    """
+    DBS APIs where the migration of PARENT#1 and PARENT#2 completes after two polls,
+    the one of PARENT#failed fails and the one of PARENT#slow never completes
+    """
+    events = []
+    polls = {'count': 0}
+
+    def statusMigration(block_name):
+        events.append(('status', block_name))
+        status = 1
+        if block_name == f"{PARENT}#failed":
+            status = 9
+        elif block_name != f"{PARENT}#slow" and polls['count'] >= 2:
+            status = 2
+        return [{'migration_status': status, 'migration_request_id': 1, 'retry_count': 0,
+                 'creation_date': int(time.time())}]
+
+    migrateApi = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/phys03/DBSMigrate')
+    migrateApi.statusMigration.side_effect = statusMigration
+    migrateApi.submitMigration.side_effect = lambda data: events.append(('submit', data['migration_input'])) or [{}]
+    destRead = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/phys03/DBSReader')
+    destRead.listBlocks.return_value = []
+    destRead.listFiles.return_value = []
+    destRead.listDatasets.side_effect = lambda dataset, **kwargs: [{'dataset': dataset}]
+    destWrite = MagicMock(url='https://cmsweb.cern.ch/dbs/prod/phys03/DBSWriter')
+    destWrite.insertBulkBlock.side_effect = lambda blockDump: events.append(('insert', blockDump['block_name']))
+    DBSApis = {'source': MagicMock(url='https://cmsweb.cern.ch/dbs/prod/global/DBSReader'),
+               'global': MagicMock(url='https://cmsweb.cern.ch/dbs/prod/global/DBSReader'),
+               'destRead': destRead, 'destWrite': destWrite, 'migrate': migrateApi}
+
+    clock = FakeClock()
+    realPoll = TaskPublishRucio.MigrationManager.poll
+
+    def poll(self):
+        polls['count'] += 1
+        events.append(('poll', polls['count']))
+        realPoll(self)
+
+    log = {'logger': logging.getLogger(TASKNAME), 'logdir': str(tmp_path), 'taskFilesDir': f"{tmp_path}/",
+           'migrationLogDir': str(tmp_path), 'logTaskDir': str(tmp_path)}
+    summary = {}
+    # set by publishInDBS3 for the DBS client
+    monkeypatch.setenv('X509_USER_CERT', 'cert.pem')
+    monkeypatch.setenv('X509_USER_KEY', 'key.pem')
+    monkeypatch.setattr(TaskPublishRucio, 'time', clock)
+    monkeypatch.setattr(TaskPublishRucio.MigrationManager, 'poll', poll)
+    monkeypatch.setattr(TaskPublishRucio, 'setupLogging', lambda *args: log)
+    monkeypatch.setattr(TaskPublishRucio, 'getCrabserver', lambda **kwargs: MagicMock())
+    monkeypatch.setattr(TaskPublishRucio, 'getDBSInputInformation',
+                        lambda taskname, crabServer: (PARENT, DBSApis['source'].url, destWrite.url))
+    monkeypatch.setattr(TaskPublishRucio, 'setupDbsAPIs', lambda **kwargs: DBSApis)
+    monkeypatch.setattr(TaskPublishRucio, 'FailedMigrationAccounter', lambda **kwargs: MagicMock(
+        checkForDoomedBlocks=MagicMock(return_value=[])))
+    monkeypatch.setattr(TaskPublishRucio, 'findParentBlocks',
+                        lambda files, **kwargs: (set(), PARENTS[files[0]['block']]))
+    monkeypatch.setattr(TaskPublishRucio, 'format_file_3', lambda file: {'logical_file_name': file['lfn']})
+    monkeypatch.setattr(TaskPublishRucio, 'prepareDbsPublishingConfigs', lambda **kwargs: dict.fromkeys(
+        ('output_config', 'processing_era_config', 'primds_config', 'dataset_config', 'acquisition_era_config')))
+    monkeypatch.setattr(TaskPublishRucio, 'createBulkBlock', lambda *args: dict(args[5]))
+    monkeypatch.setattr(TaskPublishRucio, 'markGood', MagicMock())
+    monkeypatch.setattr(TaskPublishRucio, 'markFailed', MagicMock())
+    monkeypatch.setattr(TaskPublishRucio, 'saveSummaryJson', lambda s, logdir: summary.update(s) or 'summary.json')
+    return SimpleNamespace(events=events, summary=summary, clock=clock)
+
+
+@pytest.fixture(name='config')
+def fixture_config(tmp_path):
+    """ a Publisher configuration, with the migrations polled every 30 seconds for up to 300 """
+    config = ConfigurationEx()
+    config.section_("General")
+    config.General.logsDir = str(tmp_path)
+    config.General.asoworker = 'schedd'
+    config.section_("REST")
+    config.section_("TaskPublisher")
+    config.TaskPublisher.cert = 'cert.pem'
+    config.TaskPublisher.key = 'key.pem'
+    config.TaskPublisher.dryRun = False
+    config.TaskPublisher.DBShost = 'cmsweb.cern.ch'
+    config.TaskPublisher.migrationPollInterval = 30
+    config.TaskPublisher.migrationMaxWait = 300
+    return config
+
+
+def test_parked_blocks(tmp_path, dbs, config):
+    blocks = [{'block_name': name, 'origin_site': 'T2_CH_CERN',
+               'files': [{'lfn': f"/store/user/{name.split('#')[1]}_{i}.root", 'source_lfn': f"source_{i}",
+                          'block': name} for i in range(2)]}
+              for name in PARENTS]
+    with open(os.path.join(tmp_path, f"{TASKNAME}.json"), 'w', encoding='utf8') as fd:
+        json.dump(blocks, fd)
+    start = dbs.clock.now
+    assert TaskPublishRucio.publishInDBS3(config, TASKNAME, verbose=False, console=False) == 'summary.json'
+
+    inserted = [name for event, name in dbs.events if event == 'insert']
+    # the block w/o parents is published at once, the others wait for the migrations
+    assert inserted == [f"{OUTPUT}#noParents", f"{OUTPUT}#migrated", f"{OUTPUT}#sameParents"]
+    assert dbs.events.index(('insert', f"{OUTPUT}#migrated")) > dbs.events.index(('poll', 2))
+    # each parent block is requested once
+    assert sorted(name for event, name in dbs.events if event == 'submit') == \
+        sorted({block for parents in PARENTS.values() for block in parents})
+    # the slow migration is not waited for more than migrationMaxWait
+    assert dbs.clock.now - start == 300
+    assert dbs.summary['publishedBlocks'] == 3
+    assert dbs.summary['publishedFiles'] == 6
+    assert dbs.summary['result'] == 'FAIL'
+    markFailed = TaskPublishRucio.markFailed
+    assert sorted(call.kwargs['files'] for call in markFailed.call_args_list) == [['source_0', 'source_1']] * 2
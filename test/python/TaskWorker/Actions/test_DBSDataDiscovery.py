@@ -9,6 +9,8 @@ Tape recall policy
 import pytest
 import json
 import os
+import time
+import contextlib
 from unittest.mock import patch, Mock
 from argparse import Namespace
 
@@ -51,3 +53,77 @@ def test_executeTapeRecallPolicy_deny(inputDataset, inputBlocks, totalSizeBytes,
     d = DBSDataDiscovery(config)
     with pytest.raises(TaskWorkerException):
         d.executeTapeRecallPolicy(inputDataset, inputBlocks, totalSizeBytes)
+
+
+@pytest.fixture
+def dataDiscovery_locationsCache(tmp_path, monkeypatch):
+    """ a DBSDataDiscovery with a mocked Rucio client and the locations cache in tmp_path """
+    monkeypatch.setattr('TaskWorker.Actions.DataDiscovery.CRICService', Mock())
+    config = ConfigurationEx()
+    config.section_("TaskWorker")
+    config.TaskWorker.envForCMSWEB = contextlib.nullcontext()
+    config.TaskWorker.scratchDir = str(tmp_path)
+    config.TaskWorker.rucioLocationsCacheTTL = 600
+
+    def listDatasetReplicas(scope, name, deep):
+        if name.endswith('#failing'):
+            raise Exception("Rucio lookup timed out")  # pylint: disable=broad-exception-raised
+        return [{'rse': f"T2_{name.split('#')[1]}_Disk", 'state': 'AVAILABLE', 'bytes': 1000}]
+
+    rucioClient = Mock()
+    rucioClient.list_dataset_replicas.side_effect = listDatasetReplicas
+    return DBSDataDiscovery(config, rucioClient=rucioClient)
+
+
+def lookedUp(rucioClient):
+    """ the blocks looked up in Rucio so far """
+    return sorted(c.kwargs['name'] for c in rucioClient.list_dataset_replicas.call_args_list)
+
+
+def test_lookupBlockReplicas_cache(dataDiscovery_locationsCache):
+    d = dataDiscovery_locationsCache
+    dataset = '/GenericTTbar/Run3-Unittest-dataset/AODSIM'
+    blocks = [f"{dataset}#{b}" for b in ('A', 'B', 'failing')]
+    replicas = d.lookupBlockReplicas('cms', dataset, blocks)
+    # the failed block is left out of the results and of the cache
+    assert replicas == {f"{dataset}#A": [('T2_A_Disk', 'AVAILABLE', 1000)],
+                        f"{dataset}#B": [('T2_B_Disk', 'AVAILABLE', 1000)]}
+    with open(d.locationsCacheFile('cms', dataset), 'r', encoding='utf-8') as fh:
+        assert sorted(json.load(fh)['replicas']) == blocks[:2]
+    assert lookedUp(d.rucioClient) == sorted(blocks)
+    # a second task on the same dataset only looks up the blocks which are not cached
+    d.rucioClient.list_dataset_replicas.reset_mock()
+    replicas = d.lookupBlockReplicas('cms', dataset, blocks + [f"{dataset}#C"])
+    assert lookedUp(d.rucioClient) == [f"{dataset}#C", f"{dataset}#failing"]
+    assert sorted(replicas) == sorted(blocks[:2] + [f"{dataset}#C"])
+    assert replicas[f"{dataset}#A"] == [['T2_A_Disk', 'AVAILABLE', 1000]]
+    d.rucioClient.list_dataset_replicas.reset_mock()
+    assert d.lookupBlockReplicas('cms', dataset, blocks[:1]) == {f"{dataset}#A": [['T2_A_Disk', 'AVAILABLE', 1000]]}
+    d.rucioClient.list_dataset_replicas.assert_not_called()
+    # other datasets and scopes have their own cache
+    d.lookupBlockReplicas('user.someone', dataset, blocks[:1])
+    assert lookedUp(d.rucioClient) == blocks[:1]
+
+
+def test_readLocationsCache_expired(dataDiscovery_locationsCache, monkeypatch):
+    d = dataDiscovery_locationsCache
+    dataset = '/GenericTTbar/Run3-Unittest-dataset/AODSIM'
+    cached = {'time': time.time() - 601, 'scope': 'cms', 'dataset': dataset,
+              'replicas': {f"{dataset}#A": [['T2_old_Disk', 'AVAILABLE', 1000]]}}
+    d.writeLocationsCache('cms', dataset, cached)
+    assert d.readLocationsCache('cms', dataset, 600)['replicas'] == {}
+    assert not os.path.exists(d.locationsCacheFile('cms', dataset))
+    cached['time'] = time.time() - 10
+    d.writeLocationsCache('cms', dataset, cached)
+    assert d.readLocationsCache('cms', dataset, 600)['replicas'] == cached['replicas']
+    assert d.lookupBlockReplicas('cms', dataset, [f"{dataset}#A"]) == cached['replicas']
+    # a cache file which can not be read is a cache miss
+    with open(d.locationsCacheFile('cms', dataset), 'w', encoding='utf-8') as fh:
+        fh.write('{"time": ')
+    assert d.readLocationsCache('cms', dataset, 600)['replicas'] == {}
+    assert d.lookupBlockReplicas('cms', dataset, [f"{dataset}#A"]) == {f"{dataset}#A": [('T2_A_Disk', 'AVAILABLE', 1000)]}
+    # no cache if the TTL is 0
+    monkeypatch.setattr(d.config.TaskWorker, 'rucioLocationsCacheTTL', 0)
+    d.rucioClient.list_dataset_replicas.reset_mock()
+    d.lookupBlockReplicas('cms', dataset, [f"{dataset}#A"])
+    assert lookedUp(d.rucioClient) == [f"{dataset}#A"]
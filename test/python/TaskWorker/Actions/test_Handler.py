@@ -0,0 +1,130 @@
+"""
+unittest for the action graph of TaskHandler, with mock actions which sleep and record when they run
+"""
+import time
+from unittest.mock import Mock
+
+import pytest
+
+from WMCore.Configuration import ConfigurationEx
+from TaskWorker.Actions.Handler import TaskHandler
+from TaskWorker.DataObjects.Result import Result
+from TaskWorker.WorkerExceptions import WorkerHandlerException, TaskWorkerException
+
+
+class MockAction():
+    """ an action which takes duration seconds, records when it ran and what it got in input """
+
+    def __init__(self, name, duration, events, fail=False):
+        self.name = name
+        self.duration = duration
+        self.events = events
+        self.fail = fail
+        self.input = None
+
+    def __str__(self):
+        return self.name
+
+    def execute(self, *args, **kwargs):
+        self.input = args[0]
+        self.events.append(('start', self.name, time.time()))
+        time.sleep(self.duration)
+        self.events.append(('end', self.name, time.time()))
+        if self.fail:
+            raise TaskWorkerException(f"{self.name} failed")
+        return Result(task=kwargs['task'], result=f"{self.name} output")
+
+
+class MockDiscovery(MockAction):
+    """ a data discovery which finds data on tape half way, and requests the recall if beforeTapeRecall allows it """
+
+    def __init__(self, name, duration, events, beforeTapeRecall):
+        super().__init__(name, duration, events)
+        self.beforeTapeRecall = beforeTapeRecall
+
+    def execute(self, *args, **kwargs):
+        self.input = args[0]
+        self.events.append(('start', self.name, time.time()))
+        time.sleep(self.duration / 2)
+        if not self.beforeTapeRecall():
+            self.events.append(('end', self.name, time.time()))
+            raise TaskWorkerException("Tape recall not requested")
+        self.events.append(('recall', self.name, time.time()))
+        time.sleep(self.duration / 2)
+        self.events.append(('end', self.name, time.time()))
+        return Result(task=kwargs['task'], result=f"{self.name} output")
+
+
+@pytest.fixture
+def handler(tmp_path):
+    config = ConfigurationEx()
+    config.section_("TaskWorker")
+    config.TaskWorker.logsDir = str(tmp_path)
+    config.TaskWorker.SEC_TOKEN_DIRECTORY = str(tmp_path)
+    task = {'tm_taskname': 'test_task', 'tm_username': 'someone'}
+    return TaskHandler(task, 1, Mock(), config, 'test')
+
+
+def times(events, kind):
+    """ {action name: time} of the start or end events """
+    return {name: t for k, name, t in events if k == kind}
+
+
+def newTaskActions(handler, events, failStageout=False):
+    """ mock of the actions of handleNewTask, with the same dependencies """
+    proxy = MockAction('MyProxyLogon', 0.1, events)
+    sites = MockAction('SiteInfoResolver', 0.1, events)
+    stageout = MockAction('StageoutCheck', 0.5, events, fail=failStageout)
+    discovery = MockDiscovery('DBSDataDiscovery', 0.5, events, lambda: handler.waitForActions([stageout]))
+    splitter = MockAction('Splitter', 0.1, events)
+    return [(proxy, None), (sites, None), (stageout, None), (discovery, [sites]), (splitter, [discovery, stageout])]
+
+
+def test_chain(handler):
+    events = []
+    actions = [MockAction(name, 0.01, events) for name in ('first', 'second', 'third')]
+    for action in actions:
+        handler.addWork(action)
+    output = handler.actionWork('args')
+    assert [name for kind, name, _ in events if kind == 'start'] == ['first', 'second', 'third']
+    assert actions[0].input == ('args',)
+    assert actions[1].input == 'first output'
+    assert actions[2].input == 'second output'
+    assert output.result == 'third output'
+    with pytest.raises(ValueError):
+        handler.addWork(MockAction('fourth', 0, events), dependsOn=[MockAction('notAdded', 0, events)])
+
+
+def test_parallel_actions(handler):
+    events = []
+    actions = newTaskActions(handler, events)
+    for action, dependsOn in actions:
+        handler.addWork(action, dependsOn=dependsOn)
+    output = handler.actionWork()
+
+    starts, ends = times(events, 'start'), times(events, 'end')
+    # stageout check and data discovery overlap, and both start after the site info
+    assert starts['StageoutCheck'] < ends['DBSDataDiscovery'] and starts['DBSDataDiscovery'] < ends['StageoutCheck']
+    assert min(starts['StageoutCheck'], starts['DBSDataDiscovery']) >= ends['SiteInfoResolver']
+    assert starts['Splitter'] >= max(ends['StageoutCheck'], ends['DBSDataDiscovery'])
+    # the tape recall is requested only once the stageout check succeeded
+    assert times(events, 'recall')['DBSDataDiscovery'] >= ends['StageoutCheck']
+    # splitter gets the output of the data discovery
+    assert actions[-1][0].input == 'DBSDataDiscovery output'
+    assert output.result == 'Splitter output'
+
+
+def test_failure_propagation(handler):
+    events = []
+    actions = newTaskActions(handler, events, failStageout=True)
+    for action, dependsOn in actions:
+        handler.addWork(action, dependsOn=dependsOn)
+    with pytest.raises(WorkerHandlerException, match='StageoutCheck failed'):
+        handler.actionWork()
+    starts, ends = times(events, 'start'), times(events, 'end')
+    # the data discovery running at the same time completes w/o requesting the tape recall,
+    # nothing after them starts
+    assert 'DBSDataDiscovery' in ends
+    assert not times(events, 'recall')
+    assert 'Splitter' not in starts
+    assert handler.waitForActions([actions[0][0]]) and not handler.waitForActions([actions[-1][0]])
@@ -0,0 +1,100 @@
+"""
+unittest for the lumis of the completion jobs computed by PreDAG.adjustLumisForCompletion,
+run in a synthetic spool directory
+"""
+import io
+import os
+import json
+import random
+import logging
+import tarfile
+
+import pytest
+
+from WMCore.DataStructs.LumiList import LumiList
+
+from IndexedArchive import appendToArchive, JOB_INPUTS_ARCHIVE
+from TaskWorker.Actions.PreDAG import PreDAG
+
+NJOBS = 200
+NFAILED = 20
+NMISSING = 20
+
+
+def makeJobLumis(rng, nRuns=5):
+    """ a compact list like the job_lumis_<id>.json written by DagmanCreator """
+    compactList = {}
+    for run in rng.sample(range(1, 50), nRuns):
+        first = rng.randint(1, 2000)
+        pairs = []
+        for _ in range(rng.randint(1, 4)):
+            last = first + rng.randint(0, 20)
+            pairs.append([first, last])
+            first = last + rng.randint(1, 5)
+        compactList[str(run)] = pairs
+    return compactList
+
+
+def makeSpool(rng, legacy):
+    """
+    in the current directory, the job lumis of NJOBS jobs (in the indexed archive, or in
+    run_and_lumis.tar.gz for tasks submitted before it) and the missing lumis reported by
+    the PostJob of NMISSING jobs. Returns {jobId: compact list} of both
+    """
+    jobLumis = {str(jobId): makeJobLumis(rng) for jobId in range(1, NJOBS + 1)}
+    members = [(f"job_lumis_{jobId}.json", json.dumps(lumis)) for jobId, lumis in jobLumis.items()]
+    if legacy:
+        with tarfile.open('run_and_lumis.tar.gz', 'w:gz') as tf:
+            for name, content in members:
+                data = content.encode('utf-8')
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+    else:
+        appendToArchive(JOB_INPUTS_ARCHIVE, members)
+    missingDir = 'automatic_splitting/missing_lumis/'
+    os.makedirs(missingDir)
+    missingLumis = {}
+    for jobId in rng.sample(sorted(jobLumis), NMISSING):
+        missingLumis[jobId] = makeJobLumis(rng, nRuns=2)
+        with open(os.path.join(missingDir, jobId), 'w', encoding='utf-8') as fd:
+            fd.write(str(missingLumis[jobId]))
+    return jobLumis, missingLumis
+
+
+def makePreDAG(failedJobs):
+    """ a PreDAG w/o the logging setup of the constructor """
+    preDAG = PreDAG.__new__(PreDAG)
+    preDAG.failedJobs = failedJobs
+    preDAG.logger = logging.getLogger('test_PreDAG')
+    return preDAG
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_adjustLumisForCompletion(tmp_path, monkeypatch, legacy):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(12345)
+    jobLumis, missingLumis = makeSpool(rng, legacy)
+    failed = rng.sample(sorted(jobLumis), NFAILED)
+    # a failed job and a job with missing lumis which are not in this completion stage are ignored
+    unprocessed = set(failed[1:]) | set(list(missingLumis)[1:])
+    task = {'tm_split_args': {}}
+
+    assert makePreDAG(failed).adjustLumisForCompletion(task, unprocessed)
+
+    expected = LumiList()
+    for jobId in failed[1:]:
+        expected = expected + LumiList(compactList=jobLumis[jobId])
+    for jobId in list(missingLumis)[1:]:
+        expected = expected + LumiList(compactList=missingLumis[jobId])
+    runs = expected.getRuns()
+    assert task['tm_split_args']['runs'] == runs
+    compactList = expected.getCompactList()
+    assert task['tm_split_args']['lumis'] == [",".join(str(l) for pair in compactList[run] for l in pair) for run in runs]
+
+
+def test_adjustLumisForCompletion_nothing_to_do(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    task = {'tm_split_args': {}}
+    assert not makePreDAG(['1']).adjustLumisForCompletion(task, {'2'})
+    assert task['tm_split_args'] == {}
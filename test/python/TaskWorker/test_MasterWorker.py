@@ -0,0 +1,160 @@
+"""
+unittest for the main loop of MasterWorker, run against a fake REST server
+and fake slaves which complete each work after a fixed time
+"""
+import time
+import queue
+import threading
+from urllib.parse import parse_qs
+
+import pytest
+from unittest.mock import Mock
+
+from WMCore.Configuration import ConfigurationEx
+from TaskWorker.MasterWorker import MasterWorker
+from TaskWorker.Worker import Worker
+
+
+class FakeCRABRest():
+    """ the workflowdb API of the REST, on a dictionary of tasks. Counts the requests """
+
+    def __init__(self, ntasks, status='HOLDING', rejectBulk=False):
+        self.tasks = {f"task{i}": {'tm_taskname': f"task{i}", 'tm_task_command': 'SUBMIT', 'tm_username': 'someone',
+                                   'tw_name': 'testTW', 'tm_task_status': status} for i in range(ntasks)}
+        self.rejectBulk = rejectBulk
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def get(self, api, data):
+        with self.lock:
+            self.requests.append(('GET', api, None))
+            tasks = [dict(task) for task in self.tasks.values() if task['tm_task_status'] == data['getstatus']]
+            return ({'result': tasks[:data['limit']]}, 200, '')
+
+    def post(self, api, data):
+        params = parse_qs(data)
+        subresource = params['subresource'][0]
+        with self.lock:
+            self.requests.append(('POST', api, subresource))
+            if subresource == 'bulkstate':
+                if self.rejectBulk:
+                    raise RuntimeError("bulkstate not known")
+                works = zip(params['workflows'], params['commands'], params['statuses'])
+            else:
+                works = [(params['workflow'][0], params['command'][0], params['status'][0])]
+            for taskname, command, status in works:
+                self.tasks[taskname].update({'tm_task_command': command, 'tm_task_status': status})
+        return ({'result': []}, 200, '')
+
+    def count(self, method, subresource=None):
+        """ number of requests of a kind """
+        return len([r for r in self.requests if r[0] == method and (subresource is None or r[2] == subresource)])
+
+
+class FakeSlaves(Worker):
+    """ Worker with nslots slaves which complete each work after duration seconds """
+
+    def __init__(self, nslots, duration, ntasks, master, waitOnResults=True):  # pylint: disable=super-init-not-called
+        self.logger = Mock()
+        self.working = {}
+        self.results = queue.Queue()
+        self.pool = [None] * nslots
+        self.leninqueue = nslots
+        self.nworkers = nslots
+        self.duration = duration
+        self.ntasks = ntasks
+        self.master = master
+        self.waitOnResults = waitOnResults
+        self.injected = {}
+        self.finished = {}
+        self.fullWaits = 0
+
+    def injectWorks(self, works):
+        for _, task, _, _ in works:
+            workid = 0 if len(self.working.keys()) == 0 else max(self.working.keys()) + 1
+            self.working[workid] = {'workflow': task['tm_taskname'], 'injected': time.time()}
+            self.injected[task['tm_taskname']] = time.time()
+            threading.Timer(self.duration, self.complete, (workid, task['tm_taskname'])).start()
+
+    def complete(self, workid, taskname):
+        """ called by the slave when it is done """
+        self.finished[taskname] = time.time()
+        with self.master.crabserver.lock:
+            self.master.crabserver.tasks[taskname]['tm_task_status'] = 'SUBMITTED'
+        if len(self.finished) == self.ntasks:
+            self.master.STOP = True
+        self.results.put({'workid': workid, 'out': None})
+
+    def checkFinished(self, timeout=0):
+        busy = timeout and len(self.working) > 0
+        if not self.waitOnResults:
+            # what the master loop did before: sleep polling seconds, then look at the results
+            time.sleep(timeout)
+            timeout = 0
+        results = super().checkFinished(timeout=timeout)
+        if busy and (not self.waitOnResults or not results):
+            # the master waited for the whole polling time, even if a slave completed meanwhile
+            self.fullWaits += 1
+        return results
+
+
+def makeMaster(crabserver, nslots, duration, polling, waitOnResults=True):
+    """ a MasterWorker talking to crabserver, w/o the logs and the real slaves """
+    config = ConfigurationEx()
+    config.section_("TaskWorker")
+    config.TaskWorker.name = 'testTW'
+    config.TaskWorker.is_canary = True
+    config.TaskWorker.polling = polling
+    master = MasterWorker.__new__(MasterWorker)
+    master.STOP = False
+    master.config = config
+    master.logger = Mock()
+    master.crabserver = crabserver
+    master.recurringActions = []
+    master.slaves = FakeSlaves(nslots, duration, len(crabserver.tasks), master, waitOnResults)
+    return master
+
+
+def runMaster(master, timeout=30):
+    """ run the main loop until all tasks are done """
+    thread = threading.Thread(target=master.algorithm, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "master did not process all tasks"
+
+
+def test_bulk_queue():
+    crabserver = FakeCRABRest(20)
+    master = makeMaster(crabserver, nslots=20, duration=0.01, polling=0.5)
+    runMaster(master)
+    assert all(task['tm_task_status'] == 'SUBMITTED' for task in crabserver.tasks.values())
+    # all tasks moved to QUEUED with a single request
+    assert crabserver.count('POST', 'bulkstate') == 1
+    assert crabserver.count('POST', 'state') == 0
+
+
+def test_bulk_queue_fallback():
+    crabserver = FakeCRABRest(5, rejectBulk=True)
+    master = makeMaster(crabserver, nslots=5, duration=0.01, polling=0.5)
+    runMaster(master)
+    assert all(task['tm_task_status'] == 'SUBMITTED' for task in crabserver.tasks.values())
+    assert crabserver.count('POST', 'state') == 5
+
+
+@pytest.mark.parametrize("waitOnResults", [False, True])
+def test_pickup(waitOnResults):
+    # 3 rounds of tasks through 2 slaves, each work takes much less than the polling time
+    crabserver = FakeCRABRest(6)
+    master = makeMaster(crabserver, nslots=2, duration=0.05, polling=1, waitOnResults=waitOnResults)
+    runMaster(master)
+    assert all(task['tm_task_status'] == 'SUBMITTED' for task in crabserver.tasks.values())
+    # each task waiting for a free slot is injected after a slave completed
+    ends = sorted(master.slaves.finished.values())
+    starts = sorted(master.slaves.injected.values())[2:]
+    assert all(start >= end for start, end in zip(starts, ends))
+    if waitOnResults:
+        # the master never waits for the polling time while the slaves are busy
+        assert master.slaves.fullWaits == 0
+    else:
+        # at least once per round of tasks
+        assert master.slaves.fullWaits >= 3
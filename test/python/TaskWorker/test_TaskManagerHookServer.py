@@ -0,0 +1,175 @@
+"""
+unittest for TaskWorker.TaskManagerHookServer and scripts/dagman/dag_hook_client.py,
+with a fake bootstrap module in place of TaskManagerBootstrap
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import logging
+import subprocess
+
+import pytest
+
+from TaskWorker import TaskManagerHookServer
+from TaskWorker.TaskManagerHookServer import HookServer, SOCKET_NAME
+
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../scripts/dagman/dag_hook_client.py')
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(TaskManagerHookServer.__file__)))
+
+FAKE_BOOTSTRAP = '''
+import os
+import sys
+import time
+import signal
+
+
+def terminated(signum, frame):
+    with open('terminated', 'w', encoding='utf-8') as fd:
+        fd.write(str(signum))
+    os._exit(128 + signum)
+
+
+def bootstrap():
+    action = sys.argv[1]
+    print(f"running {action} in {os.getcwd()} with HOOK_TEST={os.environ.get('HOOK_TEST')}")
+    if action == 'return':
+        return int(sys.argv[2])
+    if action == 'exit':
+        sys.exit(int(sys.argv[2]))
+    if action == 'exitmsg':
+        sys.exit("exit with a message")
+    if action == 'raise':
+        raise RuntimeError("fatal error in the hook")
+    if action == 'sleep':
+        signal.signal(signal.SIGTERM, terminated)
+        with open('child.pid', 'w', encoding='utf-8') as fd:
+            fd.write(str(os.getpid()))
+        time.sleep(60)
+    return 0
+'''
+
+
+def waitFor(condition, timeout=20):
+    """ wait until condition() is True """
+    for _ in range(timeout * 10):
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def processGone(pid):
+    """ True if there is no process with this pid """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    return False
+
+
+@pytest.fixture(name='spool')
+def fixture_spool(tmp_path):
+    """ a spool directory with the fake bootstrap module """
+    (tmp_path / 'fakebootstrap.py').write_text(FAKE_BOOTSTRAP, encoding='utf-8')
+    return tmp_path
+
+
+@pytest.fixture(name='server')
+def fixture_server(spool):
+    """ the hook server running in the spool directory """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(spool), SRC_DIR]))
+    with open(spool / 'dag_hook_server.out', 'w', encoding='utf-8') as out:
+        proc = subprocess.Popen([sys.executable, '-m', 'TaskWorker.TaskManagerHookServer',
+                                 '--bootstrap-module', 'fakebootstrap', '--dagman-pid', str(os.getpid())],
+                                cwd=spool, env=env, stdout=out, stderr=subprocess.STDOUT)
+    assert waitFor(lambda: (spool / SOCKET_NAME).exists())
+    yield proc
+    proc.kill()
+    proc.wait()
+
+
+def runClient(spool, *args):
+    """ run dag_hook_client.py as dag_bootstrap.sh does, returns the CompletedProcess """
+    env = dict(os.environ, HOOK_TEST='from the client')
+    return subprocess.run([sys.executable, '-I', '-S', CLIENT] + list(args), cwd=spool, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8',
+                          timeout=60, check=False)
+
+
+@pytest.mark.parametrize("args, exitCode", [
+    (['return', '0'], 0),
+    (['return', '3'], 3),
+    (['exit', '5'], 5),
+    (['exit', '0'], 0),
+    (['exitmsg'], 1),
+    (['raise'], 1),
+])
+def test_exit_code(server, spool, args, exitCode):  # pylint: disable=unused-argument
+    result = runClient(spool, *args)
+    assert result.returncode == exitCode
+    # the child runs with the stdout, working directory and environment of the client
+    assert f"running {args[0]} in {spool} with HOOK_TEST=from the client" in result.stdout
+    if args[0] == 'exitmsg':
+        assert "exit with a message" in result.stderr
+    if args[0] == 'raise':
+        assert "fatal error in the hook" in result.stderr
+
+
+def test_child_stopped_when_client_gone(server, spool):  # pylint: disable=unused-argument
+    client = subprocess.Popen([sys.executable, '-I', '-S', CLIENT, 'sleep'], cwd=spool,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    assert waitFor(lambda: (spool / 'child.pid').exists() and (spool / 'child.pid').read_text())
+    childPid = int((spool / 'child.pid').read_text())
+    # as when condor_rm kills the DAG
+    client.kill()
+    client.wait()
+    assert waitFor(lambda: processGone(childPid))
+    assert (spool / 'terminated').read_text() == str(int(signal.SIGTERM))
+
+
+def test_client_fallback(spool, monkeypatch):
+    monkeypatch.chdir(spool)
+    monkeypatch.syspath_prepend(os.path.dirname(CLIENT))
+    import dag_hook_client  # pylint: disable=import-outside-toplevel,import-error
+
+    class Fallback(Exception):
+        """ raised in place of exec'ing TaskManagerBootstrap """
+
+    def fallback(args):
+        raise Fallback(args)
+
+    monkeypatch.setattr(dag_hook_client, 'fallback', fallback)
+    # no server
+    with pytest.raises(Fallback) as ex:
+        dag_hook_client.main(['PREJOB', '1'])
+    assert ex.value.args[0] == ['PREJOB', '1']
+    # the socket of a server which is gone
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(SOCKET_NAME)
+    stale.close()
+    with pytest.raises(Fallback):
+        dag_hook_client.main(['PREJOB', '1'])
+
+
+def test_server_exits_when_dagman_gone(spool, monkeypatch):
+    monkeypatch.chdir(spool)
+    monkeypatch.syspath_prepend(str(spool))
+    monkeypatch.setattr(TaskManagerHookServer, 'DAGMAN_CHECK_INTERVAL', 0)
+    dagman = subprocess.Popen(['true'])
+    dagman.wait()
+    oldHandlers = {sig: signal.getsignal(sig) for sig in TaskManagerHookServer.CHILD_SIGNALS + (signal.SIGCHLD,)}
+    server = HookServer('fakebootstrap', SOCKET_NAME, dagman.pid, logging.getLogger('test_TaskManagerHookServer'))
+    try:
+        server.start()
+        assert os.path.exists(SOCKET_NAME)
+        # returns since DAGMan is gone
+        server.serve()
+    finally:
+        signal.set_wakeup_fd(-1)
+        for sig, handler in oldHandlers.items():
+            signal.signal(sig, handler)
+        for fd in server.wakeupPipe or ():
+            os.close(fd)
+    assert not os.path.exists(SOCKET_NAME)
@@ -0,0 +1,134 @@
+"""
+unittest for the reuse of the CRAB REST and Rucio clients in TaskWorker.WorkerUtilities.ClientRegistry,
+with mocked clients
+"""
+import os
+import time
+import logging
+from unittest.mock import MagicMock
+
+import pytest
+
+from WMCore.Configuration import ConfigurationEx
+from TaskWorker import WorkerUtilities
+from TaskWorker.WorkerUtilities import ClientRegistry
+
+
+@pytest.fixture(name='config')
+def fixture_config(tmp_path):
+    """ a TaskWorker configuration with certificate and key in tmp_path """
+    for name in ('cert.pem', 'key.pem'):
+        (tmp_path / name).write_text(name, encoding='utf-8')
+    config = ConfigurationEx()
+    config.section_("TaskWorker")
+    config.TaskWorker.cmscert = str(tmp_path / 'cert.pem')
+    config.TaskWorker.cmskey = str(tmp_path / 'key.pem')
+    config.section_("Services")
+    config.Services.Rucio_account = 'crab_server'
+    config.Services.Rucio_cert = str(tmp_path / 'cert.pem')
+    config.Services.Rucio_key = str(tmp_path / 'key.pem')
+    return config
+
+
+@pytest.fixture(name='clients')
+def fixture_clients(monkeypatch):
+    """ the accounts of the Rucio clients created, and the CRABRest objects created """
+    created = {'rucio': [], 'crabserver': []}
+
+    def getNativeRucioClient(config, logger):  # pylint: disable=unused-argument
+        created['rucio'].append(config.Services.Rucio_account)
+        return MagicMock(name=f"rucio-{config.Services.Rucio_account}")
+
+    def crabRest(*args, **kwargs):  # pylint: disable=unused-argument
+        crabserver = MagicMock(name='crabserver')
+        created['crabserver'].append(crabserver)
+        return crabserver
+
+    monkeypatch.setattr(WorkerUtilities, 'getNativeRucioClient', getNativeRucioClient)
+    monkeypatch.setattr(WorkerUtilities, 'CRABRest', crabRest)
+    return created
+
+
+def getCrabserver(registry, config, resthost='cmsweb-test.cern.ch'):
+    """ the CRABRest object for resthost and the dev db """
+    return registry.getCrabserver(resthost, 'dev', config, logging.getLogger('test_WorkerUtilities'))
+
+
+def test_reuse(config, clients):
+    registry = ClientRegistry()
+    crabserver = getCrabserver(registry, config)
+    assert getCrabserver(registry, config) is crabserver
+    assert getCrabserver(registry, config, resthost='cmsweb.cern.ch') is not crabserver
+    assert len(clients['crabserver']) == 2
+    crabserver.setDbInstance.assert_called_once_with('dev')
+
+
+def test_refresh_on_new_credentials(config, clients):
+    registry = ClientRegistry()
+    crabserver = getCrabserver(registry, config)
+    # a renewed certificate
+    stat = os.stat(config.TaskWorker.cmscert)
+    os.utime(config.TaskWorker.cmscert, (stat.st_atime, stat.st_mtime + 10))
+    newCrabserver = getCrabserver(registry, config)
+    assert newCrabserver is not crabserver
+    assert getCrabserver(registry, config) is newCrabserver
+    # the key
+    os.utime(config.TaskWorker.cmskey, (stat.st_atime, stat.st_mtime + 20))
+    assert getCrabserver(registry, config) is not newCrabserver
+    assert len(clients['crabserver']) == 3
+
+
+def test_refresh_after_maxAge(config, clients, monkeypatch):
+    registry = ClientRegistry(maxAge=3600)
+    rucio = registry.getRucioClient(config, logging.getLogger('test_WorkerUtilities'))
+    now = time.time()
+    monkeypatch.setattr(WorkerUtilities.time, 'time', lambda: now + 1800)
+    assert registry.getRucioClient(config, logging.getLogger('test_WorkerUtilities')) is rucio
+    monkeypatch.setattr(WorkerUtilities.time, 'time', lambda: now + 3601)
+    assert registry.getRucioClient(config, logging.getLogger('test_WorkerUtilities')) is not rucio
+    assert clients['rucio'] == ['crab_server', 'crab_server']
+
+
+def test_crab_input_account(config, clients):
+    registry = ClientRegistry()
+    logger = logging.getLogger('test_WorkerUtilities')
+    rucio = registry.getRucioClient(config, logger)
+    privileged = registry.getRucioClient(config, logger, account='crab_input')
+    assert privileged is not rucio
+    assert registry.getRucioClient(config, logger, account='crab_input') is privileged
+    assert registry.getRucioClient(config, logger, account='crab_server') is rucio
+    assert clients['rucio'] == ['crab_server', 'crab_input']
+    # the configuration of the slave is not changed
+    assert config.Services.Rucio_account == 'crab_server'
+
+
+def test_session_closed_after_fork(config, clients):  # pylint: disable=unused-argument
+    registry = ClientRegistry()
+    crabserver = getCrabserver(registry, config)
+    rucio = registry.getRucioClient(config, logging.getLogger('test_WorkerUtilities'))
+    pid = os.fork()
+    if pid == 0:
+        # a child worker: same clients, but w/o the connections of the parent
+        exitCode = 1
+        try:
+            if getCrabserver(registry, config) is crabserver and crabserver.session.close.call_count == 1 and \
+                    registry.getRucioClient(config, logging.getLogger('test_WorkerUtilities')) is rucio and \
+                    rucio.session.close.call_count == 1 and \
+                    getCrabserver(registry, config) is crabserver and crabserver.session.close.call_count == 1:
+                exitCode = 0
+        finally:
+            os._exit(exitCode)  # pylint: disable=protected-access
+    _, status = os.waitpid(pid, 0)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    # the parent keeps its connections
+    assert getCrabserver(registry, config) is crabserver
+    crabserver.session.close.assert_not_called()
+    rucio.session.close.assert_not_called()
+
+
+def test_getClientRegistry(config, monkeypatch):
+    monkeypatch.setattr(WorkerUtilities, 'CLIENT_REGISTRY', None)
+    config.TaskWorker.clientsMaxAge = 60
+    registry = WorkerUtilities.getClientRegistry(config)
+    assert registry.maxAge == 60
+    assert WorkerUtilities.getClientRegistry(config) is registry
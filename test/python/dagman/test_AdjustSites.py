@@ -0,0 +1,208 @@
+"""
+unittest for the in place adjustment of the POST script exit codes in the DAG .nodes.log file
+done by AdjustSites.adjustPostScriptExitStatus, run on synthetic files
+"""
+import os
+import re
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../scripts/dagman'))
+from AdjustSites import indexPostScriptEvents, saveIndex, adjustPostScriptExitStatus  # pylint: disable=wrong-import-position
+
+
+def makeEvent(node, retvalue, newDateFormat, eventType='016'):
+    """ the lines of an event in the DAG .nodes.log file, with the date in one of the two formats used by HTCondor """
+    date = "2024-11-11 17:45:46" if newDateFormat else "11/11 17:45:46"
+    if eventType == '016':
+        return (f"016 (146493.000.000) {date} POST Script terminated.\n"
+                f"        (1) Normal termination (return value {retvalue})\n"
+                f"    DAG Node: Job{node}\n"
+                "...\n")
+    return (f"000 (146493.000.000) {date} Job submitted from host: <127.0.0.1:9618>\n"
+            f"    DAG Node: Job{node}\n"
+            "...\n")
+
+
+def makeNodesLog(rng, nNodes=50):
+    """ a .nodes.log with submit and POST script events, the latter with random return values """
+    content = ""
+    for node in range(1, nNodes + 1):
+        newDateFormat = bool(node % 2)
+        content += makeEvent(node, None, newDateFormat, eventType='000')
+        content += makeEvent(node, rng.choice('002'), newDateFormat)
+        if node % 10 == 0:
+            # a retry, and a node of an automatic splitting subdag
+            content += makeEvent(node, rng.choice('02'), newDateFormat)
+            content += makeEvent(f"{node}-1", rng.choice('02'), newDateFormat)
+    return content
+
+
+def oldAdjustPostScriptExitStatus(resubmitJobIds, filename):
+    """ how AdjustSites.adjustPostScriptExitStatus used to rewrite the whole file """
+    if not resubmitJobIds:
+        return []
+    resubmitAllFailed = (resubmitJobIds is True)
+    terminator_re = re.compile(r"^\.\.\.$")
+    event1_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+/\d+ \d+:\d+:\d+ POST Script terminated.")
+    event2_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+-\d+-\d+ \d+:\d+:\d+ POST Script terminated.")
+    if resubmitAllFailed:
+        retvalue_re = re.compile(r"Normal termination \(return value 2\)")
+    else:
+        retvalue_re = re.compile(r"Normal termination \(return value [0|2]\)")
+    node_re = re.compile(r"DAG Node: Job(\d+(-\d+)?)")
+    ra_buffer = []
+    alt = None
+    output = ''
+    adjustedJobIds = []
+    with open(filename, 'r', encoding='utf-8') as fd:
+        lines = fd.readlines()
+    for line in lines:
+        if len(ra_buffer) == 0:
+            if terminator_re.search(line):
+                ra_buffer.append(line)
+            else:
+                output += line
+        elif len(ra_buffer) == 1:
+            if event1_re.search(line) or event2_re.search(line):
+                ra_buffer.append(line)
+            else:
+                output += ''.join(ra_buffer) + line
+                ra_buffer = []
+        elif len(ra_buffer) == 2:
+            if retvalue_re.search(line):
+                ra_buffer.append("        (1) Normal termination (return value 1)\n")
+                alt = line
+            else:
+                output += ''.join(ra_buffer) + line
+                ra_buffer = []
+        elif len(ra_buffer) == 3:
+            m = node_re.search(line)
+            if m and (resubmitAllFailed or (m.groups()[0] in resubmitJobIds)):
+                adjustedJobIds.append(m.groups()[0])
+                output += ''.join(ra_buffer)
+            else:
+                output += ''.join(ra_buffer[:-1]) + alt
+            output += line
+            ra_buffer = []
+    output += ''.join(ra_buffer)
+    with open(filename, "w", encoding='utf-8') as fd:
+        fd.write(output)
+    return adjustedJobIds
+
+
+def readBytes(path):
+    """ content of a file """
+    with open(path, 'rb') as fd:
+        return fd.read()
+
+
+def writeFile(path, content, mode='w'):
+    """ write or append to a file """
+    with open(path, mode, encoding='utf-8') as fd:
+        fd.write(content)
+
+
+@pytest.fixture
+def nodesLogs(tmp_path):
+    """ two copies of the same synthetic .nodes.log, for the new and the old code """
+    content = "...\n" + makeNodesLog(random.Random(12345))
+    new, old = str(tmp_path / 'RunJobs.dag.nodes.log'), str(tmp_path / 'old.nodes.log')
+    writeFile(new, content)
+    writeFile(old, content)
+    return new, old
+
+
+def test_both_date_formats(tmp_path):
+    nodesLog = str(tmp_path / 'RunJobs.dag.nodes.log')
+    writeFile(nodesLog, "...\n" + makeEvent(1, 2, False) + makeEvent(2, 2, True) + makeEvent(3, 0, True))
+    index = indexPostScriptEvents(nodesLog)
+    assert sorted(index['events']) == ['1', '2', '3']
+    # a final terminator may be the beginning of the next event
+    assert index['scanned'] == os.path.getsize(nodesLog) - len("...\n")
+    assert adjustPostScriptExitStatus(True, nodesLog) == ['1', '2']
+    assert readBytes(nodesLog).count(b"(return value 1)") == 2
+
+
+def test_resubmit_all_failed_or_list(nodesLogs):
+    nodesLog, _ = nodesLogs
+    content = readBytes(nodesLog)
+    failed = {node for node, events in indexPostScriptEvents(nodesLog)['events'].items()
+              if any(value == '2' for _, value in events)}
+    # True only touches the failed nodes, with return value 2
+    assert set(adjustPostScriptExitStatus(True, nodesLog)) == failed
+    assert readBytes(nodesLog).count(b"(return value 2)") == 0
+    assert readBytes(nodesLog).count(b"(return value 0)") == content.count(b"(return value 0)")
+    # an explicit list changes both 0 and 2, only for those nodes
+    events = indexPostScriptEvents(nodesLog)['events']
+    succeeded = sorted(node for node in events if all(value == '0' for _, value in events[node]))[:3]
+    nEvents = sum(len(events[node]) for node in succeeded)
+    assert sorted(adjustPostScriptExitStatus(succeeded + ['9999'], nodesLog)) == \
+        sorted(node for node in succeeded for _ in events[node])
+    assert readBytes(nodesLog).count(b"(return value 0)") == content.count(b"(return value 0)") - nEvents
+    assert len(readBytes(nodesLog)) == len(content)
+
+
+def test_same_output_as_rewrite(nodesLogs):
+    nodesLog, oldNodesLog = nodesLogs
+    for resubmitJobIds in (['5', '10', '10-1', '11'], True, ['1', '2', '3', '20-1'], True):
+        assert sorted(adjustPostScriptExitStatus(resubmitJobIds, nodesLog)) == \
+            sorted(oldAdjustPostScriptExitStatus(resubmitJobIds, oldNodesLog))
+        assert readBytes(nodesLog) == readBytes(oldNodesLog)
+
+
+def test_partial_event(tmp_path):
+    nodesLog = str(tmp_path / 'RunJobs.dag.nodes.log')
+    complete = "...\n" + makeEvent(1, 2, True)
+    last = makeEvent(2, 2, True)
+    # DAGMan is still writing the event of node 2
+    writeFile(nodesLog, complete + last[:last.index("DAG Node")])
+    index = indexPostScriptEvents(nodesLog)
+    assert list(index['events']) == ['1']
+    # next time start again from the beginning of the event of node 2
+    assert index['scanned'] == len(complete) - len("...\n")
+    assert adjustPostScriptExitStatus(True, nodesLog) == ['1']
+
+    writeFile(nodesLog, last[last.index("DAG Node"):], mode='a')
+    index = indexPostScriptEvents(nodesLog)
+    assert sorted(index['events']) == ['1', '2']
+    assert index['events']['1'][0][1] == '1'
+    assert index['scanned'] == os.path.getsize(nodesLog) - len("...\n")
+    assert adjustPostScriptExitStatus(True, nodesLog) == ['2']
+    assert readBytes(nodesLog) == (complete + last).replace("(return value 2)", "(return value 1)").encode()
+
+
+def test_partial_line(tmp_path):
+    nodesLog = str(tmp_path / 'RunJobs.dag.nodes.log')
+    event = makeEvent(1, 2, False)
+    writeFile(nodesLog, "...\n" + event[:20])
+    index = indexPostScriptEvents(nodesLog)
+    assert index['events'] == {}
+    assert index['scanned'] == 0
+    saveIndex(nodesLog, index)
+    writeFile(nodesLog, event[20:], mode='a')
+    assert adjustPostScriptExitStatus(['1'], nodesLog) == ['1']
+
+
+@pytest.mark.parametrize("change", ["truncate", "replace"])
+def test_index_rebuilt(nodesLogs, change):
+    nodesLog, _ = nodesLogs
+    adjustPostScriptExitStatus(True, nodesLog)
+    assert os.path.exists(nodesLog + ".postindex")
+    content = "...\n" + makeEvent(777, 0, True)
+    if change == "truncate":
+        # same inode, but shorter than what was scanned
+        with open(nodesLog, 'r+', encoding='utf-8') as fd:
+            fd.truncate(0)
+            fd.write(content)
+    else:
+        # a new file, e.g. a new DAG
+        writeFile(nodesLog + ".new", content + makeNodesLog(random.Random(1)))
+        os.replace(nodesLog + ".new", nodesLog)
+    index = indexPostScriptEvents(nodesLog)
+    assert index['inode'] == os.stat(nodesLog).st_ino
+    assert index['events']['777'] == [[len(content) - len("    DAG Node: Job777\n...\n") - len("0)\n"), '0']]
+    assert adjustPostScriptExitStatus(['777'], nodesLog) == ['777']
+    assert readBytes(nodesLog).startswith(content.replace("(return value 0)", "(return value 1)").encode())
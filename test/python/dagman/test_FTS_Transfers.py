@@ -0,0 +1,105 @@
+"""
+unittest for the bulk update of the transfers state done by FTS_Transfers.state_manager,
+with a mocked fts3 client and CRAB REST
+"""
+import os
+import sys
+import json
+import importlib
+from unittest.mock import MagicMock
+
+import pytest
+
+TASK_PROCESS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../scripts/dagman/task_process')
+
+# transfer ids of each FTS job, and whether they succeeded
+JOBS = {
+    'job1': {'id1': True, 'id2': False, 'id3': True},
+    'job2': {'id4': False, 'id5': True},
+    'job3': {'id6': True, 'id7': False, 'id8': False, 'id9': True, 'id10': False, 'id12': False, 'id13': False,
+             'id14': False},
+    'job4': {'id11': True},
+}
+
+
+def jobStatus(ftsContext, jobid, list_files=False):  # pylint: disable=unused-argument
+    """ what fts3.get_job_status returns for the jobs in JOBS, all FINISHED """
+    status = {'job_state': 'FINISHED'}
+    if list_files:
+        status['files'] = [{'file_metadata': {'oracleId': _id},
+                            'file_state': 'FINISHED' if ok else 'FAILED',
+                            'source_surl': f"davs://source/{_id}",
+                            'reason': None if ok else f"error, for {_id}"}
+                           for _id, ok in JOBS[jobid].items()]
+    return status
+
+
+@pytest.fixture(name='fts')
+def fixture_fts(tmp_path, monkeypatch):
+    """ FTS_Transfers imported in a task_process directory with the jobs in JOBS, and a mocked fts3 """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('task_process/transfers')
+    with open('task_process/RestInfoForFileTransfers.json', 'w', encoding='utf-8') as fd:
+        json.dump({'proxyfile': 'proxy', 'host': 'cmsweb.cern.ch', 'dbInstance': 'dev'}, fd)
+    with open('task_process/transfers/fts_jobids.txt', 'w', encoding='utf-8') as fd:
+        fd.write(''.join(f"{jobid}\n" for jobid in JOBS))
+    for jobid, ids in JOBS.items():
+        with open(f"task_process/transfers/{jobid}.json", 'w', encoding='utf-8') as fd:
+            json.dump(list(ids), fd)
+
+    easy = MagicMock()
+    easy.get_job_status.side_effect = jobStatus
+    fts3 = MagicMock()
+    fts3.rest.client.easy = easy
+    for name, module in (('fts3', fts3), ('fts3.rest', fts3.rest), ('fts3.rest.client', fts3.rest.client),
+                         ('fts3.rest.client.easy', easy)):
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.syspath_prepend(TASK_PROCESS_DIR)
+    monkeypatch.delitem(sys.modules, 'FTS_Transfers', raising=False)
+    module = importlib.import_module('FTS_Transfers')
+    monkeypatch.setattr(module, 'remove_files_in_bkg', lambda pfns, logFile, timeout=None: None)
+    monkeypatch.setattr(module, 'encodeRequest', lambda data: data)
+    monkeypatch.setattr(module, 'MARK_TRANSFERS_CHUNK', 5)
+    yield module
+    sys.modules.pop('FTS_Transfers', None)
+
+
+def test_chunkJobs(fts):
+    idsPerJob = {jobid: len(ids) for jobid, ids in JOBS.items()}
+    assert list(fts.chunkJobs(list(JOBS), idsPerJob, 4)) == [['job1'], ['job2'], ['job3'], ['job4']]
+    assert list(fts.chunkJobs(list(JOBS), idsPerJob, 5)) == [['job1', 'job2'], ['job3'], ['job4']]
+    assert list(fts.chunkJobs(list(JOBS), idsPerJob, 6)) == [['job1', 'job2'], ['job3'], ['job4']]
+    assert list(fts.chunkJobs(list(JOBS), idsPerJob, 100)) == [list(JOBS)]
+    assert not list(fts.chunkJobs([], {}, 4))
+
+
+def test_state_manager(fts):
+    posts = []
+
+    def post(api, data):  # pylint: disable=unused-argument
+        posts.append(data)
+        # one of the updates of the failed transfers of job3 is refused
+        if 'id14' in data['list_of_ids']:
+            raise Exception("HTTP 500")  # pylint: disable=broad-exception-raised
+
+    crabserver = MagicMock()
+    crabserver.post.side_effect = post
+    jobsOngoing = fts.state_manager(MagicMock(), crabserver)
+
+    marked = {}
+    for data in posts:
+        assert len(data['list_of_ids']) <= 5
+        for i, _id in enumerate(data['list_of_ids']):
+            marked[_id] = data['list_of_transfer_state'][i]
+            if data['list_of_transfer_state'][i] == 'FAILED':
+                # failure reasons stay aligned with the ids
+                assert data['list_of_failure_reason'][i] == f"error. for {_id}"
+    assert marked == {_id: 'DONE' if ok else 'FAILED' for ids in JOBS.values() for _id, ok in ids.items()}
+    # the ids of several jobs are marked in one call, and a job with many ids in several calls
+    assert {'id1', 'id3', 'id5'} in [set(data['list_of_ids']) for data in posts]
+    assert {'id2', 'id4'} in [set(data['list_of_ids']) for data in posts]
+    assert len(posts) == 6
+    # only the job whose ids were not all marked is still monitored
+    assert jobsOngoing == ['job3']
+    with open('task_process/transfers/fts_jobids.txt', 'r', encoding='utf-8') as fd:
+        assert fd.read() == "job3\n"
@@ -0,0 +1,97 @@
+"""
+unittest for the in memory job report of cmscp.py, on a temporary jobReport.json
+"""
+import os
+import sys
+import copy
+import json
+import importlib
+
+import pytest
+
+JOB_WRAPPER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../scripts/job_wrapper')
+
+REPORT = {'exitCode': 0, 'exitMsg': 'OK',
+          'steps': {'cmsRun': {'output': {'out': [{'pfn': 'output.root', 'lfn': ''}]}}}}
+
+
+def readReport(name='jobReport.json'):
+    """ the job report on disk """
+    with open(name, 'r', encoding='utf-8') as fd:
+        return json.load(fd)
+
+
+@pytest.fixture(name='cmscp')
+def fixture_cmscp(tmp_path, monkeypatch):
+    """ cmscp imported in tmp_path with a JobReport for jobReport.json """
+    monkeypatch.chdir(tmp_path)
+    with open('jobReport.json', 'w', encoding='utf-8') as fd:
+        json.dump(REPORT, fd)
+    monkeypatch.syspath_prepend(JOB_WRAPPER_DIR)
+    monkeypatch.delitem(sys.modules, 'cmscp', raising=False)
+    module = importlib.import_module('cmscp')
+    monkeypatch.setattr(module, 'G_JOB_REPORT', module.JobReport('jobReport.json'))
+    yield module
+    sys.modules.pop('cmscp', None)
+
+
+def test_checkpoint_interval(cmscp):
+    report = cmscp.G_JOB_REPORT
+    assert cmscp.get_from_job_report('exitMsg') == 'OK'
+    assert cmscp.add_to_job_report([('exitAcronym', 'OK')])
+    assert cmscp.add_to_file_in_job_report('output_1.root', False, [('lfn', '/store/user/output.root')])
+    assert cmscp.add_to_job_report([('retries', 1)], mode='update')
+    # changes are only in memory until the checkpoint interval has passed
+    assert report.dirty
+    assert readReport() == REPORT
+    report.last_flush -= cmscp.G_JOB_REPORT_CHECKPOINT_INTERVAL
+    assert cmscp.add_to_job_report([('retries', 2)], mode='update')
+    assert not report.dirty
+    onDisk = readReport()
+    assert onDisk['exitAcronym'] == 'OK'
+    assert onDisk['retries'] == [1, 2]
+    assert onDisk['steps']['cmsRun']['output']['out'][0]['lfn'] == '/store/user/output.root'
+    # the next changes wait for the next checkpoint, or the final flush
+    assert cmscp.add_to_job_report([('exitCode', 60324)])
+    assert readReport()['exitCode'] == 0
+    report.flush()
+    assert readReport()['exitCode'] == 60324
+    assert readReport() == report.get()
+
+
+def test_atomic_flush(cmscp, monkeypatch):
+    report = cmscp.G_JOB_REPORT
+    assert cmscp.add_to_job_report([('exitCode', 60324)])
+    renames = []
+    realRename = os.rename
+
+    def rename(src, dst):
+        # the old report is in place until the new one is complete
+        assert readReport(dst) == REPORT
+        assert readReport(src) == report.get()
+        renames.append((src, dst))
+        realRename(src, dst)
+
+    monkeypatch.setattr(cmscp.os, 'rename', rename)
+    report.flush()
+    assert renames == [('jobReport.json.tmp', 'jobReport.json')]
+    assert sorted(os.listdir('.')) == ['jobReport.json', 'wmcore_initialized']
+    # nothing to write
+    report.flush()
+    assert len(renames) == 1
+
+
+def test_new_mode_refused(cmscp):
+    report = cmscp.G_JOB_REPORT
+    before = copy.deepcopy(report.get())
+    # exitCode is already in the report, none of the keys is added
+    assert not cmscp.add_to_job_report([('exitAcronym', 'OK'), ('exitCode', 1)], mode='new')
+    assert report.get() == before
+    assert not report.dirty
+    assert not cmscp.add_to_job_report([('exitCode', 1)], location=['steps', 'missing'])
+    assert not cmscp.add_to_job_report([('exitCode', 1)], mode='unknown')
+    assert not report.dirty
+    report.flush()
+    assert readReport() == REPORT
+    assert cmscp.add_to_job_report([('exitAcronym', 'OK')], mode='new')
+    assert report.dirty
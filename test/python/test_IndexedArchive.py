@@ -0,0 +1,120 @@
+"""
+unittest for IndexedArchive
+"""
+import io
+import json
+import random
+import tarfile
+
+import pytest
+
+from IndexedArchive import ArchiveReader, appendToArchive, readMember, readMembers, INDEX_LOAD_FACTOR, INDEX_RECORD
+
+NJOBS = 50000
+
+
+def jobMembers(jobIds, rng):
+    """ the lumis and input files of some jobs, as written by DagmanCreator """
+    members = []
+    for jobId in jobIds:
+        run = str(rng.randint(1, 400000))
+        first = rng.randint(1, 2000)
+        members.append((f"job_lumis_{jobId}.json", json.dumps({run: [[first, first + rng.randint(0, 50)]]})))
+        inputFiles = [f"/store/data/Run2024A/Muon/AOD/v1/000/{run}/{rng.randint(0, 99999):08d}.root"
+                      for _ in range(rng.randint(1, 5))]
+        members.append((f"job_input_file_list_{jobId}.txt", json.dumps(inputFiles)))
+    return members
+
+
+def makeTarball(path, members):
+    """ a tarball with one file per member, as used before the indexed archive """
+    with tarfile.open(path, 'w:gz') as tf:
+        for name, content in members:
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+def test_read_and_append(tmp_path):
+    archive = str(tmp_path / 'job_inputs.jsonl')
+    rng = random.Random(1)
+    probe = jobMembers(['0-1', '0-2'], rng)
+    appendToArchive(archive, probe)
+    processing = jobMembers(range(1, 101), rng)
+    appendToArchive(archive, processing)
+    # a tail stage which overrides a member
+    tail = jobMembers(['1-1', '1-2'], rng) + [('job_lumis_7.json', '{"1": [[1, 2]]}')]
+    appendToArchive(archive, tail)
+
+    expected = dict(probe + processing + tail)
+    with ArchiveReader(archive) as reader:
+        assert reader.nMembers == len(expected)
+        for name, content in expected.items():
+            assert reader.read(name) == content
+        assert len(list(reader.members())) == len(probe + processing + tail)
+        with pytest.raises(KeyError):
+            reader.read('job_lumis_101.json')
+    assert readMember(archive, 'job_lumis_7.json') == '{"1": [[1, 2]]}'
+    assert readMembers(archive, ['job_lumis_0-2.json', 'job_lumis_1-1.json']) == \
+        {name: expected[name] for name in ['job_lumis_0-2.json', 'job_lumis_1-1.json']}
+
+
+def test_legacy_tarball(tmp_path):
+    archive = str(tmp_path / 'job_inputs.jsonl')
+    tarball = str(tmp_path / 'run_and_lumis.tar.gz')
+    members = jobMembers(range(1, 11), random.Random(2))
+    makeTarball(tarball, members)
+    expected = dict(members)
+    assert readMember(archive, 'job_lumis_3.json', legacyTarball=tarball) == expected['job_lumis_3.json']
+    with pytest.raises(KeyError):
+        readMembers(archive, ['job_lumis_3.json', 'job_lumis_11.json'], legacyTarball=tarball)
+    # once the archive exists the tarball is ignored
+    appendToArchive(archive, [('job_lumis_3.json', '{}')])
+    assert readMember(archive, 'job_lumis_3.json', legacyTarball=tarball) == '{}'
+
+
+class CountingFile():
+    """ wraps a file object, counts read calls and bytes read """
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.reads = 0
+        self.bytes = 0
+
+    def seek(self, *args):
+        return self.fobj.seek(*args)
+
+    def read(self, *args):
+        data = self.fobj.read(*args)
+        self.reads += 1
+        self.bytes += len(data)
+        return data
+
+    def close(self):
+        self.fobj.close()
+
+
+def test_lookup_50k_jobs(tmp_path):
+    archive = str(tmp_path / 'job_inputs.jsonl')
+    rng = random.Random(3)
+    members = jobMembers(range(1, NJOBS + 1), rng)
+    appendToArchive(archive, members)
+    tail = jobMembers([f"1-{i}" for i in range(1, 1001)], rng)
+    appendToArchive(archive, tail)
+    expected = dict(members + tail)
+
+    names = [f"job_input_file_list_{jobId}.txt" for jobId in rng.sample(range(1, NJOBS + 1), 1000)]
+    names += [f"job_lumis_1-{i}.json" for i in rng.sample(range(1, 1001), 100)]
+    with ArchiveReader(archive) as reader:
+        assert reader.nMembers == len(expected)
+        assert reader.nMembers / reader.nSlots <= INDEX_LOAD_FACTOR
+        reader.index = CountingFile(reader.index)
+        reader.data = CountingFile(reader.data)
+        for name in names:
+            assert reader.read(name) == expected[name]
+        # a lookup reads a few index records and only the line of the member from the data file
+        assert reader.data.reads == len(names)
+        assert reader.data.bytes < 1000 * len(names)
+        assert reader.index.reads / len(names) < 3
+        assert reader.index.bytes == reader.index.reads * INDEX_RECORD.size
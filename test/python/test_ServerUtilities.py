@@ -0,0 +1,41 @@
+"""
+unittest for ServerUtilities
+"""
+from ServerUtilities import readNewLines, findLineOffset
+
+
+def writeLines(path, content, mode='w'):
+    """ write or append to a text file """
+    with open(path, mode, encoding='utf-8') as fd:
+        fd.write(content)
+
+
+def test_readNewLines(tmp_path):
+    path = str(tmp_path / 'transfers.txt')
+    lines = ['{"id": "1"}\n', '{"id": "é"}\n', '{"id": "3"}\n']
+    # the last line is still being written
+    writeLines(path, ''.join(lines) + '{"id": ')
+    read = list(readNewLines(path))
+    assert [line for line, _ in read] == lines
+    # offsets are in bytes, also with non ASCII characters
+    assert [offset for _, offset in read] == [12, 25, 37]
+    assert read[-1][1] == len(''.join(lines).encode('utf-8'))
+    assert list(readNewLines(path, read[0][1])) == read[1:]
+    # the partial line is read next time, once completed
+    assert not list(readNewLines(path, read[-1][1]))
+    writeLines(path, '"4"}\n{"id": "5"}\n', mode='a')
+    assert list(readNewLines(path, read[-1][1])) == [('{"id": "4"}\n', 49), ('{"id": "5"}\n', 61)]
+
+
+def test_findLineOffset(tmp_path):
+    path = str(tmp_path / 'transfers.txt')
+    writeLines(path, '{"id": "1"}\n{"id": "é"}\n{"id": "3"}\n{"id": ')
+    assert findLineOffset(path, 0) == 0
+    assert findLineOffset(path, 1) == 12
+    assert findLineOffset(path, 2) == 25
+    assert findLineOffset(path, 3) == 37
+    # more lines than in the file, e.g. when the last one is not complete yet
+    assert findLineOffset(path, 4) == 37
+    for lineNumber in range(4):
+        assert list(readNewLines(path, findLineOffset(path, lineNumber))) == \
+            list(readNewLines(path))[lineNumber:]